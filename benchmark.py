@@ -0,0 +1,750 @@
+import os
+import gc
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import itertools
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Нагрузочный тест бота целиком: настоящие обработчики main.py, заглушки TMDB и Telegram Bot API
+# на локальных HTTP серверах и тысячи пользователей, которые ищут, подбирают и листают фильмы.
+# Результат - JSON (пропускная способность, перцентили задержек, число запросов к TMDB и Bot API,
+# память на пользователя), который можно сравнивать между версиями:
+#     python benchmark.py --users 2000 --tmdb-latency 0.08 --output bench.json
+# Переменные окружения бота задаются здесь, до импорта его модулей, поэтому .env не влияет на результат.
+
+logger = logging.getLogger('benchmark')
+
+BOT_TOKEN = '123456:benchmark'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+PAGE_SIZE = 20
+MAX_PAGES = 500
+WEBHOOK_PATH = 'telegram'
+WEBHOOK_SECRET = 'benchmark-secret'
+
+# Жанры TMDB (ru-RU)
+GENRES = [
+    (28, 'боевик'), (12, 'приключения'), (16, 'мультфильм'), (35, 'комедия'), (80, 'криминал'),
+    (99, 'документальный'), (18, 'драма'), (10751, 'семейный'), (14, 'фэнтези'), (36, 'история'),
+    (27, 'ужасы'), (10402, 'музыка'), (9648, 'детектив'), (10749, 'мелодрама'), (878, 'фантастика'),
+    (10770, 'телевизионный фильм'), (53, 'триллер'), (10752, 'военный'), (37, 'вестерн'),
+]
+TITLE_WORDS = [
+    'Тень', 'Город', 'Ночь', 'Звезда', 'Путь', 'Река', 'Огонь', 'Море', 'Ветер', 'Дом', 'Остров', 'Зима',
+    'Волк', 'Сердце', 'Мост', 'Король', 'Дорога', 'Сон', 'Небо', 'Пламя', 'Граница', 'Охота', 'Тайна', 'Время',
+]
+ORIGINAL_WORDS = [
+    'Shadow', 'City', 'Night', 'Star', 'Path', 'River', 'Fire', 'Sea', 'Wind', 'House', 'Island', 'Winter',
+    'Wolf', 'Heart', 'Bridge', 'King', 'Road', 'Dream', 'Sky', 'Flame', 'Border', 'Hunt', 'Secret', 'Time',
+]
+PEOPLE = ['Иван Петров', 'Анна Смирнова', 'John Smith', 'Maria Garcia', 'Li Wei', 'Olga Ivanova', 'Tom Brown', 'Sara Khan']
+
+
+# --- Данные заглушки TMDB ---
+
+class MovieFixtures:
+    """Детерминированный набор фильмов с полями, как в ответах TMDB, и готовые списки для эндпоинтов."""
+
+    def __init__(self, count, seed):
+        rng = random.Random(seed)
+        self.movies = []
+        for movie_id in range(1, count + 1):
+            word, other = rng.randrange(len(TITLE_WORDS)), rng.randrange(len(TITLE_WORDS))
+            year = rng.randint(1960, 2026)
+            self.movies.append({
+                'adult': False,
+                'backdrop_path': f"/b{movie_id}.jpg",
+                'genre_ids': rng.sample([g for g, _ in GENRES], rng.randint(1, 3)),
+                'id': movie_id,
+                'original_language': rng.choice(['en', 'ru', 'fr', 'ja']),
+                'original_title': f"{ORIGINAL_WORDS[word]} {ORIGINAL_WORDS[other]} {movie_id % 7 or ''}".strip(),
+                'overview': f"{TITLE_WORDS[word]} и {TITLE_WORDS[other].lower()}: история фильма {movie_id}. " * 4,
+                'popularity': round(rng.lognormvariate(2.5, 1.2), 3),
+                'poster_path': f"/p{movie_id}.jpg" if rng.random() > 0.05 else None,
+                'release_date': f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                'title': f"{TITLE_WORDS[word]} {TITLE_WORDS[other].lower()} {movie_id % 7 or ''}".strip(),
+                'video': False,
+                'vote_average': round(rng.uniform(4.0, 9.0), 1),
+                'vote_count': int(rng.lognormvariate(6.5, 1.5)),
+            })
+        self.by_id = {movie['id']: movie for movie in self.movies}
+        latest = max(int(m['release_date'][:4]) for m in self.movies)
+        self.charts = {
+            'popular': sorted(self.movies, key=lambda m: -m['popularity']),
+            'top_rated': sorted((m for m in self.movies if m['vote_count'] >= 300), key=lambda m: -m['vote_average']),
+            'upcoming': sorted((m for m in self.movies if int(m['release_date'][:4]) >= latest - 1), key=lambda m: m['release_date']),
+        }
+        self._search_cache = {}
+        self._lock = threading.Lock()
+
+    def search(self, query):
+        words = query.casefold().split()
+        with self._lock:
+            found = self._search_cache.get(query)
+        if found is None:
+            found = [m for m in self.movies
+                     if all(w in m['title'].casefold() or w in m['original_title'].casefold() for w in words)]
+            found.sort(key=lambda m: -m['popularity'])
+            with self._lock:
+                self._search_cache[query] = found
+        return found
+
+    def discover(self, params):
+        genre = int(params['with_genres']) if params.get('with_genres') else None
+        year = params.get('primary_release_year')
+        rating = float(params.get('vote_average.gte', 0))
+        votes = int(params.get('vote_count.gte', 0))
+        found = [m for m in self.movies
+                 if (genre is None or genre in m['genre_ids'])
+                 and (not year or m['release_date'].startswith(year))
+                 and m['vote_average'] >= rating and m['vote_count'] >= votes]
+        found.sort(key=lambda m: -m['popularity'])
+        return found
+
+    def details(self, movie_id, append):
+        movie = self.by_id.get(movie_id)
+        if movie is None:
+            return None
+        names = dict(GENRES)
+        data = {key: value for key, value in movie.items() if key != 'genre_ids'}
+        data.update({
+            'genres': [{'id': g, 'name': names[g]} for g in movie['genre_ids']],
+            'runtime': 80 + movie_id % 90,
+            'tagline': 'Слоган фильма',
+            'budget': movie_id * 1000,
+            'status': 'Released',
+        })
+        if 'credits' in append:
+            data['credits'] = {
+                'cast': [{'id': i, 'name': PEOPLE[(movie_id + i) % len(PEOPLE)], 'character': f"Роль {i}", 'order': i} for i in range(30)],
+                'crew': [{'id': 100 + i, 'name': PEOPLE[(movie_id * 3 + i) % len(PEOPLE)], 'job': 'Director' if i == 0 else 'Writer'} for i in range(15)],
+            }
+        return data
+
+
+def _page(movies, page):
+    start = (page - 1) * PAGE_SIZE
+    results = [{**movie} for movie in movies[start:start + PAGE_SIZE]]
+    return {
+        'page': page,
+        'results': results,
+        'total_pages': min(max((len(movies) + PAGE_SIZE - 1) // PAGE_SIZE, 1), MAX_PAGES),
+        'total_results': len(movies),
+    }
+
+
+# --- HTTP заглушки ---
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, как у настоящих серверов
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeServer:
+    """Локальный HTTP сервер в отдельном потоке (потоки не делят цикл событий с ботом)."""
+
+    def __init__(self, handler_class):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _TMDBHandler(QuietHandler):
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = url.path[len('/3'):] if url.path.startswith('/3/') else url.path
+        parts = path.strip('/').split('/')
+        endpoint = '/movie/{id}' if len(parts) == 2 and parts[0] == 'movie' and parts[1].isdigit() else path
+        fake.count(endpoint)
+        if fake.latency:
+            time.sleep(fake.latency * fake.rng.uniform(0.5, 1.5))
+        if fake.error_rate and fake.rng.random() < fake.error_rate:
+            fake.count('errors')
+            if fake.rng.random() < 0.5:
+                return self._send_json(429, {'status_code': 25, 'status_message': 'Too many requests'}, {'Retry-After': '1'})
+            return self._send_json(503, {'status_code': 11, 'status_message': 'Service unavailable'})
+
+        fixtures = fake.fixtures
+        page = int(params.get('page', 1))
+        if path == '/configuration':
+            payload = {'images': {'secure_base_url': 'https://image.tmdb.org/t/p/',
+                                  'poster_sizes': ['w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original']}}
+        elif path == '/genre/movie/list':
+            payload = {'genres': [{'id': g, 'name': name} for g, name in GENRES]}
+        elif path == '/search/movie':
+            payload = _page(fixtures.search(params.get('query', '')), page)
+        elif path == '/discover/movie':
+            payload = _page(fixtures.discover(params), page)
+        elif len(parts) == 2 and parts[0] == 'movie' and parts[1] in fixtures.charts:
+            payload = _page(fixtures.charts[parts[1]], page)
+        elif endpoint == '/movie/{id}':
+            payload = fixtures.details(int(parts[1]), params.get('append_to_response', ''))
+            if payload is None:
+                return self._send_json(404, {'status_code': 34, 'status_message': 'Not found'})
+        else:
+            return self._send_json(404, {'status_code': 34, 'status_message': 'Not found'})
+        self._send_json(200, payload)
+
+
+class FakeTMDB(FakeServer):
+    """Заглушка TMDB с настраиваемой задержкой и долей ошибок (429/503)."""
+
+    def __init__(self, fixtures, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(_TMDBHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+
+def _parse_body(handler):
+    length = int(handler.headers.get('Content-Length') or 0)
+    body = handler.rfile.read(length) if length else b''
+    content_type = handler.headers.get('Content-Type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        return {part.get_param('name', header='content-disposition'): part.get_content()
+                for part in message.iter_parts()}
+    return {key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+
+class _TelegramHandler(QuietHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        method = self.path.rsplit('/', 1)[-1]
+        params = _parse_body(self)
+        fake.count(method)
+        if fake.latency:
+            time.sleep(fake.latency * fake.rng.uniform(0.5, 1.5))
+        self._send_json(200, {'ok': True, 'result': fake.handle(method, params)})
+
+    do_GET = do_POST
+
+
+class FakeTelegram(FakeServer):
+    """
+    Заглушка Bot API. Запоминает последнее сообщение с inline клавиатурой в каждом чате,
+    чтобы пользователи могли нажимать кнопки, которые им на самом деле отправил бот.
+    """
+
+    def __init__(self, latency=0.0, seed=0):
+        super().__init__(_TelegramHandler)
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.message_ids = itertools.count(1_000_000)
+        self.keyboards = {} # chat_id -> (message_id, с фото ли сообщение, inline клавиатура)
+        self.on_message = None # Вызывается (из потока сервера) при отправке или изменении сообщения в чате
+
+    def _message(self, chat_id, message_id, photo=None, text=None):
+        message = {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                   'chat': {'id': chat_id, 'type': 'private', 'first_name': 'U'}}
+        if photo:
+            message['photo'] = [{'file_id': f"file-{abs(hash(photo))}", 'file_unique_id': f"u{abs(hash(photo))}", 'width': 500, 'height': 750}]
+        else:
+            message['text'] = text or ''
+        return message
+
+    def _remember(self, chat_id, message_id, is_photo, reply_markup):
+        markup = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+        with self.lock:
+            if markup and 'inline_keyboard' in markup:
+                self.keyboards[chat_id] = (message_id, is_photo, markup['inline_keyboard'])
+            elif self.keyboards.get(chat_id, (None,))[0] == message_id:
+                del self.keyboards[chat_id] # Изменение без клавиатуры убирает ее
+        if self.on_message is not None:
+            self.on_message(chat_id)
+
+    def keyboard(self, chat_id):
+        with self.lock:
+            return self.keyboards.get(chat_id)
+
+    def handle(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        if method in ('sendMessage', 'sendPhoto'):
+            message_id = next(self.message_ids)
+            photo = params.get('photo') if method == 'sendPhoto' else None
+            self._remember(chat_id, message_id, bool(photo), params.get('reply_markup'))
+            return self._message(chat_id, message_id, photo, params.get('text'))
+        if method in ('editMessageText', 'editMessageMedia', 'editMessageCaption', 'editMessageReplyMarkup'):
+            message_id = int(params['message_id'])
+            media = params.get('media')
+            media = json.loads(media) if isinstance(media, str) else media
+            photo = media.get('media') if media else None
+            is_photo = bool(photo) if method == 'editMessageMedia' else method != 'editMessageText'
+            self._remember(chat_id, message_id, is_photo, params.get('reply_markup'))
+            return self._message(chat_id, message_id, photo, params.get('text'))
+        return True # answerCallbackQuery, deleteMessage, answerInlineQuery и т.п.
+
+
+# --- Пользователи ---
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples = {} # вид действия -> список задержек (сек.)
+
+    def add(self, kind, seconds):
+        self.samples.setdefault(kind, []).append(seconds)
+
+    @staticmethod
+    def summarize(values):
+        values = sorted(values)
+        if not values:
+            return {'count': 0}
+        def pick(q):
+            return round(values[min(int(round(q * (len(values) - 1))), len(values) - 1)] * 1000, 2)
+        return {'count': len(values), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+                'max_ms': round(values[-1] * 1000, 2), 'mean_ms': round(sum(values) / len(values) * 1000, 2)}
+
+    def report(self):
+        report = {kind: self.summarize(values) for kind, values in sorted(self.samples.items())}
+        report['all'] = self.summarize([v for kind, values in self.samples.items() if kind != 'render' for v in values])
+        return report
+
+
+class WebhookSender:
+    """
+    Отправляет обновления во встроенный webhook сервер бота (--webhook) так же, как Telegram:
+    POST с JSON обновления и секретным токеном в заголовке, не больше max_connections соединений сразу.
+    """
+
+    def __init__(self, url, secret, max_connections):
+        import httpx
+        self.url = url
+        self.secret = secret
+        self.client = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=max_connections))
+        self.accepted = 0
+        self.rejected = {} # HTTP статус -> число обновлений
+        self.errors = 0
+        self.checks = {}
+
+    async def _post(self, url, payload, secret):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        response = await self.client.post(url, json=payload, headers=headers)
+        return response.status_code
+
+    async def check(self):
+        """Проверяет, что сервер отклоняет запросы без верного токена и по чужому пути (обновления не обрабатываются)."""
+        payload = {'update_id': 0}
+        self.checks = {
+            'wrong_secret': await self._post(self.url, payload, self.secret + '-wrong'),
+            'no_secret': await self._post(self.url, payload, None),
+            'wrong_path': await self._post(self.url + '-wrong', payload, self.secret),
+        }
+        self.checks['ok'] = self.checks['wrong_secret'] == 403 and self.checks['no_secret'] == 403 and self.checks['wrong_path'] == 404
+        if not self.checks['ok']:
+            logger.error(f"Webhook сервер принял запрос, который должен был отклонить: {self.checks}")
+
+    async def post(self, payload):
+        """Отправляет обновление. Возвращает False, если сервер его не принял."""
+        import httpx
+        try:
+            status = await self._post(self.url, payload, self.secret)
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка отправки обновления на webhook: {e!r}")
+            self.errors += 1
+            return False
+        if status != 200:
+            self.rejected[status] = self.rejected.get(status, 0) + 1
+            return False
+        self.accepted += 1
+        return True
+
+    def get_stats(self):
+        return {'accepted': self.accepted, 'rejected': self.rejected, 'errors': self.errors, 'checks': self.checks}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def free_port():
+    """Свободный локальный порт для webhook сервера бота."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def start_webhook(application):
+    """
+    Запускает прием обновлений через webhook с настройками main.webhook_settings() (см. configure_environment)
+    и возвращает WebhookSender для отправки обновлений на него.
+    """
+    import main
+    settings = main.webhook_settings()
+    await application.updater.start_webhook(**settings)
+    sender = WebhookSender(settings['webhook_url'], settings['secret_token'], settings['max_connections'])
+    await sender.check()
+    return sender
+
+
+class LoadDriver:
+    """
+    Передает обновления в Application и ждет окончания их обработки.
+    С webhook (WebhookSender) обновления идут через HTTP сервер бота, иначе - прямо в очередь Application.
+    """
+
+    def __init__(self, application, processor, telegram, timeout, webhook=None):
+        self.application = application
+        self.processor = processor
+        self.telegram = telegram
+        self.timeout = timeout
+        self.webhook = webhook
+        self.latency = LatencyRecorder()
+        self.update_ids = itertools.count(1)
+        self.user_message_ids = itertools.count(1)
+        self.sent = 0
+        self.timeouts = 0
+        self.render_timeouts = 0
+        self._render_waiters = {} # chat_id -> future следующего сообщения бота в чате
+        self._loop = asyncio.get_running_loop()
+        telegram.on_message = lambda chat_id: self._loop.call_soon_threadsafe(self._message_arrived, chat_id)
+
+    def _message_arrived(self, chat_id):
+        future = self._render_waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'U', 'language_code': 'ru'}
+
+    def text_update(self, user_id, text):
+        message = {'message_id': next(self.user_message_ids), 'date': int(time.time()), 'text': text,
+                   'chat': {'id': user_id, 'type': 'private', 'first_name': 'U'}, 'from': self._user(user_id)}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self.update_ids), 'message': message}
+
+    def callback_update(self, user_id, message_id, is_photo, data):
+        message = self.telegram._message(user_id, message_id, 'poster' if is_photo else None, 'карточка')
+        return {'update_id': next(self.update_ids), 'callback_query': {
+            'id': str(next(self.update_ids)), 'from': self._user(user_id), 'chat_instance': str(user_id),
+            'data': data, 'message': message}}
+
+    async def send(self, kind, payload):
+        """Отправляет обновление и ждет окончания обработки. Возвращает False по таймауту."""
+        from telegram import Update
+        done = self._loop.create_future()
+        self.processor.waiters[payload['update_id']] = done
+        started = time.perf_counter()
+        self.sent += 1
+        if self.webhook is None:
+            await self.application.update_queue.put(Update.de_json(payload, self.application.bot))
+        elif not await self.webhook.post(payload):
+            self.processor.waiters.pop(payload['update_id'], None)
+            return False
+        try:
+            finished = await asyncio.wait_for(done, self.timeout)
+        except asyncio.TimeoutError:
+            self.processor.waiters.pop(payload['update_id'], None)
+            self.timeouts += 1
+            return False
+        self.latency.add(kind, finished - started)
+        return True
+
+    async def click(self, user_id, kind, choose):
+        """Нажимает кнопку последней inline клавиатуры в чате (choose выбирает callback_data)."""
+        keyboard = self.telegram.keyboard(user_id)
+        if keyboard is None:
+            return False
+        message_id, is_photo, rows = keyboard
+        data = choose([button['callback_data'] for row in rows for button in row if 'callback_data' in button])
+        if data is None:
+            return False
+        return await self.send(kind, self.callback_update(user_id, message_id, is_photo, data))
+
+    async def paginate(self, user_id):
+        """Нажимает "След." и ждет, пока бот перерисует карточку (перерисовка идет после ответа обработчика)."""
+        keyboard = self.telegram.keyboard(user_id)
+        if keyboard is None:
+            return False
+        message_id, is_photo, rows = keyboard
+        buttons = [button for row in rows for button in row if button.get('callback_data', '').startswith('pg:')]
+        if not buttons:
+            return False
+        rendered = self._render_waiters[user_id] = self._loop.create_future()
+        started = time.perf_counter()
+        if not await self.send('pagination', self.callback_update(user_id, message_id, is_photo, buttons[-1]['callback_data'])):
+            return False
+        try:
+            self.latency.add('render', await asyncio.wait_for(rendered, self.timeout) - started)
+        except asyncio.TimeoutError:
+            self.render_timeouts += 1
+            return False
+        return True
+
+
+async def simulate_user(driver, user_id, rng, args):
+    """Один пользователь: поиск, подбор или список фильмов, затем несколько страниц."""
+    async def think():
+        if args.think_time:
+            await asyncio.sleep(args.think_time * rng.uniform(0.5, 1.5))
+
+    scenario = rng.choices(['search', 'discover', 'chart'], weights=args.mix)[0]
+    if scenario == 'search':
+        words = rng.sample(TITLE_WORDS, rng.choice([1, 1, 2]))
+        ok = await driver.send('search', driver.text_update(user_id, f"/search {' '.join(w.lower() for w in words)}"))
+    elif scenario == 'discover':
+        ok = await driver.send('discover_start', driver.text_update(user_id, '/discover'))
+        await think()
+        ok = ok and await driver.click(user_id, 'discover_genre', lambda data: rng.choice([d for d in data if d.startswith('genre_')] or [None]))
+        await think()
+        year = 'пропустить' if rng.random() < 0.3 else str(rng.randint(1980, 2025))
+        ok = ok and await driver.send('discover_year', driver.text_update(user_id, year))
+        await think()
+        ok = ok and await driver.click(user_id, 'discover_rating', lambda data: rng.choice([d for d in data if d.startswith('rating_')] or [None]))
+    else:
+        ok = await driver.send('chart', driver.text_update(user_id, rng.choice(['/popular', '/toprated', '/upcoming'])))
+    for _ in range(args.pages if ok else 0):
+        await think()
+        if not await driver.paginate(user_id):
+            break
+
+
+# --- Обработка обновлений с замером ---
+
+def make_processor_class():
+    from update_processor import ChatOrderedUpdateProcessor
+
+    class TimedUpdateProcessor(ChatOrderedUpdateProcessor):
+        """Сообщает нагрузочному тесту об окончании обработки каждого обновления."""
+
+        def __init__(self):
+            super().__init__()
+            self.waiters = {} # update_id -> future
+
+        async def run_update(self, update, coroutine):
+            try:
+                await coroutine
+            finally:
+                future = self.waiters.pop(getattr(update, 'update_id', None), None)
+                if future is not None and not future.done():
+                    future.set_result(time.perf_counter())
+
+    return TimedUpdateProcessor
+
+
+def rss_bytes():
+    """Текущий объем резидентной памяти процесса (Linux) или пиковый (остальные системы)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def configure_environment(args, workdir, tmdb_url, telegram_url):
+    """Настройки бота для теста: заглушки вместо настоящих API, файлы состояния во временном каталоге."""
+    os.environ.update({
+        'TMDB_API_KEY': 'benchmark',
+        'TMDB_BASE_URL': f"{tmdb_url}/3",
+        'TELEGRAM_BASE_URL': telegram_url,
+        'BOT_STATE_FILE': os.path.join(workdir, 'bot_state.sqlite3'),
+        'POSTER_CACHE_FILE': os.path.join(workdir, 'poster_file_ids.json'),
+        'TITLE_INDEX_SNAPSHOT': os.path.join(workdir, 'title_index.pickle'),
+        'DISCOVER_CATALOG_FILE': os.path.join(workdir, 'discover_catalog.pickle'),
+        'TITLE_INDEX_EXPORT': '',
+        'TMDB_DISK_CACHE': '',
+        'SHARED_CACHE': '',
+        'BOT_WORKERS': '1',
+        'TRAFFIC_RECORD_FILE': '',
+    })
+    if getattr(args, 'webhook', False):
+        # Webhook сервер бота на локальном порту; setWebhook получает заглушка Bot API
+        port = free_port()
+        os.environ.update({
+            'WEBHOOK_URL': f"http://127.0.0.1:{port}",
+            'WEBHOOK_LISTEN': '127.0.0.1',
+            'WEBHOOK_PORT': str(port),
+            'WEBHOOK_PATH': WEBHOOK_PATH,
+            'WEBHOOK_SECRET_TOKEN': WEBHOOK_SECRET,
+        })
+    if not args.real_limits:
+        # По умолчанию измеряется сам бот, а не общие лимиты API (лимиты отдельных чатов остаются)
+        os.environ.update({'TMDB_RATE_LIMIT': '100000', 'TMDB_RATE_BURST': '100000', 'TELEGRAM_RATE_LIMIT': '100000'})
+
+
+async def run_benchmark(args):
+    fixtures = MovieFixtures(args.movies, args.seed)
+    tmdb = FakeTMDB(fixtures, args.tmdb_latency, args.tmdb_error_rate, args.seed)
+    telegram = FakeTelegram(args.telegram_latency, args.seed)
+    tmdb.start()
+    telegram.start()
+    workdir = tempfile.mkdtemp(prefix='tmdb-bot-benchmark-')
+    configure_environment(args, workdir, tmdb.url, telegram.url)
+
+    # Модули бота читают настройки при импорте
+    import main
+    import tmdb_api
+    import rate_limit
+    import bot_logic
+    import movie_store
+    import discover_catalog
+    logging.getLogger().setLevel(args.log_level)
+
+    processor = make_processor_class()()
+    application = main.build_application(BOT_TOKEN, updater=args.webhook, update_processor=processor)
+    errors = []
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+    application.add_error_handler(on_error)
+
+    warmup_started = time.perf_counter()
+    await application.initialize()
+    await main.post_init(application, primary=False) # Без фоновых обновлений кэшей во время замера
+    if args.discover_catalog:
+        await discover_catalog.refresh_job(None)
+    webhook = await start_webhook(application) if args.webhook else None
+    await application.start()
+    warmup = {'seconds': round(time.perf_counter() - warmup_started, 3),
+              'tmdb_requests': tmdb.reset_counts(), 'telegram_requests': telegram.reset_counts()}
+    rate_limit.tmdb_limiter.reset_stats() # Задержки в очередях - только за время замера
+    application.bot.rate_limiter.reset_stats()
+
+    driver = LoadDriver(application, processor, telegram, args.timeout, webhook)
+    gc.collect()
+    rss_before = rss_bytes()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+
+    async def delayed_user(user_id):
+        await asyncio.sleep(rng.uniform(0, args.ramp))
+        await simulate_user(driver, user_id, random.Random(rng.random()), args)
+
+    await asyncio.gather(*(delayed_user(10_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    rss_after = rss_bytes()
+
+    tmdb_counts = tmdb.reset_counts()
+    tmdb_errors = tmdb_counts.pop('errors', 0)
+    telegram_counts = telegram.reset_counts()
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'log_level')},
+        'warmup': warmup,
+        'duration_s': round(elapsed, 3),
+        'updates': driver.sent,
+        'throughput_updates_per_s': round(driver.sent / elapsed, 2) if elapsed else None,
+        'latency': driver.latency.report(),
+        'timeouts': {'handler': driver.timeouts, 'render': driver.render_timeouts},
+        'handler_errors': len(errors),
+        'upstream': {
+            'tmdb': {'total': sum(tmdb_counts.values()), 'injected_errors': tmdb_errors, 'by_endpoint': tmdb_counts},
+            'telegram': {'total': sum(telegram_counts.values()), 'by_method': telegram_counts},
+        },
+        'memory': {
+            'rss_before_bytes': rss_before,
+            'rss_after_bytes': rss_after,
+            'per_user_bytes': round((rss_after - rss_before) / args.users) if args.users else None,
+            'users_with_data': len(application.user_data),
+        },
+        'bot': {
+            'tmdb_cache': tmdb_api.get_cache_stats(),
+            'tmdb_pool': tmdb_api.get_pool_stats(),
+            'movie_store': movie_store.stats(),
+            'pagination': bot_logic.get_pagination_stats(),
+            'updates': processor.get_stats(),
+            'rate_limits': {'tmdb': rate_limit.tmdb_limiter.get_stats(),
+                            'telegram': application.bot.rate_limiter.get_stats()},
+        },
+    }
+    if webhook is not None:
+        report['webhook'] = webhook.get_stats()
+        await webhook.close()
+        await application.updater.stop()
+    if errors:
+        report['handler_error_samples'] = sorted(set(errors))[:5]
+
+    await application.stop()
+    await main.post_shutdown(application, primary=False)
+    await application.shutdown()
+    tmdb.stop()
+    telegram.stop()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушками TMDB и Telegram Bot API.")
+    parser.add_argument('--users', type=int, default=1000, help="Число пользователей")
+    parser.add_argument('--ramp', type=float, default=5.0, help="За сколько секунд подключаются все пользователи")
+    parser.add_argument('--pages', type=int, default=3, help="Сколько раз каждый пользователь нажимает \"След.\"")
+    parser.add_argument('--think-time', type=float, default=0.5, help="Средняя пауза пользователя между действиями, сек.")
+    parser.add_argument('--mix', type=float, nargs=3, default=[0.5, 0.25, 0.25], metavar=('SEARCH', 'DISCOVER', 'CHART'),
+                        help="Доли сценариев: поиск, подбор, списки")
+    parser.add_argument('--movies', type=int, default=5000, help="Число фильмов в данных заглушки TMDB")
+    parser.add_argument('--tmdb-latency', type=float, default=0.05, help="Средняя задержка ответа TMDB, сек.")
+    parser.add_argument('--tmdb-error-rate', type=float, default=0.0, help="Доля ответов TMDB с ошибкой 429/503")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="Средняя задержка ответа Bot API, сек.")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Сколько ждать обработки одного обновления, сек.")
+    parser.add_argument('--discover-catalog', action='store_true', help="Загрузить каталог для подбора до начала замера")
+    parser.add_argument('--real-limits', action='store_true', help="Не поднимать общие лимиты запросов к TMDB и Telegram")
+    parser.add_argument('--webhook', action='store_true', help="Отправлять обновления POST запросами на webhook сервер бота")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Файл для JSON отчета (по умолчанию - только stdout)")
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run_benchmark(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
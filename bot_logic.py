@@ -1,7 +1,15 @@
 import logging
 import html  # Import the html module for escaping
+import re
+import math
+import time
 import asyncio # Import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto
+import contextlib
+from collections import OrderedDict
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto,
+    InlineQueryResultArticle, InputTextMessageContent, LinkPreviewOptions,
+)
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, RetryAfter # Import errors
 from telegram.ext import (
@@ -10,9 +18,17 @@ from telegram.ext import (
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     filters,
 )
 import tmdb_api # Import our API module
+import movie_store
+import poster_cache
+import rate_limit
+import pagination_codec
+import title_index
+import discover_catalog
+from update_processor import ChatOrderedUpdateProcessor, ordering_key
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -21,15 +37,21 @@ logger = logging.getLogger(__name__)
 # --- Глобальные переменные и константы ---
 # Кэш для жанров и конфигурации API для избежания частых запросов
 GENRES_CACHE = {}
+GENRE_NAMES = {} # ID жанра -> название (для карточек из списков, где есть только genre_ids)
 API_CONFIG_CACHE = {}
+API_CONFIG_VERSION = 0 # Увеличивается при каждом обновлении конфигурации (для кэша карточек)
 # Состояния диалога для команды /discover
 (ASK_GENRE, ASK_YEAR, ASK_RATING, SHOW_DISCOVERY_RESULTS) = range(4) # Для /discover
-ASK_SEARCH_QUERY = range(4, 5) # Для поиска по кнопке
+ASK_SEARCH_QUERY = 4 # Для поиска по кнопке (int, чтобы состояние можно было сохранить)
 
 # Ключи пользовательских данных
 DISCOVERY_CRITERIA = 'discovery_criteria'
-PAGINATED_RESULTS = 'paginated_results'
-CURRENT_INDEX = 'current_index'
+
+# Пагинация по страницам TMDB (позиция хранится в самих кнопках, см. pagination_codec.py)
+PREFETCH_DISTANCE = 5 # За сколько фильмов до конца страницы подгружать следующую
+MAX_EMPTY_PAGES = 5 # Сколько страниц подряд без подходящих фильмов пропускать при переходе
+MAX_TMDB_PAGES = 500 # TMDB не отдает страницы дальше 500-й
+MIN_VOTE_COUNT = 1000 # Порог голосов для списка популярных (API его не поддерживает)
 
 # Тексты кнопок клавиатуры
 BTN_SEARCH = "🔍 Поиск"
@@ -49,67 +71,87 @@ MAIN_REPLY_MARKUP = ReplyKeyboardMarkup(MAIN_KEYBOARD, resize_keyboard=True)
 
 # --- Вспомогательные функции ---
 
+async def refresh_api_config(force=False):
+    """Запрашивает конфигурацию API. При ошибке сохраняется последний удачный снимок."""
+    global API_CONFIG_CACHE, API_CONFIG_VERSION
+    config = await tmdb_api.get_api_config_async(refresh=force)
+    if not config or 'images' not in config:
+        logger.error("Не удалось получить валидную конфигурацию API, оставляю предыдущую.")
+        return False
+    if config != API_CONFIG_CACHE:
+        API_CONFIG_CACHE = config
+        API_CONFIG_VERSION += 1
+        _CARD_CACHE.clear() # URL постеров зависят от конфигурации
+    logger.info("Конфигурация API успешно кэширована.")
+    return True
+
+async def refresh_genres(force=False):
+    """Запрашивает список жанров. При ошибке сохраняется последний удачный снимок."""
+    global GENRES_CACHE, GENRE_NAMES
+    genres_data = await tmdb_api.get_genres_async(refresh=force)
+    if not genres_data or 'genres' not in genres_data:
+        logger.error("Не удалось получить жанры, оставляю предыдущий список.")
+        return False
+    GENRES_CACHE = {genre['name'].lower(): genre['id'] for genre in genres_data['genres']}
+    genre_names = {genre['id']: genre['name'] for genre in genres_data['genres']}
+    if genre_names != GENRE_NAMES:
+        GENRE_NAMES = genre_names
+        _CARD_CACHE.clear() # Названия жанров в карточках из списков берутся отсюда
+    logger.info("Жанры успешно кэшированы.")
+    return True
+
 async def ensure_api_config_cached():
     """Гарантирует, что конфигурация API получена и закэширована."""
-    global API_CONFIG_CACHE
-    if not API_CONFIG_CACHE or 'images' not in API_CONFIG_CACHE:
-        logger.info("Конфигурация API не кэширована или невалидна. Запрашиваю...")
-        API_CONFIG_CACHE = tmdb_api.get_api_config()
-        if not API_CONFIG_CACHE or 'images' not in API_CONFIG_CACHE:
-            logger.error("Не удалось получить или кэшировать валидную конфигурацию API.")
-            API_CONFIG_CACHE = {} # Сброс кэша при ошибке
-            return False
-        logger.info("Конфигурация API успешно кэширована.")
-    return True
+    if API_CONFIG_CACHE and 'images' in API_CONFIG_CACHE:
+        return True
+    logger.info("Конфигурация API не кэширована или невалидна. Запрашиваю...")
+    return await refresh_api_config()
 
 async def ensure_genres_cached():
     """Гарантирует, что жанры фильмов получены и закэшированы."""
-    global GENRES_CACHE
-    if not GENRES_CACHE:
-        logger.info("Жанры не кэшированы. Запрашиваю...")
-        genres_data = tmdb_api.get_genres()
-        if genres_data and 'genres' in genres_data:
-            GENRES_CACHE = {genre['name'].lower(): genre['id'] for genre in genres_data['genres']}
-            logger.info("Жанры успешно кэшированы.")
-        else:
-            logger.error("Не удалось получить или кэшировать жанры.")
-            GENRES_CACHE = {} # Сброс кэша при ошибке
-            return False
-    return True
-
-def format_movie_details(movie_data):
-    """Форматирует данные фильма в читаемую строку для Telegram с использованием HTML."""
-    if not movie_data:
+    if GENRES_CACHE:
+        return True
+    logger.info("Жанры не кэшированы. Запрашиваю...")
+    return await refresh_genres()
+
+def format_movie_details(movie):
+    """Форматирует запись фильма (movie_store.MovieRecord) в читаемую строку для Telegram с использованием HTML."""
+    if not movie:
         return "Не удалось получить информацию о фильме.", None
 
     # Основная информация - Экранируем HTML символы из полей API
-    title = html.escape(movie_data.get('title', 'N/A'))
-    original_title = html.escape(movie_data.get('original_title', ''))
-    overview = html.escape(movie_data.get('overview', 'Описание недоступно.'))
-    release_date = movie_data.get('release_date', 'N/A') # Дата безопасна
-    rating = movie_data.get('vote_average', 0)
-    vote_count = movie_data.get('vote_count', 0)
-    # Экранируем названия жанров по отдельности
-    genres_list = [html.escape(g['name']) for g in movie_data.get('genres', [])]
+    title = html.escape(movie.title)
+    original_title = html.escape(movie.original_title)
+    overview = html.escape(movie.overview)
+    release_date = movie.release_date # Дата безопасна
+    rating = movie.vote_average
+    vote_count = movie.vote_count
+    # Экранируем названия жанров по отдельности (если детального ответа еще нет - названия по genre_ids)
+    genre_names = movie.genres or [GENRE_NAMES[g] for g in movie.genre_ids if g in GENRE_NAMES]
+    genres_list = [html.escape(name) for name in genre_names]
     genres = ', '.join(genres_list)
-    runtime = movie_data.get('runtime', 0) # в минутах
+    runtime = movie.runtime # в минутах
 
     # Составляем сообщение с использованием HTML тегов
     message = f"🎬 <b>{title}</b>"
     # Проверяем оригинальное название *перед* экранированием для сравнения
-    if movie_data.get('title', '').lower() != movie_data.get('original_title', '').lower() and original_title:
+    if movie.title.lower() != movie.original_title.lower() and original_title:
         message += f" ({original_title})" # Уже экранировано
     message += f"\n\n🗓️ Дата выхода: {release_date}"
     if genres:
         message += f"\n🎭 Жанры: {genres}" # Уже экранировано
     if runtime:
         message += f"\n⏱️ Продолжительность: {runtime} мин."
+    if movie.directors:
+        message += f"\n🎥 Режиссер: {html.escape(', '.join(movie.directors))}"
+    if movie.cast:
+        message += f"\n👥 В ролях: {html.escape(', '.join(movie.cast))}"
     message += f"\n⭐ Рейтинг: {rating:.1f}/10 ({vote_count} голосов)"
     message += f"\n\n📝 Описание:\n{overview}" # Уже экранировано
 
     # Добавляем URL постера, если доступна конфигурация
     poster_url = None
-    if API_CONFIG_CACHE and 'images' in API_CONFIG_CACHE and movie_data.get('poster_path'):
+    if API_CONFIG_CACHE and 'images' in API_CONFIG_CACHE and movie.poster_path:
         base_url = API_CONFIG_CACHE['images'].get('secure_base_url', '')
         # Выбираем подходящий размер постера (например, w500)
         poster_size = 'w500' # По умолчанию w500
@@ -124,7 +166,7 @@ def format_movie_details(movie_data):
         else:
              poster_size = 'original' # Абсолютный резервный вариант
 
-        poster_path = movie_data['poster_path']
+        poster_path = movie.poster_path
         if base_url and poster_path:
             poster_url = f"{base_url}{poster_size}{poster_path}"
             # logger.info(f"Сформирован URL постера: {poster_url}") # Уменьшаем шум в логах
@@ -134,33 +176,294 @@ def format_movie_details(movie_data):
     return message, poster_url # Возвращаем сообщение и опциональный URL постера
 
 
-async def display_movie_result(update: Update, context: ContextTypes.DEFAULT_TYPE, index: int):
-    """Отображает один результат фильма с кнопками пагинации."""
-    results = context.user_data.get(PAGINATED_RESULTS, [])
-    if not results or index < 0 or index >= len(results):
-        logger.warning(f"Неверный индекс ({index}) или нет результатов для пагинации.")
+# --- Кэш готовых карточек ---
+# (подпись, URL постера) по ID фильма, ревизии записи, языку и версии конфигурации API
+CARD_CACHE_SIZE = 5000
+_CARD_CACHE = OrderedDict()
+
+def render_movie_card(movie):
+    """Возвращает закэшированный результат format_movie_details для записи фильма."""
+    if not movie:
+        return format_movie_details(movie)
+    key = (movie.id, movie.revision, tmdb_api.DEFAULT_LANGUAGE, API_CONFIG_VERSION)
+    card = _CARD_CACHE.get(key)
+    if card is not None:
+        _CARD_CACHE.move_to_end(key)
+        return card
+    card = format_movie_details(movie)
+    _CARD_CACHE[key] = card
+    if len(_CARD_CACHE) > CARD_CACHE_SIZE:
+        _CARD_CACHE.popitem(last=False)
+    return card
+
+def html_to_plain_text(message_text):
+    """Убирает HTML теги и экранирование из подписи карточки (для отправки без parse_mode)."""
+    return html.unescape(re.sub(r"<[^>]+>", "", message_text))
+
+
+async def send_poster(send_photo, poster_url):
+    """
+    Отправляет постер через send_photo(photo), используя file_id из кэша, если он есть.
+    Если Telegram отклоняет file_id, повторяет отправку по URL и запоминает новый file_id.
+    """
+    file_id = await poster_cache.fetch(poster_url)
+    if file_id:
+        try:
+            return await send_photo(file_id)
+        except BadRequest as e:
+            if "message is not modified" in str(e).lower():
+                raise
+            logger.warning(f"Telegram отклонил file_id постера {poster_url}: {e}. Отправляю по URL.")
+            poster_cache.forget(poster_url)
+    message = await send_photo(poster_url)
+    poster_cache.remember(poster_url, message)
+    await poster_cache.share(poster_url)
+    return message
+
+
+# --- Пагинация по страницам TMDB ---
+
+async def _fetch_source_page(source, args, page):
+    """Запрашивает страницу результатов для указанного источника."""
+    if source == 'title':
+        # Локальный индекс названий: в результатах только ID, детали запрашиваются для показанной карточки
+        return title_index.index.page(args['query'], page)
+    if source == 'search':
+        return await tmdb_api.search_movies_async(args['query'], page=page)
+    if source == 'discover':
+        # Локальный каталог хорошо оцененных фильмов; запрос к API - только пока каталог не загружен
+        local = discover_catalog.catalog.query(args['criteria'], page)
+        if local is not None:
+            return local
+        return await tmdb_api.discover_movies_async(args['criteria'], page=page)
+    if source in CHART_FETCHERS:
+        return await _chart_page(source, page)
+    raise ValueError(f"Неизвестный источник результатов: {source}")
+
+def _filter_results(source, results):
+    """Применяет клиентские фильтры источника к результатам страницы."""
+    if source == 'popular':
+        # Фильтруем результаты по количеству голосов (т.к. эндпоинт API это не поддерживает)
+        return [m for m in results if m.get('vote_count', 0) >= MIN_VOTE_COUNT]
+    return results
+
+
+# --- Списки фильмов (популярные, топ, скоро) ---
+# Список собирается из нескольких страниц TMDB, запрашиваемых параллельно, пока после фильтрации
+# не наберется CHART_TARGET фильмов. Готовый список общий для всех пользователей и обновляется
+# вместе с остальными кэшами, поэтому запросы пользователей к TMDB не идут.
+CHART_TARGET = 100 # Сколько фильмов набирать в список
+CHART_FANOUT = 5 # Сколько страниц TMDB запрашивать одновременно
+CHART_MAX_PAGES = 25 # Больше страниц не запрашивать, даже если фильмов не набралось
+CHART_TTL = 3600 # Время жизни собранного списка (сек.), как у обновления списков в фоне
+CHART_PAGE_SIZE = 20 # Как у страниц TMDB
+
+CHART_FETCHERS = {
+    'popular': tmdb_api.get_popular_movies_async,
+    'top_rated': tmdb_api.get_top_rated_movies_async,
+    'upcoming': tmdb_api.get_upcoming_movies_async,
+}
+
+_CHARTS = {} # источник -> (время сборки, список фильмов)
+_CHART_BUILDS = {} # источник -> задача сборки (одновременные запросы ждут одну сборку)
+
+async def _assemble_chart(source, refresh=False):
+    """
+    Собирает список: страницы запрашиваются окном не больше CHART_FANOUT, разбираются по порядку,
+    повторы по ID отбрасываются. Окно рассчитывается по недостающему числу фильмов, поэтому лишние
+    страницы почти не запрашиваются: начатый запрос к TMDB не отменить (его ждут и другие, см. _fetch_coalesced).
+    Возвращает список фильмов или None, если не удалось получить даже первую страницу.
+    """
+    fetch = CHART_FETCHERS[source]
+    movies = {} # ID -> данные фильма, в порядке списка
+    pending = {} # страница -> задача запроса
+    next_page, total_pages, page = 1, CHART_MAX_PAGES, 1
+    try:
+        while page <= total_pages and len(movies) < CHART_TARGET:
+            # Сколько страниц нужно при той доле фильмов, что пока проходила фильтр
+            per_page = len(movies) / (page - 1) if page > 1 else CHART_PAGE_SIZE
+            needed = math.ceil((CHART_TARGET - len(movies)) / max(per_page, 1))
+            while next_page <= min(total_pages, page + min(needed, CHART_FANOUT) - 1):
+                pending[next_page] = asyncio.ensure_future(fetch(page=next_page, refresh=refresh))
+                next_page += 1
+            api_results = await pending.pop(page)
+            if not api_results:
+                if page == 1:
+                    return None
+                logger.warning(f"Список {source}: не удалось получить страницу {page}, собрано {len(movies)} фильмов.")
+                break
+            total_pages = min(api_results.get('total_pages', page), CHART_MAX_PAGES)
+            title_index.index.add_results(api_results.get('results', [])) # Названия пригодятся для поиска с опечатками
+            for movie_data in _filter_results(source, api_results.get('results', [])):
+                movies.setdefault(movie_data['id'], movie_data)
+            page += 1
+    finally:
+        for task in pending.values():
+            task.cancel()
+    logger.info(f"Список {source} собран: {len(movies)} фильмов с {page - 1} страниц.")
+    return list(movies.values())
+
+async def _build_chart(source, refresh=False):
+    movies = await _assemble_chart(source, refresh)
+    if movies is not None:
+        _CHARTS[source] = (time.monotonic(), movies)
+    return movies
+
+async def _get_chart(source):
+    """Возвращает собранный список (или None при ошибке), собирая его, если он устарел."""
+    cached = _CHARTS.get(source)
+    if cached is not None and time.monotonic() - cached[0] < CHART_TTL:
+        return cached[1]
+    task = _CHART_BUILDS.get(source)
+    if task is None:
+        task = _CHART_BUILDS[source] = asyncio.ensure_future(_build_chart(source))
+        task.add_done_callback(lambda _: _CHART_BUILDS.pop(source, None))
+    movies = await asyncio.shield(task)
+    if movies is None and cached is not None:
+        return cached[1] # Лучше устаревший список, чем ошибка
+    return movies
+
+async def _chart_page(source, page):
+    """Страница собранного списка в формате ответа TMDB."""
+    movies = await _get_chart(source)
+    if movies is None:
+        return None
+    start = (page - 1) * CHART_PAGE_SIZE
+    return {
+        'page': page,
+        'total_pages': max(math.ceil(len(movies) / CHART_PAGE_SIZE), 1),
+        'total_results': len(movies),
+        'results': movies[start:start + CHART_PAGE_SIZE],
+    }
+
+async def _resolve_position(source, args, page, offset):
+    """
+    Находит фильм по позиции (страница TMDB, номер на странице после фильтрации).
+    Страницы, на которых после фильтрации ничего не осталось, пропускаются в направлении перехода.
+    Возвращает (фильмы страницы после фильтрации, страница, номер, число страниц) или None.
+    """
+    step = -1 if offset == pagination_codec.LAST_OFFSET else 1
+    for _ in range(MAX_EMPTY_PAGES):
+        if page < 1 or page > MAX_TMDB_PAGES:
+            return None
+        api_results = await _fetch_source_page(source, args, page)
+        if not api_results:
+            return None
+        total_pages = min(api_results.get('total_pages', page), MAX_TMDB_PAGES)
+        results = _filter_results(source, api_results.get('results', []))
+        if results:
+            if offset == pagination_codec.LAST_OFFSET:
+                offset = len(results) - 1
+            if offset >= len(results):
+                return None
+            return results, page, offset, total_pages
+        if page + step > total_pages:
+            return None
+        page += step
+    return None
+
+async def _fetch_and_index_page(source, args, page):
+    api_results = await _fetch_source_page(source, args, page)
+    if api_results and source != 'title':
+        title_index.index.add_results(api_results.get('results', []))
+
+def _prefetch_next_page(update: Update, context: ContextTypes.DEFAULT_TYPE, source, args, page):
+    """Загружает следующую страницу в общий кэш TMDB в фоне."""
+    context.application.create_task(rate_limit.run_in_background(_fetch_and_index_page(source, args, page)), update=update)
+
+# Детали фильма (/movie/{id}): в списках TMDB нет названий жанров, длительности и актеров.
+# Детали запрашиваются для показанной карточки и нескольких следующих, поэтому при листании они уже готовы.
+DETAILS_APPEND = 'credits'
+DETAILS_LOOKAHEAD = 3 # Для скольких следующих карточек запрашивать детали заранее
+DETAILS_CONCURRENCY = 8 # Одновременных фоновых запросов деталей (во всех чатах)
+DETAILS_WAIT = 1.0 # Сколько ждать деталей показываемой карточки (сек.), если есть данные из списка
+_DETAILS_LIMIT = asyncio.Semaphore(DETAILS_CONCURRENCY)
+_DETAILS_PENDING = set() # ID фильмов, детали которых уже запрошены в фоне
+
+async def _fetch_details(movie_id):
+    """Запрашивает детали фильма и дополняет ими запись в movie_store. Возвращает запись или None."""
+    # Одинаковые запросы из разных чатов объединяются в tmdb_api, повторные - берутся из кэша
+    details = await tmdb_api.get_movie_details_async(movie_id, append_to_response=DETAILS_APPEND)
+    return movie_store.put(details) if details else None
+
+async def _prefetch_movie_details(movie_id):
+    try:
+        async with _DETAILS_LIMIT:
+            await _fetch_details(movie_id)
+    finally:
+        _DETAILS_PENDING.discard(movie_id)
+
+async def _load_movie(movie_data):
+    """
+    Возвращает запись фильма с деталями. Если детали не пришли за DETAILS_WAIT или их не удалось получить,
+    карточка строится по данным из списка (жанры - по genre_ids), а запрос деталей продолжается в фоне
+    и дополняет запись для следующего показа.
+    Для результатов локального индекса (только ID) без деталей записи нет - их ждем полностью, иначе None.
+    """
+    movie = movie_store.put(movie_data) if 'title' in movie_data else movie_store.get(movie_data['id'])
+    if movie is None:
+        return await _fetch_details(movie_data['id'])
+    if movie.detailed:
+        return movie
+    fetch = asyncio.ensure_future(_fetch_details(movie_data['id']))
+    try:
+        # shield: по таймауту отменяется только ожидание, а не сам запрос
+        return await asyncio.wait_for(asyncio.shield(fetch), DETAILS_WAIT) or movie
+    except asyncio.TimeoutError:
+        logger.info(f"Детали фильма {movie_data['id']} не пришли за {DETAILS_WAIT}с, карточка - по данным списка.")
+        return movie
+
+def _prefetch_details(update: Update, context: ContextTypes.DEFAULT_TYPE, results):
+    """Запрашивает в фоне детали следующих фильмов, для которых их еще нет."""
+    for movie_data in results:
+        movie_id = movie_data['id']
+        movie = movie_store.get(movie_id)
+        if (movie is None or not movie.detailed) and movie_id not in _DETAILS_PENDING:
+            _DETAILS_PENDING.add(movie_id)
+            context.application.create_task(rate_limit.run_in_background(_prefetch_movie_details(movie_id)), update=update)
+
+
+async def display_movie_result(update: Update, context: ContextTypes.DEFAULT_TYPE, position):
+    """
+    Отображает один результат фильма с кнопками пагинации.
+    position - (источник, параметры, страница TMDB, номер на странице).
+    """
+    source, args, page, offset = position
+    resolved = await _resolve_position(source, args, page, offset)
+    if resolved is None:
+        logger.warning(f"Неверная позиция ({source}, страница {page}, номер {offset}) или нет результатов для пагинации.")
         reply_target = update.callback_query.message if update.callback_query else update.message
         if reply_target:
             await reply_target.reply_text("Ошибка пагинации или нет результатов.")
         return
+    results, page, offset, total_pages = resolved
+    movie_data, page_count = results[offset], len(results)
 
-    movie = results[index]
-    message_text, poster_url = format_movie_details(movie)
-    context.user_data[CURRENT_INDEX] = index
+    _prefetch_details(update, context, results[offset + 1:offset + 1 + DETAILS_LOOKAHEAD])
+    movie = await _load_movie(movie_data)
+    movie_id = movie_data['id']
+    message_text, poster_url = render_movie_card(movie)
+    if page < total_pages and offset == max(page_count - 1 - PREFETCH_DISTANCE, 0):
+        _prefetch_next_page(update, context, source, args, page + 1)
 
     # --- Создание клавиатуры пагинации ---
+    # Кнопки описывают позицию целиком, поэтому их может обработать любой процесс бота
     keyboard = []
     row = []
-    if index > 0:
-        row.append(InlineKeyboardButton("⬅️ Пред.", callback_data=f"prev_movie_{index - 1}"))
-    if index < len(results) - 1:
-        row.append(InlineKeyboardButton("След. ➡️", callback_data=f"next_movie_{index + 1}"))
+    if offset > 0:
+        row.append(InlineKeyboardButton("⬅️ Пред.", callback_data=await pagination_codec.encode(source, args, page, offset - 1)))
+    elif page > 1:
+        row.append(InlineKeyboardButton("⬅️ Пред.", callback_data=await pagination_codec.encode(source, args, page - 1, pagination_codec.LAST_OFFSET)))
+    if offset < page_count - 1:
+        row.append(InlineKeyboardButton("След. ➡️", callback_data=await pagination_codec.encode(source, args, page, offset + 1)))
+    elif page < total_pages:
+        row.append(InlineKeyboardButton("След. ➡️", callback_data=await pagination_codec.encode(source, args, page + 1, 0)))
     if row:
         keyboard.append(row)
     inline_reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
 
     # Определяем правильную разметку ответа (inline для редактирования, основную для новых сообщений)
-    final_reply_markup = inline_reply_markup if update.callback_query else (inline_reply_markup if results else MAIN_REPLY_MARKUP)
+    final_reply_markup = inline_reply_markup if update.callback_query else (inline_reply_markup or MAIN_REPLY_MARKUP)
 
 
     # --- Отправка или редактирование сообщения ---
@@ -179,13 +482,16 @@ async def display_movie_result(update: Update, context: ContextTypes.DEFAULT_TYP
             # Случай 1: Типы совпадают (фото->фото или текст->текст) - Редактируем
             if has_current_photo == has_new_photo:
                 if has_new_photo: # Фото -> Фото
-                     logger.info(f"Редактирую сообщение {current_message.message_id} с фото для фильма {movie.get('id')}")
-                     await update.callback_query.edit_message_media(
-                        media=InputMediaPhoto(media=poster_url, caption=message_text, parse_mode=ParseMode.HTML),
-                        reply_markup=inline_reply_markup # Используем inline клавиатуру для редактирования
+                     logger.info(f"Редактирую сообщение {current_message.message_id} с фото для фильма {movie_id}")
+                     await send_poster(
+                        lambda photo: update.callback_query.edit_message_media(
+                            media=InputMediaPhoto(media=photo, caption=message_text, parse_mode=ParseMode.HTML),
+                            reply_markup=inline_reply_markup # Используем inline клавиатуру для редактирования
+                        ),
+                        poster_url,
                     )
                 else: # Текст -> Текст
-                    logger.info(f"Редактирую сообщение {current_message.message_id} с текстом для фильма {movie.get('id')}")
+                    logger.info(f"Редактирую сообщение {current_message.message_id} с текстом для фильма {movie_id}")
                     await update.callback_query.edit_message_text(
                         text=message_text,
                         parse_mode=ParseMode.HTML,
@@ -198,7 +504,7 @@ async def display_movie_result(update: Update, context: ContextTypes.DEFAULT_TYP
                 await current_message.delete()
                 chat_id = current_message.chat_id
                 if has_new_photo:
-                    await context.bot.send_photo(chat_id=chat_id, photo=poster_url, caption=message_text, parse_mode=ParseMode.HTML, reply_markup=inline_reply_markup) # Используем inline клавиатуру
+                    await send_poster(lambda photo: context.bot.send_photo(chat_id=chat_id, photo=photo, caption=message_text, parse_mode=ParseMode.HTML, reply_markup=inline_reply_markup), poster_url) # Используем inline клавиатуру
                 else:
                     await context.bot.send_message(chat_id=chat_id, text=message_text, parse_mode=ParseMode.HTML, reply_markup=inline_reply_markup, disable_web_page_preview=True) # Используем inline клавиатуру
 
@@ -209,12 +515,12 @@ async def display_movie_result(update: Update, context: ContextTypes.DEFAULT_TYP
                 try: await update.callback_query.answer() # Просто подтверждаем нажатие кнопки
                 except Exception: pass
             else:
-                logger.error(f"BadRequest во время редактирования/переотправки пагинации для фильма {movie.get('id')}: {e}")
+                logger.error(f"BadRequest во время редактирования/переотправки пагинации для фильма {movie_id}: {e}")
                 try: await update.callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
                 except Exception: pass # Игнорируем, если ответ на callback не удался
         except Exception as e:
             # Обрабатываем другие неожиданные ошибки
-            logger.error(f"Неожиданная ошибка во время редактирования/переотправки пагинации для фильма {movie.get('id')}: {e}")
+            logger.error(f"Неожиданная ошибка во время редактирования/переотправки пагинации для фильма {movie_id}: {e}")
             try: await update.callback_query.answer("Произошла ошибка.", show_alert=True)
             except Exception: pass # Игнорируем, если ответ на callback не удался
 
@@ -222,64 +528,100 @@ async def display_movie_result(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         try:
             if poster_url:
-                logger.info(f"Отправляю начальное сообщение с фото для фильма {movie.get('id')}")
-                await reply_target.reply_photo(photo=poster_url, caption=message_text, parse_mode=ParseMode.HTML, reply_markup=final_reply_markup)
+                logger.info(f"Отправляю начальное сообщение с фото для фильма {movie_id}")
+                await send_poster(lambda photo: reply_target.reply_photo(photo=photo, caption=message_text, parse_mode=ParseMode.HTML, reply_markup=final_reply_markup), poster_url)
             else:
-                logger.info(f"Отправляю начальное сообщение с текстом для фильма {movie.get('id')}")
+                logger.info(f"Отправляю начальное сообщение с текстом для фильма {movie_id}")
                 await reply_target.reply_text(text=message_text, parse_mode=ParseMode.HTML, reply_markup=final_reply_markup, disable_web_page_preview=True)
         except RetryAfter as e:
-             logger.error(f"Превышен лимит запросов при отправке начального сообщения для фильма {movie.get('id')}: {e}. Повтор через {e.retry_after}с.")
-             # Опционально уведомляем пользователя о флуд-контроле
-             await reply_target.reply_text(f"Слишком много запросов. Попробуйте через {e.retry_after} секунд.", reply_markup=MAIN_REPLY_MARKUP)
+             # RetryAfter обрабатывается ограничителем rate_limit.TelegramRateLimiter, сюда попадаем только после всех повторов
+             logger.error(f"Превышен лимит запросов при отправке начального сообщения для фильма {movie_id}: {e}.")
         except Exception as e:
             # Упрощенный fallback при ошибке отправки начального сообщения
-            logger.error(f"Ошибка отправки начального сообщения для фильма {movie.get('id')}: {e}. Отправляю обычный текст.")
+            logger.error(f"Ошибка отправки начального сообщения для фильма {movie_id}: {e}. Отправляю обычный текст.")
             try:
-                # Переформатируем без HTML для fallback'а
-                plain_title = html.unescape(html.escape(movie.get('title', 'N/A'))) # Получаем сырое и раскодируем
-                plain_original_title = html.unescape(html.escape(movie.get('original_title', '')))
-                plain_overview = html.unescape(html.escape(movie.get('overview', 'Описание недоступно.')))
-                plain_genres_list = [html.unescape(html.escape(g['name'])) for g in movie.get('genres', [])]
-                plain_genres = ', '.join(plain_genres_list)
-                plain_runtime = movie.get('runtime', 0)
-                plain_rating = movie.get('vote_average', 0)
-                plain_vote_count = movie.get('vote_count', 0)
-                plain_release_date = movie.get('release_date', 'N/A')
-
-                plain_text = f"🎬 {plain_title}"
-                if movie.get('title', '').lower() != movie.get('original_title', '').lower() and plain_original_title:
-                     plain_text += f" ({plain_original_title})"
-                plain_text += f"\n\n🗓️ Дата выхода: {plain_release_date}"
-                if plain_genres:
-                     plain_text += f"\n🎭 Жанры: {plain_genres}"
-                if plain_runtime:
-                     plain_text += f"\n⏱️ Продолжительность: {plain_runtime} мин."
-                plain_text += f"\n⭐ Рейтинг: {plain_rating:.1f}/10 ({plain_vote_count} голосов)"
-                plain_text += f"\n\n📝 Описание:\n{plain_overview}"
+                # Отправляем ту же карточку без HTML разметки
+                plain_text = html_to_plain_text(message_text)
                 await reply_target.reply_text(plain_text, reply_markup=final_reply_markup, disable_web_page_preview=True)
             except Exception as e2:
-                logger.error(f"Не удалось отправить даже обычный текст для фильма {movie.get('id')}: {e2}")
+                logger.error(f"Не удалось отправить даже обычный текст для фильма {movie_id}: {e2}")
 
 
 async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает нажатия кнопок 'next' и 'previous' для результатов фильмов."""
     query = update.callback_query
-    await query.answer() # Подтверждаем нажатие кнопки
-
     data = query.data
     logger.info(f"Получен callback пагинации: {data}")
 
-    try:
-        action, new_index_str = data.split("_", 2)[1:] # например, "next", "movie", "5" -> "movie", "5"
-        new_index = int(new_index_str)
-    except (ValueError, IndexError) as e:
-        logger.error(f"Ошибка парсинга данных callback'а пагинации '{data}': {e}")
-        # Пытаемся ответить на callback, если возможно
-        try: await query.answer("Ошибка пагинации.", show_alert=True)
-        except Exception: pass
+    position = await pagination_codec.decode(data) if data.startswith(pagination_codec.PREFIX) else None
+    if position is None:
+        # Кнопки старого формата (prev_movie_N/next_movie_N) или запрос, который уже не найти
+        await query.answer("Список устарел, повторите поиск.", show_alert=True)
+        return
+
+    await query.answer() # Подтверждаем нажатие кнопки
+    _request_render(update, context, position)
+
+
+# --- Схлопывание частых нажатий пагинации ---
+
+PAGINATION_COALESCE_WINDOW = 0.3 # Минимальный интервал между перерисовками одного сообщения (сек.)
+
+# Сообщение -> последнее нажатие, которое еще не отрисовано; запись живет, пока идет перерисовка
+_PENDING_RENDERS = {}
+_COALESCE_STATS = {'clicks': 0, 'renders': 0}
+
+def _render_key(query):
+    if query.message is not None:
+        return (query.message.chat_id, query.message.message_id)
+    return query.inline_message_id
+
+def _chat_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очередь чата обновления в ChatOrderedUpdateProcessor (или пустой контекст, если обработчик обновлений другой)."""
+    processor = context.application.update_processor
+    if isinstance(processor, ChatOrderedUpdateProcessor):
+        return processor.ordered(ordering_key(update))
+    return contextlib.nullcontext()
+
+def _request_render(update: Update, context: ContextTypes.DEFAULT_TYPE, position):
+    """
+    Ставит перерисовку сообщения на указанную позицию.
+    Первое нажатие отрисовывается сразу, а нажатия, пришедшие во время перерисовки и окна после нее,
+    схлопываются в одну перерисовку последнего выбранного фильма.
+    """
+    _COALESCE_STATS['clicks'] += 1
+    key = _render_key(update.callback_query)
+    pending = _PENDING_RENDERS.get(key)
+    if pending is not None:
+        pending.update(update=update, context=context, position=position)
         return
+    _PENDING_RENDERS[key] = {'update': update, 'context': context, 'position': position}
+    context.application.create_task(_render_pending(key), update=update)
+
+async def _render_pending(key):
+    """
+    Отрисовывает последнее нажатие для сообщения, пока они продолжают поступать.
+    Каждая перерисовка встает в очередь чата, как обновление: она не пересекается с ответами
+    на команды и другие нажатия в этом чате. Пауза между перерисовками - вне очереди.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            pending = _PENDING_RENDERS[key]
+            position, pending['position'] = pending['position'], None
+            started = loop.time()
+            _COALESCE_STATS['renders'] += 1
+            async with _chat_order(pending['update'], pending['context']):
+                await display_movie_result(pending['update'], pending['context'], position)
+            await asyncio.sleep(max(PAGINATION_COALESCE_WINDOW - (loop.time() - started), 0))
+            if pending['position'] is None:
+                break
+    finally:
+        _PENDING_RENDERS.pop(key, None)
 
-    await display_movie_result(update, context, new_index)
+def get_pagination_stats():
+    """Сколько нажатий пагинации получено и сколько перерисовок выполнено."""
+    return {**_COALESCE_STATS, 'pending': len(_PENDING_RENDERS)}
 
 
 # --- Обработчики команд ---
@@ -312,6 +654,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 Кнопка '🏆 Топ Рейтинг' или /toprated - Показать фильмы с высоким рейтингом
 Кнопка '📅 Скоро' или /upcoming - Показать скоро выходящие фильмы
 /cancel - Отменить текущую операцию (поиск или подбор)
+В любом чате: <code>@имя_бота название</code> - быстрый поиск без отправки команды
     """
     await update.message.reply_text(help_text, parse_mode=ParseMode.HTML, reply_markup=MAIN_REPLY_MARKUP)
 
@@ -320,13 +663,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def handle_search(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str) -> None:
     """Основная логика для выполнения поиска и отображения результатов."""
     logger.info(f"Обработка поиска по запросу: {query}")
-    api_results = tmdb_api.search_movies(query)
+    # Индекс по полной выгрузке TMDB отвечает сам, только если запрос - оригинальное название целиком;
+    # совпадения из индекса (в т.ч. с опечатками) показываются, только если TMDB ничего не нашел
+    if title_index.index.answers_locally(query):
+        await display_movie_result(update, context, ('title', {'query': query}, 1, 0))
+        return
+
+    api_results = await tmdb_api.search_movies_async(query)
 
     # Не фильтруем результаты поиска по количеству голосов изначально,
     # чтобы находить точные совпадения названий, например "Начало"
     if api_results and api_results.get('results'):
-        context.user_data[PAGINATED_RESULTS] = api_results['results'] # Используем сырые результаты
-        await display_movie_result(update, context, 0) # Отображаем первый результат
+        title_index.index.add_results(api_results['results'])
+        await display_movie_result(update, context, ('search', {'query': query}, api_results.get('page', 1), 0)) # Отображаем первый результат
+    elif title_index.index.search(query)[0]:
+        await update.message.reply_text("Точных совпадений не найдено, показываю похожие названия.", reply_markup=MAIN_REPLY_MARKUP)
+        await display_movie_result(update, context, ('title', {'query': query}, 1, 0))
     elif api_results is None:
          # Убеждаемся, что основная клавиатура показана при ошибке API после поиска по кнопке
          await update.message.reply_text("Произошла ошибка при запросе к API. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP)
@@ -347,34 +699,27 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def popular_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает команду /popular или нажатие кнопки."""
     logger.info("Обработка запроса Популярные.")
-    api_results = tmdb_api.get_popular_movies()
+    api_results = await _fetch_source_page('popular', {}, 1) # Уже отфильтровано при сборке списка
     # Сначала отправляем заголовок, затем результаты
     await update.message.reply_text("<b>Популярные фильмы (голосов > 1000):</b>", parse_mode=ParseMode.HTML, reply_markup=MAIN_REPLY_MARKUP)
 
     if api_results and api_results.get('results'):
-         # Фильтруем результаты по количеству голосов >= 1000 (т.к. эндпоинт API это не поддерживает)
-        filtered_results = [m for m in api_results['results'] if m.get('vote_count', 0) >= 1000]
-        if filtered_results:
-            context.user_data[PAGINATED_RESULTS] = filtered_results
-            await display_movie_result(update, context, 0) # Отображаем первый результат
-        else:
-            await update.message.reply_text("Не найдено популярных фильмов с достаточным количеством голосов (>1000).", reply_markup=MAIN_REPLY_MARKUP)
+        await display_movie_result(update, context, ('popular', {}, 1, 0)) # Отображаем первый результат
     elif api_results is None:
          await update.message.reply_text("Произошла ошибка при запросе к API. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP)
     else:
-        await update.message.reply_text("Не найдено популярных фильмов.", reply_markup=MAIN_REPLY_MARKUP)
+        await update.message.reply_text("Не найдено популярных фильмов с достаточным количеством голосов (>1000).", reply_markup=MAIN_REPLY_MARKUP)
 
 
 async def toprated_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает команду /toprated или нажатие кнопки."""
     logger.info("Обработка запроса Топ Рейтинг.")
-    api_results = tmdb_api.get_top_rated_movies() # Уже отфильтровано API
+    api_results = await _fetch_source_page('top_rated', {}, 1) # Уже отфильтровано API
     # Сначала отправляем заголовок, затем результаты
     await update.message.reply_text("<b>Фильмы с высоким рейтингом (голосов > 1000):</b>", parse_mode=ParseMode.HTML, reply_markup=MAIN_REPLY_MARKUP)
 
     if api_results and api_results.get('results'):
-        context.user_data[PAGINATED_RESULTS] = api_results['results']
-        await display_movie_result(update, context, 0) # Отображаем первый результат
+        await display_movie_result(update, context, ('top_rated', {}, 1, 0)) # Отображаем первый результат
     elif api_results is None:
          await update.message.reply_text("Произошла ошибка при запросе к API. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP)
     else:
@@ -384,20 +729,159 @@ async def toprated_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def upcoming_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает команду /upcoming или нажатие кнопки."""
     logger.info("Обработка запроса Скоро.")
-    api_results = tmdb_api.get_upcoming_movies()
+    api_results = await _fetch_source_page('upcoming', {}, 1)
     # Сначала отправляем заголовок, затем результаты
     await update.message.reply_text("<b>Скоро в кино:</b>", parse_mode=ParseMode.HTML, reply_markup=MAIN_REPLY_MARKUP)
 
     if api_results and api_results.get('results'):
         # Скоро выходящие фильмы часто имеют мало голосов, поэтому не фильтруем их
-        context.user_data[PAGINATED_RESULTS] = api_results['results']
-        await display_movie_result(update, context, 0) # Отображаем первый результат
+        await display_movie_result(update, context, ('upcoming', {}, 1, 0)) # Отображаем первый результат
     elif api_results is None:
          await update.message.reply_text("Произошла ошибка при запросе к API. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP)
     else:
         await update.message.reply_text("Не найдено скоро выходящих фильмов.", reply_markup=MAIN_REPLY_MARKUP)
 
 
+# --- Inline режим (@бот название) ---
+
+INLINE_DEBOUNCE = 0.3 # Ответ отправляется, только если пользователь перестал печатать на это время (сек.)
+INLINE_CACHE_TIME = 300 # Сколько Telegram кэширует ответ на одинаковый запрос (сек.)
+INLINE_PAGES_PER_ANSWER = 2 # Страниц TMDB в одном ответе (40 результатов, Telegram принимает не больше 50)
+INLINE_MAX_RESULTS = 50
+
+# Последний inline запрос каждого пользователя: user_id -> ID запроса
+_INLINE_LATEST = {}
+
+def _poster_thumbnail_url(movie):
+    """URL постера самого маленького размера для миниатюры в списке inline результатов."""
+    images = API_CONFIG_CACHE.get('images') if API_CONFIG_CACHE else None
+    if not images or not movie.poster_path:
+        return None
+    poster_sizes = images.get('poster_sizes') or ['original']
+    return f"{images.get('secure_base_url', '')}{poster_sizes[0]}{movie.poster_path}"
+
+def _inline_result(movie):
+    """Карточка фильма для списка inline результатов; при выборе отправляется текст карточки с постером в превью."""
+    message_text, poster_url = render_movie_card(movie)
+    year = movie.release_date[:4] if movie.release_date != 'N/A' else ''
+    if poster_url:
+        link_preview = LinkPreviewOptions(url=poster_url, prefer_large_media=True, show_above_text=True)
+    else:
+        link_preview = LinkPreviewOptions(is_disabled=True)
+    return InlineQueryResultArticle(
+        id=str(movie.id),
+        title=f"{movie.title} ({year})" if year else movie.title,
+        description=f"⭐ {movie.vote_average:.1f} · {movie.overview[:100]}",
+        input_message_content=InputTextMessageContent(message_text, parse_mode=ParseMode.HTML, link_preview_options=link_preview),
+        thumbnail_url=_poster_thumbnail_url(movie),
+    )
+
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает inline запрос. Ответ готовится в отдельной задаче после паузы,
+    чтобы запросы, которые пользователь успел дописать, не обрабатывались зря
+    и не задерживали следующие обновления этого пользователя.
+    """
+    inline_query = update.inline_query
+    _INLINE_LATEST[inline_query.from_user.id] = inline_query.id
+    context.application.create_task(_answer_inline_query(inline_query), update=update)
+
+async def _answer_inline_query(inline_query):
+    user_id = inline_query.from_user.id
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if _INLINE_LATEST.get(user_id) != inline_query.id:
+        return # Пользователь продолжил печатать, Telegram уже ждет ответ на новый запрос
+    del _INLINE_LATEST[user_id]
+
+    query = inline_query.query.strip()
+    # Пустой запрос - популярные фильмы; смещение - номер следующей страницы TMDB
+    source, args = ('search', {'query': query}) if query else ('popular', {})
+    first_page = int(inline_query.offset) if inline_query.offset.isdigit() else 1
+    logger.info(f"Inline запрос '{query}', страница {first_page}.")
+
+    api_results = await _fetch_source_page(source, args, first_page)
+    if api_results is None:
+        return # Ошибка API: Telegram покажет пустой список
+    total_pages = min(api_results.get('total_pages', 1), MAX_TMDB_PAGES)
+    last_page = min(first_page + INLINE_PAGES_PER_ANSWER - 1, total_pages)
+    pages = [api_results] + list(await asyncio.gather(
+        *(_fetch_source_page(source, args, page) for page in range(first_page + 1, last_page + 1))
+    ))
+
+    movies = {}
+    for page_results in pages:
+        if not page_results:
+            break
+        title_index.index.add_results(page_results.get('results', []))
+        for movie_data in _filter_results(source, page_results.get('results', [])):
+            movies.setdefault(movie_data['id'], movie_store.put(movie_data)) # ID результатов в ответе должны быть уникальны
+    if not movies and first_page == 1 and query:
+        # TMDB ничего не нашел - возможно, опечатка: берем уже известные фильмы из локального индекса
+        local_ids, _ = title_index.index.search(query)
+        movies = {movie_id: movie_store.get(movie_id) for movie_id in local_ids if movie_store.get(movie_id) is not None}
+
+    results = [_inline_result(movie) for movie in list(movies.values())[:INLINE_MAX_RESULTS]]
+    try:
+        await inline_query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=False, # Результаты одинаковы для всех, Telegram может отдавать их из своего кэша
+            next_offset=str(last_page + 1) if last_page < total_pages else '',
+        )
+    except BadRequest as e:
+        # Например, запрос устарел, пока ждали TMDB
+        logger.warning(f"Не удалось ответить на inline запрос '{query}': {e}")
+
+
+# --- Фоновый прогрев и обновление кэшей ---
+
+# Интервалы обновления (сек.) и доля случайного разброса, чтобы обновления не совпадали
+REFRESH_INTERVALS = {
+    'config': 24 * 3600,
+    'genres': 24 * 3600,
+    'charts': 3600,
+}
+REFRESH_JITTER = 0.1
+
+async def refresh_charts(force=False):
+    """Пересобирает списки популярных, топовых и скоро выходящих фильмов."""
+    results = await asyncio.gather(*(_build_chart(source, refresh=force) for source in CHART_FETCHERS))
+    if any(movies is None for movies in results):
+        logger.error("Не удалось обновить часть списков фильмов, в кэше остаются предыдущие.")
+        return False
+    logger.info("Списки популярных, топовых и скоро выходящих фильмов обновлены.")
+    return True
+
+REFRESH_TASKS = {
+    'config': refresh_api_config,
+    'genres': refresh_genres,
+    'charts': refresh_charts,
+}
+
+async def warm_up_caches():
+    """Предзагружает конфигурацию, жанры и списки фильмов до начала опроса."""
+    logger.info("Прогрев кэшей...")
+    await asyncio.gather(*(refresh() for refresh in REFRESH_TASKS.values()))
+
+async def refresh_cache_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача JobQueue: обновляет один из кэшей по имени из job.data."""
+    rate_limit.request_priority.set(rate_limit.PRIORITY_BACKGROUND)
+    await REFRESH_TASKS[context.job.data](force=True)
+
+def schedule_cache_refresh(job_queue):
+    """Регистрирует периодическое обновление кэшей в JobQueue приложения."""
+    for name, interval in REFRESH_INTERVALS.items():
+        job_queue.run_repeating(
+            refresh_cache_job,
+            interval=interval,
+            first=interval,
+            data=name,
+            name=f"refresh_{name}",
+            job_kwargs={'jitter': int(interval * REFRESH_JITTER)},
+        )
+    logger.info("Фоновое обновление кэшей запланировано.")
+
+
 # --- Обработчики диалогов (/discover) ---
 
 # --- Диалог поиска по кнопке ---
@@ -462,11 +946,7 @@ async def ask_genre_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         genre_id = callback_data.split("_")[1]
         context.user_data[DISCOVERY_CRITERIA]['with_genres'] = genre_id
         # Находим имя жанра для подтверждающего сообщения
-        genre_name = "Выбранный жанр"
-        for name, gid in GENRES_CACHE.items():
-            if str(gid) == genre_id:
-                genre_name = name.capitalize()
-                break
+        genre_name = GENRE_NAMES.get(int(genre_id), "Выбранный жанр").capitalize()
         logger.info(f"Пользователь выбрал жанр ID: {genre_id} ({genre_name})")
         await query.edit_message_text(text=f"Выбран жанр: {genre_name}")
 
@@ -531,11 +1011,11 @@ async def ask_rating_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     logger.info(f"Выполняю подбор по критериям: {criteria}")
     # Сначала отправляем заголовок, затем результаты
     await query.message.reply_text("Ищу фильмы по вашим критериям (голосов > 1000)...", reply_markup=MAIN_REPLY_MARKUP) # Показываем основную клавиатуру снова
-    api_results = tmdb_api.discover_movies(criteria) # Уже отфильтровано API
+    api_results = await _fetch_source_page('discover', {'criteria': criteria}, 1) # Уже отфильтровано каталогом или API
 
     if api_results and api_results.get('results'):
-        context.user_data[PAGINATED_RESULTS] = api_results['results']
-        await display_movie_result(update, context, 0) # Отображаем первый результат
+        title_index.index.add_results(api_results['results']) # Названия пригодятся для поиска с опечатками
+        await display_movie_result(update, context, ('discover', {'criteria': dict(criteria)}, api_results.get('page', 1), 0)) # Отображаем первый результат
     elif api_results is None:
          await query.message.reply_text("Произошла ошибка при запросе к API. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP)
     else:
@@ -552,13 +1032,9 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отменяет и завершает диалог."""
     user = update.effective_user
     logger.info(f"Пользователь {user.first_name} отменил диалог.")
-    # Очищаем данные для обоих типов диалогов
+    # Очищаем данные диалога подбора (позиция пагинации хранится в кнопках и очистки не требует)
     if DISCOVERY_CRITERIA in context.user_data:
         del context.user_data[DISCOVERY_CRITERIA]
-    if PAGINATED_RESULTS in context.user_data: # Также очищаем результаты при отмене
-        del context.user_data[PAGINATED_RESULTS]
-    if CURRENT_INDEX in context.user_data:
-        del context.user_data[CURRENT_INDEX]
 
     await update.message.reply_text(
         "Операция отменена.", reply_markup=MAIN_REPLY_MARKUP
@@ -577,7 +1053,8 @@ discover_conv_handler = ConversationHandler(
         # Состояние SHOW_DISCOVERY_RESULTS не нужно, т.к. обработка в ask_rating_callback
     },
     fallbacks=[CommandHandler("cancel", cancel)],
-    # Опционально: добавить сохранение состояния диалога при необходимости
+    name="discover_conversation",
+    persistent=True, # Состояние диалога переживает перезапуск (см. persistence.py)
 )
 
 # Диалог поиска по кнопке
@@ -587,11 +1064,16 @@ search_conv_handler = ConversationHandler(
         ASK_SEARCH_QUERY: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_query_input)],
     },
     fallbacks=[CommandHandler("cancel", cancel)],
+    name="search_conversation",
+    persistent=True,
 )
 
 
 # --- Обработчик пагинации ---
-pagination_handler = CallbackQueryHandler(handle_pagination, pattern="^(prev_movie_|next_movie_)")
+pagination_handler = CallbackQueryHandler(handle_pagination, pattern=f"^({pagination_codec.PREFIX}|prev_movie_|next_movie_)")
+
+# --- Обработчик inline запросов ---
+inline_query_handler = InlineQueryHandler(handle_inline_query)
 
 # --- Обработчики сообщений для кнопок ---
 # Они напрямую связывают текст кнопки с функциями команд
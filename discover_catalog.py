@@ -0,0 +1,251 @@
+import os
+import math
+import time
+import pickle
+import asyncio
+import logging
+import datetime
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+import tmdb_api
+import rate_limit
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Локальный каталог фильмов с числом голосов >= 1000 для ответа на /discover без запросов к TMDB.
+# Каталог загружается из TMDB в фоне (по годам выпуска, чтобы не упираться в лимит 500 страниц),
+# хранится по столбцам (ID, маска жанров, год, рейтинг, число голосов, популярность) и сохраняется в снимок,
+# который загружают все процессы бота. Пока каталог не загружен, подбор выполняется через API.
+CATALOG_FILE = os.getenv('DISCOVER_CATALOG_FILE', 'discover_catalog.pickle')
+REFRESH_INTERVAL = 24 * 3600 # Как часто перезагружать каталог из TMDB (сек.)
+RELOAD_INTERVAL = 600 # Как часто проверять, не обновил ли снимок другой процесс (сек.)
+RETRY_INTERVAL = 1800 # Через сколько повторить загрузку, если часть годов не загрузилась (сек.)
+FIRST_YEAR = 1900
+CRAWL_CONCURRENCY = 4 # Сколько страниц загружать одновременно (остальные ждут, не занимая очередь ограничителя)
+CRAWL_ATTEMPTS = 3 # Сколько раз запрашивать страницу, прежде чем считать год незагруженным
+CRAWL_RETRY_DELAY = 30.0 # Пауза перед повтором страницы (сек.), не меньше таймаута выключателя TMDB
+MAX_PAGES = 500 # TMDB не отдает страницы подбора дальше 500-й
+PAGE_SIZE = 20 # Как у страниц TMDB
+SNAPSHOT_VERSION = 1
+MATCH_CACHE_SIZE = 512 # Сколько наборов критериев помнить (порядок строк для листания без повторного подбора)
+
+# Критерии, которые каталог умеет применять (остальные - только через API)
+SUPPORTED_CRITERIA = {'with_genres', 'primary_release_year', 'vote_average.gte'}
+# Поля фильма, нужные для карточки (остальное из ответа TMDB не храним)
+_CARD_FIELDS = ('id', 'title', 'original_title', 'overview', 'release_date', 'vote_average',
+                'vote_count', 'genre_ids', 'poster_path', 'popularity')
+
+
+def _release_year(movie):
+    date = movie.get('release_date') or ''
+    return int(date[:4]) if date[:4].isdigit() else 0
+
+
+class DiscoverCatalog:
+    """
+    Каталог фильмов в столбцах numpy. Подбор - маски по столбцам и сортировка совпавших по популярности
+    (как sort_by=popularity.desc у TMDB).
+    """
+
+    def __init__(self, movies=(), built_at=0.0):
+        self.movies = list(movies) # Данные для карточек, в порядке строк столбцов
+        self.built_at = built_at # Время загрузки из TMDB (time.time()), 0 - каталог пуст
+        genre_ids = sorted({g for m in self.movies for g in m.get('genre_ids') or ()})
+        self.genre_bits = {genre_id: 1 << i for i, genre_id in enumerate(genre_ids[:63])}
+        count = len(self.movies)
+        self.ids = np.fromiter((m['id'] for m in self.movies), dtype=np.int64, count=count)
+        self.genre_mask = np.fromiter((self._genre_mask(m) for m in self.movies), dtype=np.int64, count=count)
+        self.year = np.fromiter((_release_year(m) for m in self.movies), dtype=np.int16, count=count)
+        self.vote_average = np.fromiter(((m.get('vote_average') or 0.0) for m in self.movies), dtype=np.float64, count=count)
+        self.vote_count = np.fromiter(((m.get('vote_count') or 0) for m in self.movies), dtype=np.int32, count=count)
+        self.popularity = np.fromiter(((m.get('popularity') or 0.0) for m in self.movies), dtype=np.float64, count=count)
+        self._matches = OrderedDict() # (бит жанра, год, рейтинг) -> номера строк по убыванию популярности
+
+    def __len__(self):
+        return len(self.movies)
+
+    def _genre_mask(self, movie):
+        mask = 0
+        for genre_id in movie.get('genre_ids') or ():
+            mask |= self.genre_bits.get(genre_id, 0)
+        return mask
+
+    def _match(self, genre_bit, year, rating):
+        """Номера строк, подходящих под критерии, по убыванию популярности."""
+        mask = np.ones(len(self.movies), dtype=bool)
+        if genre_bit:
+            mask &= (self.genre_mask & genre_bit) != 0
+        if year:
+            mask &= self.year == year
+        if rating:
+            mask &= self.vote_average >= rating
+        rows = np.flatnonzero(mask)
+        return rows[np.argsort(-self.popularity[rows], kind='stable')]
+
+    def _cached_match(self, genre_bit, year, rating):
+        """_match с запоминанием: каталог не меняется, а листание запрашивает те же критерии много раз."""
+        key = (genre_bit, year, rating)
+        rows = self._matches.get(key)
+        if rows is not None:
+            self._matches.move_to_end(key)
+            return rows
+        rows = self._match(genre_bit, year, rating)
+        self._matches[key] = rows
+        if len(self._matches) > MATCH_CACHE_SIZE:
+            self._matches.popitem(last=False)
+        return rows
+
+    def query(self, criteria, page=1):
+        """
+        Страница подбора в формате ответа TMDB или None, если каталог пуст
+        или критерии не поддерживаются (тогда нужен запрос к API).
+        """
+        if not self.built_at or set(criteria) - SUPPORTED_CRITERIA:
+            return None
+        genre = criteria.get('with_genres')
+        genre_bit = self.genre_bits.get(int(genre)) if genre else 0
+        if genre_bit is None:
+            rows = [] # Жанра нет ни у одного фильма каталога
+        else:
+            rows = self._cached_match(genre_bit, criteria.get('primary_release_year'), criteria.get('vote_average.gte'))
+        start = (page - 1) * PAGE_SIZE
+        return {
+            'page': page,
+            'total_pages': min(max(math.ceil(len(rows) / PAGE_SIZE), 1), MAX_PAGES),
+            'total_results': len(rows),
+            'results': [self.movies[i] for i in rows[start:start + PAGE_SIZE]],
+        }
+
+    # --- Снимок ---
+
+    def save_snapshot(self, path):
+        state = {'version': SNAPSHOT_VERSION, 'built_at': self.built_at, 'movies': self.movies}
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия снимка каталога: {state.get('version')}")
+        return cls(state['movies'], state['built_at'])
+
+
+# Единственный каталог на процесс; пустой, пока не загружен снимок или данные из TMDB
+catalog = DiscoverCatalog()
+_snapshot_mtime = None
+_crawl_slots = None # asyncio.Semaphore(CRAWL_CONCURRENCY), создается внутри цикла событий
+_refreshing = False
+
+async def _fetch_page(criteria, page):
+    """Страница подбора с повторами или None, если она так и не загрузилась."""
+    for attempt in range(CRAWL_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(CRAWL_RETRY_DELAY)
+        async with _crawl_slots:
+            data = await tmdb_api.crawl_discover_movies_async(criteria, page)
+        if data is not None:
+            return data
+    return None
+
+async def _fetch_year(year):
+    """Все страницы подбора за год выпуска или None, если какая-то страница не загрузилась."""
+    criteria = {'primary_release_year': year}
+    first = await _fetch_page(criteria, 1)
+    if first is None:
+        return None
+    pages = await asyncio.gather(*(
+        _fetch_page(criteria, page)
+        for page in range(2, min(first.get('total_pages') or 1, MAX_PAGES) + 1)
+    ))
+    if any(page is None for page in pages):
+        return None
+    return [movie for page in (first, *pages) for movie in page.get('results', [])]
+
+async def build(previous=None):
+    """
+    Загружает каталог из TMDB и возвращает (каталог, годы, которые не загрузились).
+    Фильмы незагруженных годов берутся из предыдущего каталога; если не загрузился ни один год - (None, годы).
+    """
+    global _crawl_slots
+    _crawl_slots = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    years = range(FIRST_YEAR, datetime.date.today().year + 2)
+    per_year = await asyncio.gather(*(_fetch_year(year) for year in years))
+    failed = [year for year, year_movies in zip(years, per_year) if year_movies is None]
+    if len(failed) == len(years):
+        return None, failed
+    if failed and previous is not None:
+        kept_years = set(failed)
+        per_year.append([m for m in previous.movies if _release_year(m) in kept_years])
+    movies = {}
+    for year_movies in per_year:
+        for movie in year_movies or ():
+            movies[movie['id']] = {field: movie.get(field) for field in _CARD_FIELDS}
+    return DiscoverCatalog(movies.values(), time.time()), failed
+
+def _read_snapshot(path):
+    """Загружает снимок, если он изменился с прошлой загрузки (блокирующий вызов)."""
+    if not os.path.exists(path):
+        return None, None
+    mtime = os.path.getmtime(path)
+    if mtime == _snapshot_mtime:
+        return None, mtime
+    return DiscoverCatalog.from_snapshot(path), mtime
+
+async def load():
+    """Загружает каталог из снимка (при старте бота и когда снимок обновил другой процесс)."""
+    global catalog, _snapshot_mtime
+    try:
+        loaded, mtime = await asyncio.to_thread(_read_snapshot, CATALOG_FILE)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        logger.error(f"Не удалось загрузить каталог для подбора: {e}")
+        return
+    if loaded is not None:
+        catalog, _snapshot_mtime = loaded, mtime
+        logger.info(f"Каталог для подбора загружен из снимка: {len(catalog)} фильмов.")
+
+def refresh_delay():
+    """Через сколько секунд обновить каталог: сразу, если его нет или он устарел."""
+    age = time.time() - catalog.built_at
+    return max(REFRESH_INTERVAL - age, 0)
+
+async def refresh_job(context) -> None:
+    """
+    Задача JobQueue: загружает каталог из TMDB и сохраняет снимок для остальных процессов.
+    Если часть годов не загрузилась, повторяет загрузку через RETRY_INTERVAL, а не через сутки.
+    """
+    global catalog, _snapshot_mtime, _refreshing
+    if _refreshing:
+        return # Предыдущая загрузка (например, повтор после ошибки) еще идет
+    _refreshing = True
+    rate_limit.request_priority.set(rate_limit.PRIORITY_BACKGROUND)
+    started = time.monotonic()
+    try:
+        built, failed = await build(catalog if catalog.built_at else None)
+    finally:
+        _refreshing = False
+    if failed:
+        logger.error(f"Не загрузились фильмы за {len(failed)} годов ({failed[0]}-{failed[-1]}), "
+                     f"повтор через {RETRY_INTERVAL}с.")
+        context.job_queue.run_once(refresh_job, RETRY_INTERVAL)
+    if built is None:
+        logger.error("Не удалось обновить каталог для подбора, используется предыдущий.")
+        return
+    catalog = built
+    try:
+        await asyncio.to_thread(built.save_snapshot, CATALOG_FILE)
+        _snapshot_mtime = os.path.getmtime(CATALOG_FILE)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить снимок каталога для подбора: {e}")
+    logger.info(f"Каталог для подбора обновлен: {len(catalog)} фильмов за {time.monotonic() - started:.1f}с.")
+
+async def reload_job(context) -> None:
+    """Задача JobQueue: подхватывает снимок каталога, обновленный другим процессом."""
+    await load()
@@ -0,0 +1,122 @@
+import time
+import zlib
+import json
+import sqlite3
+import asyncio
+import logging
+import threading
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Дисковый уровень кэша ответов TMDB (один файл SQLite).
+# Ответы хранятся сжатыми вместе со сроками годности и читаются при старте,
+# поэтому после перезапуска бот отвечает из кэша, не обращаясь к TMDB.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    stored_at REAL NOT NULL
+)
+"""
+
+
+class DiskCache:
+    """
+    Кэш ответов в SQLite с пакетной записью.
+    put() только ставит ответ в очередь; запись на диск выполняет flush() в отдельном потоке.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._pending = {} # ключ -> строка для записи (повторные записи одного ключа схлопываются)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def put(self, key, content, ttl, stale_ttl):
+        """Ставит сырой ответ TMDB в очередь на запись."""
+        now = time.time()
+        self._pending[key] = (key, content, now + ttl, now + ttl + stale_ttl, now)
+
+    def load(self):
+        """
+        Читает все годные записи (блокирующий вызов, выполнять в потоке).
+        Возвращает список (ключ, данные, размер, оставшийся TTL, оставшийся stale TTL).
+        """
+        now = time.time()
+        entries = []
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses WHERE stale_until <= ?", (now,))
+            conn.commit()
+            rows = conn.execute(
+                "SELECT key, data, expires_at, stale_until FROM responses ORDER BY stored_at"
+            ).fetchall()
+        for key, blob, expires_at, stale_until in rows:
+            try:
+                content = zlib.decompress(blob)
+                data = json.loads(content)
+            except (zlib.error, ValueError) as e:
+                logger.warning(f"Поврежденная запись дискового кэша {key}: {e}")
+                continue
+            ttl = max(expires_at - now, 0)
+            entries.append((key, data, len(content), ttl, stale_until - now - ttl))
+        return entries
+
+    def _write(self, rows):
+        compressed = [(key, zlib.compress(content), expires_at, stale_until, stored_at)
+                      for key, content, expires_at, stale_until, stored_at in rows]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO responses (key, data, size, expires_at, stale_until, stored_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(key, blob, len(blob), expires_at, stale_until, stored_at)
+                     for key, blob, expires_at, stale_until, stored_at in compressed],
+                )
+                self._evict(conn)
+
+    def _evict(self, conn):
+        """Удаляет просроченные записи и самые старые, пока размер файла выше лимита."""
+        conn.execute("DELETE FROM responses WHERE stale_until <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evict_keys = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY stored_at"):
+            if total <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        logger.info(f"Из дискового кэша вытеснено {len(evict_keys)} записей.")
+
+    async def flush(self):
+        """Записывает накопленные ответы одной транзакцией в отдельном потоке."""
+        if not self._pending:
+            return
+        rows = list(self._pending.values())
+        self._pending.clear()
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось записать {len(rows)} ответов в дисковый кэш {self.path}: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
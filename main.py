@@ -2,10 +2,20 @@ import logging
 import os
 import asyncio # Импорт asyncio для gather
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler # Импорт CallbackQueryHandler
+from telegram import Update
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, TypeHandler # Импорт CallbackQueryHandler
 
 # Импорт обработчиков из bot_logic
 import bot_logic
+import tmdb_api
+import poster_cache
+import rate_limit
+import shared_cache
+import title_index
+import discover_catalog
+import traffic_recorder
+from persistence import CompactPersistence
+from update_processor import ChatOrderedUpdateProcessor
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,23 +25,25 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    """Запускает бота."""
-    # Загрузка переменных окружения из файла .env
-    load_dotenv()
-    TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    TMDB_API_KEY = os.getenv('TMDB_API_KEY') # Загружаем ключ TMDB для проверки его наличия
-
-    if not TELEGRAM_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN не найден в переменных окружения. Выход.")
-        return
-    if not TMDB_API_KEY:
-        logger.error("TMDB_API_KEY не найден в переменных окружения. Проверьте файл .env, но продолжаем...")
-        # Разрешаем продолжение, но вызовы API будут неудачными
-
-    # Создание Application и передача токена вашего бота.
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+load_dotenv()
+# Режим приема обновлений: 'polling' (по умолчанию) или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '') # Публичный адрес, на который Telegram будет отправлять обновления
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')) # 1-100, параллельные соединения от Telegram
+# Адрес Bot API (можно указать локальный Bot API сервер или заглушку для тестов)
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', '')
+# Число процессов-обработчиков; при значении больше 1 обновления распределяются по чатам (см. sharding.py)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
 
+def register_handlers(application: Application) -> None:
+    """Регистрирует все обработчики бота в приложении."""
+    # Запись трафика для воспроизведения (TRAFFIC_RECORD_FILE) - до всех остальных обработчиков
+    if traffic_recorder.recorder is not None:
+        application.add_handler(TypeHandler(Update, traffic_recorder.record_update), group=-1)
     # --- Регистрация обработчиков ---
     # Основные команды
     application.add_handler(CommandHandler("start", bot_logic.start))
@@ -48,6 +60,9 @@ def main() -> None:
     # --- Обработчики Callback Query ---
     application.add_handler(bot_logic.pagination_handler) # Обрабатывает кнопки next/prev
 
+    # --- Inline режим (@бот название) ---
+    application.add_handler(bot_logic.inline_query_handler)
+
     # --- Обработчики сообщений для кнопок ---
     # Их следует добавлять после CommandHandlers и ConversationHandlers,
     # чтобы команды вроде /start имели приоритет над текстом кнопок
@@ -58,14 +73,121 @@ def main() -> None:
 
     # Примечание: команда cancel зарегистрирована в fallbacks ConversationHandler
 
+async def post_init(application: Application, primary=True) -> None:
+    """
+    Прогревает кэши и планирует их обновление до начала опроса.
+    primary=False - один из нескольких процессов, не главный: общие для всех процессов задачи
+    (обновление кэшей TMDB, сохранение кэша постеров, очистку общего кэша) он не выполняет.
+    """
+    poster_cache.load()
+    await tmdb_api.load_disk_cache() # До прогрева, чтобы не запрашивать то, что уже есть на диске
+    await title_index.load()
+    await discover_catalog.load()
+    await bot_logic.warm_up_caches()
+    if tmdb_api.disk_tier is not None:
+        application.job_queue.run_repeating(tmdb_api.flush_disk_cache_job, interval=tmdb_api.DISK_CACHE_FLUSH_INTERVAL)
+    application.job_queue.run_repeating(rate_limit.log_stats_job, interval=rate_limit.STATS_LOG_INTERVAL, first=rate_limit.STATS_LOG_INTERVAL)
+    if not primary:
+        # Каталог для подбора загружает первый обработчик, остальные подхватывают его снимок
+        application.job_queue.run_repeating(discover_catalog.reload_job, interval=discover_catalog.RELOAD_INTERVAL)
+        return
+    bot_logic.schedule_cache_refresh(application.job_queue)
+    application.job_queue.run_repeating(
+        discover_catalog.refresh_job, interval=discover_catalog.REFRESH_INTERVAL, first=discover_catalog.refresh_delay()
+    )
+    application.job_queue.run_repeating(poster_cache.save_job, interval=poster_cache.SAVE_INTERVAL, first=poster_cache.SAVE_INTERVAL)
+    if shared_cache.backend is not None:
+        application.job_queue.run_repeating(shared_cache.purge_job, interval=shared_cache.PURGE_INTERVAL)
+
+async def post_shutdown(application: Application, primary=True) -> None:
+    """Освобождает ресурсы после остановки бота."""
+    if primary:
+        await poster_cache.save()
+    await tmdb_api.close_transport()
+    traffic_recorder.close()
+
+def webhook_settings() -> dict:
+    """Параметры webhook сервера из переменных окружения (общие для Application и sharding.py)."""
+    if not WEBHOOK_URL:
+        raise ValueError("Для BOT_MODE=webhook нужно указать WEBHOOK_URL.")
+    if not WEBHOOK_SECRET_TOKEN:
+        logger.warning("WEBHOOK_SECRET_TOKEN не задан - запросы к webhook не проверяются.")
+    logger.info(f"Запуск webhook сервера на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+    return {
+        'listen': WEBHOOK_LISTEN,
+        'port': WEBHOOK_PORT,
+        'url_path': WEBHOOK_PATH,
+        'webhook_url': f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        'secret_token': WEBHOOK_SECRET_TOKEN or None,
+        'max_connections': WEBHOOK_MAX_CONNECTIONS,
+        'allowed_updates': Update.ALL_TYPES,
+    }
+
+def run_webhook(application: Application) -> None:
+    """
+    Запускает встроенный HTTP сервер для приема обновлений через webhook.
+    Сервер только проверяет секретный токен, кладет обновление в очередь и сразу отвечает 200,
+    а обработка идет независимо от приема.
+    """
+    application.run_webhook(**webhook_settings())
+
+def build_application(token, updater=True, update_processor=None) -> Application:
+    """
+    Создает Application со всеми обработчиками.
+    updater=False - без собственного приема обновлений (их передает процесс-маршрутизатор, см. sharding.py).
+    update_processor - замена ChatOrderedUpdateProcessor (например, с замером времени обработки в benchmark.py).
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .rate_limiter(rate_limit.TelegramRateLimiter())
+        .persistence(CompactPersistence())
+        # Разные чаты обрабатываются параллельно, обновления одного чата - по порядку
+        .concurrent_updates(update_processor or ChatOrderedUpdateProcessor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_BASE_URL.rstrip('/')}/bot").base_file_url(f"{TELEGRAM_BASE_URL.rstrip('/')}/file/bot")
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    register_handlers(application)
+    return application
+
+def main() -> None:
+    """Запускает бота."""
+    # Загрузка переменных окружения из файла .env
+    load_dotenv()
+    TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+    TMDB_API_KEY = os.getenv('TMDB_API_KEY') # Загружаем ключ TMDB для проверки его наличия
+
+    if not TELEGRAM_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN не найден в переменных окружения. Выход.")
+        return
+    if not TMDB_API_KEY:
+        logger.error("TMDB_API_KEY не найден в переменных окружения. Проверьте файл .env, но продолжаем...")
+        # Разрешаем продолжение, но вызовы API будут неудачными
+
+    if BOT_WORKERS > 1:
+        # Несколько процессов: этот принимает обновления и распределяет их по чатам
+        import sharding
+        sharding.run(TELEGRAM_TOKEN, BOT_WORKERS)
+        logger.info("Бот остановлен.")
+        return
+
+    # Создание Application и передача токена вашего бота.
+    application = build_application(TELEGRAM_TOKEN)
+
     logger.info("Обработчики бота зарегистрированы.")
 
-    # Запуск бота до нажатия Ctrl-C
-    logger.info("Запуск опроса бота...")
-    # Предварительная загрузка кэшей перед запуском опроса (опционально, но хорошая практика)
-    # asyncio.run(bot_logic.ensure_api_config_cached()) # Уже вызывается в обработчике start
-    # asyncio.run(bot_logic.ensure_genres_cached()) # Уже вызывается в обработчике start
-    application.run_polling()
+    # Запуск бота до нажатия Ctrl-C (или SIGTERM) - кэши прогреваются в post_init до начала приема обновлений
+    if BOT_MODE == 'webhook':
+        run_webhook(application)
+    else:
+        logger.info("Запуск опроса бота...")
+        application.run_polling()
     logger.info("Бот остановлен.")
 
 if __name__ == "__main__":
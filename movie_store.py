@@ -0,0 +1,106 @@
+import logging
+from collections import OrderedDict
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Общее хранилище записей о фильмах для всех пользователей.
+# Кнопки пагинации ссылаются на фильмы по ID, сами данные - здесь, по одной копии на фильм.
+MAX_RECORDS = 50000
+CAST_SIZE = 3 # Сколько актеров показывать в карточке
+
+
+class MovieRecord:
+    """Компактная запись о фильме только с полями, нужными для карточки."""
+
+    __slots__ = (
+        'id', 'title', 'original_title', 'overview', 'release_date',
+        'vote_average', 'vote_count', 'genres', 'genre_ids', 'runtime',
+        'poster_path', 'popularity', 'directors', 'cast', 'detailed', 'revision',
+    )
+
+    def __init__(self, movie_id):
+        self.id = movie_id
+        self.title = 'N/A'
+        self.original_title = ''
+        self.overview = 'Описание недоступно.'
+        self.release_date = 'N/A'
+        self.vote_average = 0.0
+        self.vote_count = 0
+        self.genres = () # Названия жанров (есть только в детальном ответе)
+        self.genre_ids = () # ID жанров (есть в списках)
+        self.runtime = 0
+        self.poster_path = None
+        self.popularity = 0.0
+        self.directors = () # Из credits детального ответа
+        self.cast = ()
+        self.detailed = False # Получен детальный ответ /movie/{id} (жанры, длительность, актеры)
+        self.revision = 0 # Увеличивается при каждом изменении полей (для кэша карточек)
+
+    def _snapshot(self):
+        return (self.title, self.original_title, self.overview, self.release_date, self.vote_average,
+                self.vote_count, self.genres, self.genre_ids, self.runtime, self.poster_path,
+                self.directors, self.cast)
+
+    def update_from_api(self, data):
+        """Обновляет поля из словаря TMDB, не затирая уже известные значения отсутствующими."""
+        before = self._snapshot()
+        if data.get('title'):
+            self.title = data['title']
+        if data.get('original_title'):
+            self.original_title = data['original_title']
+        if data.get('overview'):
+            self.overview = data['overview']
+        if data.get('release_date'):
+            self.release_date = data['release_date']
+        if 'vote_average' in data:
+            self.vote_average = data['vote_average'] or 0.0
+        if 'vote_count' in data:
+            self.vote_count = data['vote_count'] or 0
+        if data.get('genres'):
+            self.genres = tuple(g['name'] for g in data['genres'])
+            self.genre_ids = tuple(g['id'] for g in data['genres'])
+        elif data.get('genre_ids'):
+            self.genre_ids = tuple(data['genre_ids'])
+        if data.get('runtime'):
+            self.runtime = data['runtime']
+        if data.get('poster_path'):
+            self.poster_path = data['poster_path']
+        if 'popularity' in data:
+            self.popularity = data['popularity'] or 0.0
+        if data.get('credits'):
+            credits = data['credits']
+            self.directors = tuple(p['name'] for p in credits.get('crew', []) if p.get('job') == 'Director')
+            self.cast = tuple(p['name'] for p in credits.get('cast', [])[:CAST_SIZE])
+        if 'genres' in data: # Есть только в детальном ответе (в списках - genre_ids)
+            self.detailed = True
+        if self._snapshot() != before:
+            self.revision += 1
+
+
+_RECORDS = OrderedDict() # id -> MovieRecord, в порядке последнего использования
+
+def get(movie_id):
+    """Возвращает запись о фильме или None, если ее нет в хранилище."""
+    record = _RECORDS.get(movie_id)
+    if record is not None:
+        _RECORDS.move_to_end(movie_id)
+    return record
+
+def put(data):
+    """Добавляет или обновляет запись по словарю TMDB и возвращает ее."""
+    movie_id = data['id']
+    record = _RECORDS.get(movie_id)
+    if record is None:
+        record = MovieRecord(movie_id)
+        _RECORDS[movie_id] = record
+        if len(_RECORDS) > MAX_RECORDS:
+            _RECORDS.popitem(last=False)
+    else:
+        _RECORDS.move_to_end(movie_id)
+    record.update_from_api(data)
+    return record
+
+def stats():
+    """Возвращает число записей в хранилище."""
+    return {'records': len(_RECORDS), 'max_records': MAX_RECORDS}
@@ -0,0 +1,151 @@
+import os
+import base64
+import hashlib
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from persistence import STATE_FILE
+import traffic_recorder
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Самоописываемые callback_data для кнопок пагинации.
+# Кнопка хранит источник, параметры запроса, страницу TMDB и позицию на ней:
+#     pg:<источник>:<страница>:<позиция>:<параметры>
+# поэтому карточку может построить любой процесс по общим кэшам, без данных пользователя в памяти.
+PREFIX = 'pg:'
+MAX_CALLBACK_BYTES = 64 # Ограничение Telegram на callback_data
+LAST_OFFSET = -1 # Позиция "последний фильм страницы" (для перехода назад на предыдущую страницу)
+
+SOURCE_CODES = {
+    'search': 's',
+    'title': 'l', # Локальный индекс названий (title_index.py)
+    'discover': 'd',
+    'popular': 'p',
+    'top_rated': 't',
+    'upcoming': 'u',
+}
+_SOURCES = {code: source for source, code in SOURCE_CODES.items()}
+
+# Критерии подбора, которые кодируются прямо в кнопке (через точку, пустое значение - не задан)
+_DISCOVER_FIELDS = ('with_genres', 'primary_release_year', 'vote_average.gte')
+
+# Длинные поисковые запросы заменяются коротким хэшем, а сам запрос хранится в общей таблице
+HANDLES_FILE = os.getenv('QUERY_HANDLES_FILE', STATE_FILE)
+MAX_MEMORY_HANDLES = 10000
+
+
+class QueryHandleStore:
+    """Таблица "хэш -> поисковый запрос" в SQLite с кэшем последних запросов в памяти."""
+
+    def __init__(self, path=HANDLES_FILE):
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS query_handles (handle TEXT PRIMARY KEY, query TEXT NOT NULL)")
+        return self._conn
+
+    def _remember(self, handle, query):
+        self._memory[handle] = query
+        self._memory.move_to_end(handle)
+        if len(self._memory) > MAX_MEMORY_HANDLES:
+            self._memory.popitem(last=False)
+
+    def _write(self, handle, query):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO query_handles (handle, query) VALUES (?, ?)", (handle, query))
+
+    def _read(self, handle):
+        with self._lock:
+            row = self._connect().execute("SELECT query FROM query_handles WHERE handle = ?", (handle,)).fetchone()
+        return row[0] if row else None
+
+    async def put(self, query):
+        handle = base64.urlsafe_b64encode(hashlib.blake2b(query.encode('utf-8'), digest_size=9).digest()).decode('ascii')
+        if handle not in self._memory:
+            try:
+                await asyncio.to_thread(self._write, handle, query)
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось сохранить поисковый запрос для кнопок пагинации: {e}")
+        self._remember(handle, query)
+        traffic_recorder.record_handle(handle, query)
+        return handle
+
+    async def get(self, handle):
+        query = self._memory.get(handle)
+        if query is None:
+            try:
+                query = await asyncio.to_thread(self._read, handle)
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось прочитать поисковый запрос {handle}: {e}")
+            if query is not None:
+                self._remember(handle, query)
+        if query is not None:
+            traffic_recorder.record_handle(handle, query)
+        return query
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+query_handles = QueryHandleStore()
+
+
+def _encode_discover(criteria):
+    return '.'.join(str(criteria.get(field, '')) for field in _DISCOVER_FIELDS)
+
+def _decode_discover(arg):
+    values = arg.split('.')
+    if len(values) != len(_DISCOVER_FIELDS):
+        raise ValueError(f"Неверные критерии подбора: {arg}")
+    return {'criteria': {field: int(value) for field, value in zip(_DISCOVER_FIELDS, values) if value}}
+
+async def encode(source, args, page, offset):
+    """Кодирует позицию в списке результатов в callback_data (не длиннее 64 байт)."""
+    data = f"{PREFIX}{SOURCE_CODES[source]}:{page}:{offset}:"
+    if source in ('search', 'title'):
+        query = args['query']
+        if len(data.encode('utf-8')) + 1 + len(query.encode('utf-8')) <= MAX_CALLBACK_BYTES:
+            data += 'q' + query
+        else:
+            data += 'h' + await query_handles.put(query)
+    elif source == 'discover':
+        data += _encode_discover(args['criteria'])
+    return data
+
+async def decode(data):
+    """
+    Разбирает callback_data кнопки пагинации.
+    Возвращает (источник, параметры, страница, позиция) или None, если данные не разобрать.
+    """
+    try:
+        code, page, offset, arg = data[len(PREFIX):].split(':', 3)
+        source = _SOURCES[code]
+        page, offset = int(page), int(offset)
+        if source in ('search', 'title'):
+            query = arg[1:] if arg.startswith('q') else await query_handles.get(arg[1:])
+            if not query:
+                return None
+            args = {'query': query}
+        elif source == 'discover':
+            args = _decode_discover(arg)
+        else:
+            args = {}
+    except (ValueError, KeyError) as e:
+        logger.error(f"Ошибка разбора callback_data пагинации '{data}': {e}")
+        return None
+    return source, args, page, offset
@@ -0,0 +1,214 @@
+import os
+import json
+import sqlite3
+import asyncio
+import logging
+import threading
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Сохранение user_data и состояний диалогов между перезапусками.
+# В user_data хранятся только критерии подбора (позиция пагинации - в самих кнопках), поэтому записи маленькие.
+STATE_FILE = os.getenv('BOT_STATE_FILE', 'bot_state.sqlite3')
+UPDATE_INTERVAL = 30 # Как часто Application передает изменения в persistence (сек.)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    conv_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, conv_key)
+);
+"""
+
+def encode_user_data(data):
+    """Кодирует user_data в компактный JSON."""
+    if isinstance(data, LazyUserData):
+        # json читает содержимое dict напрямую, минуя методы LazyUserData, и не декодированные данные потерялись бы
+        data = dict(data.items())
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+def decode_user_data(blob):
+    return json.loads(blob)
+
+
+class LazyUserData(dict):
+    """
+    user_data, которая декодируется из сохраненного JSON только при первом обращении.
+    Так при старте не нужно разбирать данные всех пользователей сразу.
+    """
+
+    __slots__ = ('_blob',)
+
+    def __init__(self, blob):
+        super().__init__()
+        self._blob = blob
+
+    def _materialize(self):
+        if getattr(self, '_blob', None) is not None:
+            blob, self._blob = self._blob, None
+            dict.update(self, decode_user_data(blob))
+
+
+def _lazy_method(name):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._materialize()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__', '__len__',
+              '__eq__', '__repr__', '__reduce_ex__', 'get', 'keys', 'items', 'values', 'pop',
+              'popitem', 'setdefault', 'update', 'clear', 'copy'):
+    setattr(LazyUserData, _name, _lazy_method(_name))
+
+
+class CompactPersistence(BasePersistence):
+    """
+    Persistence для Application на SQLite с отложенной пакетной записью.
+    Изменения накапливаются в памяти (повторные изменения одного пользователя схлопываются)
+    и записываются одной транзакцией после каждого прохода Application.update_persistence.
+    """
+
+    def __init__(self, path=STATE_FILE, update_interval=UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._dirty_users = {} # user_id -> JSON или None (удалить)
+        self._dirty_conversations = {} # (имя, ключ) -> JSON состояния или None (удалить)
+        self._flush_task = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _read(self, query, args=()):
+        with self._lock:
+            return self._connect().execute(query, args).fetchall()
+
+    # --- Загрузка ---
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(self._read, "SELECT user_id, data FROM user_data")
+        logger.info(f"Загружены сохраненные данные {len(rows)} пользователей (декодируются при обращении).")
+        return {user_id: LazyUserData(blob) for user_id, blob in rows}
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(self._read, "SELECT conv_key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass # Данные в памяти всегда актуальны, на диске - их копия
+
+    # --- Накопление изменений ---
+
+    async def update_user_data(self, user_id, data):
+        self._dirty_users[user_id] = encode_user_data(data)
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        self._dirty_conversations[(name, json.dumps(list(key)))] = None if new_state is None else json.dumps(new_state)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Application вызывает update_* для всех изменившихся пользователей разом;
+        # запись запускается после них, чтобы попасть в одну транзакцию
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    # --- Запись ---
+
+    def _write(self, users, conversations):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                    [(uid, blob) for uid, blob in users.items() if blob is not None],
+                )
+                conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?",
+                    [(uid,) for uid, blob in users.items() if blob is None],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, conv_key, state) VALUES (?, ?, ?)",
+                    [(name, key, state) for (name, key), state in conversations.items() if state is not None],
+                )
+                conn.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND conv_key = ?",
+                    [(name, key) for (name, key), state in conversations.items() if state is None],
+                )
+
+    async def _write_pending(self):
+        await asyncio.sleep(0) # Даем остальным update_* этого прохода добавить свои изменения
+        if not self._dirty_users and not self._dirty_conversations:
+            return
+        users, self._dirty_users = self._dirty_users, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        try:
+            await asyncio.to_thread(self._write, users, conversations)
+            logger.info(f"Сохранено состояние {len(users)} пользователей и {len(conversations)} диалогов.")
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось сохранить состояние в {self.path}: {e}")
+            # Возвращаем несохраненное, не затирая более новые изменения
+            self._dirty_users = {**users, **self._dirty_users}
+            self._dirty_conversations = {**conversations, **self._dirty_conversations}
+
+    async def flush(self):
+        """Записывает все накопленные изменения (вызывается при остановке бота)."""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- Не используется: chat_data, bot_data и callback_data не сохраняются ---
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
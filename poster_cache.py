@@ -0,0 +1,108 @@
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+import shared_cache
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Кэш file_id постеров, которые Telegram уже скачал и сохранил у себя.
+# Повторная отправка по file_id не заставляет Telegram заново загружать картинку с TMDB.
+CACHE_FILE = os.getenv('POSTER_CACHE_FILE', 'poster_file_ids.json')
+MAX_ENTRIES = 100000
+SAVE_INTERVAL = 300 # Как часто сохранять кэш на диск (сек.)
+SHARED_TTL = 30 * 24 * 3600 # Сколько хранить file_id в общем кэше процессов (сек.)
+
+_FILE_IDS = OrderedDict() # "размер/путь_постера" -> file_id
+_dirty = False
+
+def poster_key(poster_url):
+    """Строит ключ из размера и пути постера (не зависит от базового URL изображений)."""
+    size, path = poster_url.rsplit('/', 2)[-2:]
+    return f"{size}/{path}"
+
+def get(poster_url):
+    """Возвращает сохраненный file_id для постера или None."""
+    key = poster_key(poster_url)
+    file_id = _FILE_IDS.get(key)
+    if file_id is not None:
+        _FILE_IDS.move_to_end(key)
+    return file_id
+
+def remember(poster_url, message):
+    """Запоминает file_id самого большого размера фото из отправленного сообщения."""
+    global _dirty
+    photo = getattr(message, 'photo', None)
+    if not photo:
+        return
+    _FILE_IDS[poster_key(poster_url)] = photo[-1].file_id
+    _FILE_IDS.move_to_end(poster_key(poster_url))
+    if len(_FILE_IDS) > MAX_ENTRIES:
+        _FILE_IDS.popitem(last=False)
+    _dirty = True
+
+def forget(poster_url):
+    """Удаляет file_id, который Telegram отклонил."""
+    global _dirty
+    if _FILE_IDS.pop(poster_key(poster_url), None) is not None:
+        _dirty = True
+
+async def fetch(poster_url):
+    """Как get(), но при промахе ищет file_id в общем кэше процессов (shared_cache.py)."""
+    file_id = get(poster_url)
+    if file_id is not None or shared_cache.backend is None:
+        return file_id
+    entry = await shared_cache.get('poster', poster_key(poster_url))
+    if entry is None:
+        return None
+    file_id = entry[0]
+    _FILE_IDS[poster_key(poster_url)] = file_id
+    if len(_FILE_IDS) > MAX_ENTRIES:
+        _FILE_IDS.popitem(last=False)
+    return file_id
+
+async def share(poster_url):
+    """Передает в общий кэш процессов текущее значение file_id постера (или его удаление)."""
+    if shared_cache.backend is None:
+        return
+    key = poster_key(poster_url)
+    file_id = _FILE_IDS.get(key)
+    if file_id is None:
+        await shared_cache.delete('poster', key)
+    else:
+        await shared_cache.put('poster', key, file_id, SHARED_TTL)
+
+def load():
+    """Загружает кэш с диска (при старте бота)."""
+    try:
+        with open(CACHE_FILE, encoding='utf-8') as f:
+            _FILE_IDS.update(json.load(f))
+        logger.info(f"Загружено {len(_FILE_IDS)} file_id постеров из {CACHE_FILE}.")
+    except FileNotFoundError:
+        logger.info(f"Файл кэша постеров {CACHE_FILE} не найден, начинаем с пустого кэша.")
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось загрузить кэш постеров из {CACHE_FILE}: {e}")
+
+def _write(snapshot):
+    tmp_file = f"{CACHE_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_file, CACHE_FILE) # Атомарная замена, чтобы не оставить поврежденный файл
+
+async def save():
+    """Сохраняет кэш на диск в отдельном потоке, если он изменился."""
+    global _dirty
+    if not _dirty:
+        return
+    _dirty = False
+    try:
+        await asyncio.to_thread(_write, dict(_FILE_IDS))
+    except OSError as e:
+        _dirty = True
+        logger.error(f"Не удалось сохранить кэш постеров в {CACHE_FILE}: {e}")
+
+async def save_job(context) -> None:
+    """Задача JobQueue для периодического сохранения кэша."""
+    await save()
@@ -0,0 +1,261 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import contextvars
+from dotenv import load_dotenv
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Приоритеты: меньшее значение обслуживается раньше
+PRIORITY_INTERACTIVE = 0 # Ответ на действие пользователя (команда, пагинация)
+PRIORITY_BACKGROUND = 10 # Фоновая подгрузка страниц и обновление кэшей
+
+# Приоритет текущей задачи. Фоновые задачи устанавливают PRIORITY_BACKGROUND,
+# и он наследуется всеми запросами к TMDB, сделанными внутри них.
+request_priority = contextvars.ContextVar('request_priority', default=PRIORITY_INTERACTIVE)
+
+# Лимиты (запросов в секунду и размер всплеска).
+# Общие лимиты делятся поровну между процессами бота (BOT_WORKERS, см. sharding.py);
+# лимиты чатов не делятся, т.к. каждый чат обслуживает только один процесс.
+WORKERS = max(int(os.getenv('BOT_WORKERS', '1')), 1)
+TMDB_RATE = float(os.getenv('TMDB_RATE_LIMIT', '40')) / WORKERS
+TMDB_BURST = max(int(os.getenv('TMDB_RATE_BURST', '40')) // WORKERS, 1)
+TELEGRAM_RATE = float(os.getenv('TELEGRAM_RATE_LIMIT', '30')) / WORKERS # Общий лимит бота
+TELEGRAM_CHAT_RATE = 1.0 # Личные чаты: ~1 сообщение в секунду с небольшими всплесками
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_RATE = 20 / 60 # Группы: не более 20 сообщений в минуту
+TELEGRAM_GROUP_BURST = 5
+TELEGRAM_MAX_RETRIES = 3 # Сколько раз повторять запрос после RetryAfter
+STATS_LOG_INTERVAL = 600 # Как часто писать в лог задержки в очередях ограничителей (сек.)
+
+
+def run_in_background(coro):
+    """Оборачивает корутину так, чтобы ее запросы шли с фоновым приоритетом."""
+    async def wrapper():
+        request_priority.set(PRIORITY_BACKGROUND)
+        return await coro
+    return wrapper()
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket с очередью ожидания по приоритетам.
+    Пока есть ожидающие, новые запросы встают в очередь, а не обгоняют их.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._waiters = [] # куча (приоритет, порядковый номер, future)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def queued(self):
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    @property
+    def idle(self):
+        """Корзина полна и никто не ждет - ее можно удалить без потери состояния."""
+        self._refill()
+        return not self._waiters and self._tokens >= self.capacity
+
+    def pause(self, seconds):
+        """Приостанавливает выдачу токенов (например, после RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Ждет токен и возвращает время ожидания в секундах."""
+        self._refill()
+        if not self._waiters and self._tokens >= 1 and time.monotonic() >= self._paused_until:
+            self._tokens -= 1
+            return 0.0
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._schedule_dispatch()
+        await future # При отмене future помечается отмененным и пропускается при раздаче
+        return time.monotonic() - started
+
+    def _schedule_dispatch(self):
+        if self._wakeup is not None:
+            return
+        now = time.monotonic()
+        delay = max((1 - self._tokens) / self.rate, self._paused_until - now, 0)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._wakeup = None
+        self._refill()
+        if time.monotonic() >= self._paused_until:
+            while self._waiters and self._tokens >= 1:
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self._tokens -= 1
+                future.set_result(None)
+        # Убираем отмененных ожидающих из головы очереди
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._waiters:
+            self._schedule_dispatch()
+
+
+class QueueStats:
+    """Статистика задержки в очереди ограничителя."""
+
+    def __init__(self):
+        self.requests = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited):
+        self.requests += 1
+        if waited > 0:
+            self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'delayed': self.delayed,
+            'avg_wait': self.total_wait / self.delayed if self.delayed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class TMDBRateLimiter:
+    """Общий token bucket для исходящих запросов к TMDB."""
+
+    def __init__(self, rate=TMDB_RATE, burst=TMDB_BURST):
+        self.bucket = TokenBucket(rate, burst)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = QueueStats()
+        # Отдельно по приоритетам: фоновые загрузки могут ждать долго, интерактивные запросы - нет
+        self.stats_by_priority = {PRIORITY_INTERACTIVE: QueueStats(), PRIORITY_BACKGROUND: QueueStats()}
+
+    async def acquire(self):
+        priority = request_priority.get()
+        waited = await self.bucket.acquire(priority)
+        self.stats.record(waited)
+        self.stats_by_priority.setdefault(priority, QueueStats()).record(waited)
+        return waited
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats['queued'] = self.bucket.queued
+        stats['interactive'] = self.stats_by_priority[PRIORITY_INTERACTIVE].as_dict()
+        stats['background'] = self.stats_by_priority[PRIORITY_BACKGROUND].as_dict()
+        return stats
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель запросов к Bot API для Application.builder().rate_limiter().
+    Применяет общий лимит и лимит на чат, а RetryAfter обрабатывает сам:
+    ждет указанное время и повторяет запрос, не показывая ошибку пользователю.
+    Приоритет можно передать через rate_limit_args={'priority': ...}.
+    """
+
+    def __init__(self, max_retries=TELEGRAM_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(TELEGRAM_RATE, max(TELEGRAM_RATE, 1))
+        self.chat_buckets = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = QueueStats()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Удаляем простаивающие корзины, чтобы словарь не рос бесконечно
+                for idle_id in [cid for cid, b in self.chat_buckets.items() if b.idle]:
+                    del self.chat_buckets[idle_id]
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(TELEGRAM_GROUP_RATE, TELEGRAM_GROUP_BURST)
+            else:
+                bucket = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get('priority', request_priority.get())
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            waited = 0.0
+            if chat_id is not None:
+                waited += await self._chat_bucket(chat_id).acquire(priority)
+            waited += await self.global_bucket.acquire(priority)
+            self.stats.record(waited)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Лимит Telegram для {endpoint} превышен после {self.max_retries} повторов.")
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"RetryAfter для {endpoint} (чат {chat_id}), повтор через {retry_after}с.")
+                # Флуд-контроль действует на весь бот, поэтому приостанавливаем все отправки
+                self.global_bucket.pause(retry_after)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(retry_after)
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats['queued'] = self.global_bucket.queued + sum(b.queued for b in self.chat_buckets.values())
+        stats['chats'] = len(self.chat_buckets)
+        return stats
+
+
+# Единственный ограничитель запросов к TMDB на процесс
+tmdb_limiter = TMDBRateLimiter()
+
+def _format_stats(stats):
+    return f"{stats['requests']} запросов, ждали {stats['delayed']}, в среднем {stats['avg_wait']:.2f}с, максимум {stats['max_wait']:.2f}с"
+
+async def log_stats_job(context) -> None:
+    """Задача JobQueue: пишет в лог задержки в очередях ограничителей за интервал и обнуляет счетчики."""
+    tmdb = tmdb_limiter.get_stats()
+    logger.info(f"Очередь TMDB: {_format_stats(tmdb)} (фоновые: {_format_stats(tmdb['background'])}), сейчас ждут {tmdb['queued']}.")
+    tmdb_limiter.reset_stats()
+    telegram = context.bot.rate_limiter
+    if isinstance(telegram, TelegramRateLimiter):
+        stats = telegram.get_stats()
+        logger.info(f"Очередь Telegram: {_format_stats(stats)}, сейчас ждут {stats['queued']}.")
+        telegram.reset_stats()
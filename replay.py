@@ -0,0 +1,238 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from urllib.parse import urlsplit, parse_qs
+from benchmark import (
+    BOT_TOKEN, FakeServer, FakeTelegram, QuietHandler, LatencyRecorder,
+    make_processor_class, configure_environment, start_webhook, rss_bytes,
+)
+
+# Воспроизведение трассы, записанной traffic_recorder.py: обновления передаются настоящему Application
+# в исходном темпе (или быстрее в N раз), а TMDB заменяется заглушкой с записанными ответами.
+#     python replay.py trace.jsonl --speed 10 --output replay.json
+# Отчет - JSON в том же формате, что у benchmark.py, плюс отставание от расписания и промахи по записанным ответам.
+
+logger = logging.getLogger('replay')
+
+
+def _open_trace(path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+def read_traces(paths):
+    """
+    Читает трассы (несколько файлов - от нескольких процессов).
+    Возвращает (обновления по времени, ответы TMDB, поисковые запросы по хэшам кнопок пагинации).
+    """
+    updates, responses, handles = [], {}, {}
+    for path in paths:
+        with _open_trace(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # Последняя строка могла не дописаться при остановке
+                if record.get('type') == 'update':
+                    updates.append((record['ts'], record['update']))
+                elif record.get('type') == 'tmdb':
+                    responses.setdefault(record['key'], record['body'])
+                elif record.get('type') == 'handle':
+                    handles[record['handle']] = record['query']
+    updates.sort(key=lambda item: item[0])
+    return updates, responses, handles
+
+def update_kind(payload):
+    """Вид обновления для отчета: команда, префикс callback_data, текст, inline запрос."""
+    if 'message' in payload:
+        text = payload['message'].get('text') or ''
+        return text.split()[0].split('@')[0] if text.startswith('/') else 'text'
+    if 'callback_query' in payload:
+        data = payload['callback_query'].get('data') or ''
+        return 'callback:' + (data.split(':', 1)[0] if ':' in data else data.split('_', 1)[0])
+    return next((key for key in payload if key != 'update_id'), 'unknown')
+
+
+class _RecordedTMDBHandler(QuietHandler):
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        endpoint = url.path[len('/3'):] if url.path.startswith('/3/') else url.path
+        key = fake.cache_key(endpoint, params)
+        body = fake.responses.get(key)
+        if fake.latency:
+            time.sleep(fake.latency)
+        if body is None:
+            fake.count('misses')
+            with fake.lock:
+                fake.missing.add(key)
+            return self._send_json(404, {'status_code': 34, 'status_message': 'Not recorded'})
+        fake.count('hits')
+        self._send_json(200, body)
+
+
+class RecordedTMDB(FakeServer):
+    """Заглушка TMDB, отвечающая записанными ответами по ключу кэша tmdb_api."""
+
+    def __init__(self, responses, latency=0.0):
+        super().__init__(_RecordedTMDBHandler)
+        self.responses = responses
+        self.latency = latency
+        self.missing = set()
+        self.cache_key = None # tmdb_api._cache_key; модуль импортируется после настройки окружения
+
+
+async def run_replay(args):
+    updates, responses, handles = read_traces(args.traces)
+    if not updates:
+        raise SystemExit("В трассе нет обновлений.")
+    tmdb = RecordedTMDB(responses, args.tmdb_latency)
+    telegram = FakeTelegram(args.telegram_latency)
+    tmdb.start()
+    telegram.start()
+    workdir = tempfile.mkdtemp(prefix='tmdb-bot-replay-')
+    configure_environment(args, workdir, tmdb.url, telegram.url)
+    # Локальные каталоги с машины, где писалась трасса (иначе их запросы к TMDB не воспроизвести)
+    if args.discover_catalog:
+        os.environ['DISCOVER_CATALOG_FILE'] = args.discover_catalog
+    if args.title_index:
+        os.environ['TITLE_INDEX_SNAPSHOT'] = args.title_index
+
+    # Модули бота читают настройки при импорте
+    import main
+    import tmdb_api
+    import rate_limit
+    import pagination_codec
+    from telegram import Update
+    tmdb.cache_key = tmdb_api._cache_key # Тот же ключ, под которым ответ записан
+    logging.getLogger().setLevel(args.log_level)
+
+    processor = make_processor_class()()
+    application = main.build_application(BOT_TOKEN, updater=args.webhook, update_processor=processor)
+    errors = []
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+    application.add_error_handler(on_error)
+
+    # Хэш длинного запроса вычисляется из самого запроса, поэтому таблицу хэшей с записывавшей машины можно восстановить
+    for handle, query in handles.items():
+        if await pagination_codec.query_handles.put(query) != handle:
+            logger.warning(f"Хэш запроса {handle} из трассы не совпал с вычисленным, кнопки с ним не воспроизвести.")
+    await application.initialize()
+    await main.post_init(application, primary=False)
+    webhook = await start_webhook(application) if args.webhook else None
+    await application.start()
+    tmdb.reset_counts()
+    telegram.reset_counts()
+    rate_limit.tmdb_limiter.reset_stats()
+    application.bot.rate_limiter.reset_stats()
+
+    loop = asyncio.get_running_loop()
+    latency = LatencyRecorder()
+    lags = []
+    timeouts = 0
+
+    async def track(kind, put_at, done):
+        nonlocal timeouts
+        try:
+            latency.add(kind, await asyncio.wait_for(done, args.timeout) - put_at)
+        except asyncio.TimeoutError:
+            timeouts += 1
+
+    rss_before = rss_bytes()
+    first_ts = updates[0][0]
+    started = time.perf_counter()
+    tracking = []
+    for ts, payload in updates:
+        if args.speed > 0:
+            delay = started + (ts - first_ts) / args.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lags.append(-delay)
+        done = loop.create_future()
+        processor.waiters[payload['update_id']] = done
+        put_at = time.perf_counter()
+        if webhook is None:
+            await application.update_queue.put(Update.de_json(payload, application.bot))
+        elif not await webhook.post(payload):
+            processor.waiters.pop(payload['update_id'], None)
+            continue
+        tracking.append(asyncio.ensure_future(track(update_kind(payload), put_at, done)))
+    await asyncio.gather(*tracking)
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    tmdb_counts = tmdb.reset_counts()
+    telegram_counts = telegram.reset_counts()
+    lag = LatencyRecorder.summarize(lags)
+    lag['late_updates'] = lag.pop('count')
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'log_level')},
+        'trace': {'updates': len(updates), 'tmdb_responses': len(responses), 'query_handles': len(handles),
+                  'span_s': round(updates[-1][0] - first_ts, 3)},
+        'duration_s': round(elapsed, 3),
+        'updates': len(updates),
+        'throughput_updates_per_s': round(len(updates) / elapsed, 2) if elapsed else None,
+        'latency': latency.report(),
+        'schedule_lag': lag,
+        'timeouts': timeouts,
+        'handler_errors': len(errors),
+        'upstream': {
+            'tmdb': {'hits': tmdb_counts.get('hits', 0), 'misses': tmdb_counts.get('misses', 0),
+                     'missing_samples': sorted(tmdb.missing)[:10]},
+            'telegram': {'total': sum(telegram_counts.values()), 'by_method': telegram_counts},
+        },
+        'memory': {'rss_before_bytes': rss_before, 'rss_after_bytes': rss_after,
+                   'users_with_data': len(application.user_data)},
+        'bot': {
+            'tmdb_cache': tmdb_api.get_cache_stats(),
+            'updates': processor.get_stats(),
+            'rate_limits': {'tmdb': rate_limit.tmdb_limiter.get_stats(),
+                            'telegram': application.bot.rate_limiter.get_stats()},
+        },
+    }
+    if webhook is not None:
+        report['webhook'] = webhook.get_stats()
+        await webhook.close()
+        await application.updater.stop()
+    if errors:
+        report['handler_error_samples'] = sorted(set(errors))[:5]
+
+    await application.stop()
+    await main.post_shutdown(application, primary=False)
+    await application.shutdown()
+    tmdb.stop()
+    telegram.stop()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика бота (см. traffic_recorder.py).")
+    parser.add_argument('traces', nargs='+', help="Файлы трассы (.jsonl или .jsonl.gz), от одного или нескольких процессов")
+    parser.add_argument('--speed', type=float, default=1.0, help="Во сколько раз быстрее исходного темпа (0 - без пауз)")
+    parser.add_argument('--tmdb-latency', type=float, default=0.05, help="Задержка ответа заглушки TMDB, сек.")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="Средняя задержка ответа Bot API, сек.")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Сколько ждать обработки одного обновления, сек.")
+    parser.add_argument('--discover-catalog', help="Снимок каталога для подбора (discover_catalog.pickle) с записывавшей машины")
+    parser.add_argument('--title-index', help="Снимок индекса названий (title_index.pickle) с записывавшей машины")
+    parser.add_argument('--real-limits', action='store_true', help="Не поднимать общие лимиты запросов к TMDB и Telegram")
+    parser.add_argument('--webhook', action='store_true', help="Отправлять обновления POST запросами на webhook сервер бота")
+    parser.add_argument('--output', help="Файл для JSON отчета (по умолчанию - только stdout)")
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run_replay(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,193 @@
+import time
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import main
+import shared_cache
+from update_processor import ordering_key
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Запуск бота в нескольких процессах (BOT_WORKERS > 1).
+# Процесс-маршрутизатор получает обновления (опросом или через webhook) и передает каждое
+# процессу-обработчику по ID чата, поэтому обновления одного чата всегда обрабатывает один процесс
+# и порядок внутри чата сохраняется. Кэши TMDB и file_id постеров процессы делят через shared_cache.py.
+# Маршрутизатор следит за обработчиками: упавший перезапускается, а если он падает слишком часто,
+# бот останавливается с ошибкой, чтобы его чаты не замолчали незаметно.
+SUPERVISE_INTERVAL = 5.0 # Как часто проверять, живы ли процессы-обработчики (сек.)
+MAX_RESTARTS = 5 # Сколько перезапусков одного обработчика допускается за RESTART_WINDOW
+RESTART_WINDOW = 600.0 # (сек.)
+
+
+def shard_for(update, workers):
+    """Номер процесса-обработчика для обновления: по чату, а без чата - по пользователю."""
+    key = ordering_key(update)
+    return key[1] % workers if key is not None else 0
+
+
+# --- Процесс-обработчик ---
+
+def _worker_main(index, token, queue):
+    # Сигналы остановки получает маршрутизатор; обработчик завершается, когда тот закроет очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, token, queue))
+
+async def _run_worker(index, token, queue):
+    # Общие задачи (обновление кэшей, сохранение кэша постеров) выполняет только первый процесс
+    primary = index == 0
+    application = main.build_application(token, updater=False)
+    async with application:
+        await main.post_init(application, primary=primary)
+        await application.start()
+        logger.info(f"Обработчик {index} запущен.")
+        while True:
+            data = await asyncio.to_thread(queue.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.stop() # Дожидается обработки уже полученных обновлений
+    await main.post_shutdown(application, primary=primary)
+    logger.info(f"Обработчик {index} остановлен.")
+
+
+# --- Процесс-маршрутизатор ---
+
+class WorkerPool:
+    """Процессы-обработчики и их очереди. Упавший обработчик перезапускается с новой очередью."""
+
+    def __init__(self, token, workers):
+        self.token = token
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [None] * workers
+        self.processes = [None] * workers
+        self.restarts = [[] for _ in range(workers)] # Время последних перезапусков каждого обработчика
+        self.failed = False # Обработчик падал слишком часто, бот остановлен
+        for index in range(workers):
+            self._start(index)
+
+    def __len__(self):
+        return len(self.processes)
+
+    def _start(self, index):
+        self.queues[index] = self.context.Queue()
+        self.processes[index] = self.context.Process(
+            target=_worker_main, args=(index, self.token, self.queues[index]), name=f"bot-worker-{index}"
+        )
+        self.processes[index].start()
+
+    def put(self, index, data):
+        self.queues[index].put(data)
+
+    @staticmethod
+    def _drain(old_queue):
+        """Забирает из очереди упавшего обработчика то, что он не успел прочитать."""
+        items = []
+        while True:
+            try:
+                items.append(old_queue.get_nowait())
+            except (queue.Empty, OSError, ValueError):
+                break
+        old_queue.close()
+        old_queue.cancel_join_thread() # Не ждать при выходе записи в очередь, которую никто не читает
+        return items
+
+    def check(self):
+        """Перезапускает упавшие обработчики. Возвращает False, если какой-то падает слишком часто."""
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            recent = [t for t in self.restarts[index] if now - t < RESTART_WINDOW]
+            if len(recent) >= MAX_RESTARTS:
+                logger.critical(f"Обработчик {index} завершился с кодом {process.exitcode} уже {len(recent) + 1} раз "
+                                f"за {RESTART_WINDOW:.0f}с. Останавливаю бота.")
+                self.failed = True
+                return False
+            pending = self._drain(self.queues[index])
+            logger.error(f"Обработчик {index} завершился с кодом {process.exitcode}, перезапускаю "
+                         f"(необработанных обновлений в его очереди: {len(pending)}).")
+            self._start(index)
+            for data in pending:
+                self.put(index, data)
+            self.restarts[index] = recent + [now]
+        return True
+
+    def stop(self):
+        """Закрывает очереди (обработчики дорабатывают полученное) и ждет завершения процессов."""
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                self.put(index, None)
+        for process in self.processes:
+            process.join()
+
+
+async def _dispatch(update_queue, pool):
+    """Передает обновления из очереди Updater в очереди процессов-обработчиков."""
+    routed = [0] * len(pool)
+    while True:
+        update = await update_queue.get()
+        if update is None:
+            break
+        shard = shard_for(update, len(pool))
+        pool.put(shard, update.to_dict())
+        routed[shard] += 1
+    logger.info(f"Распределено обновлений по обработчикам: {routed}")
+
+async def _supervise(pool, stop):
+    """Проверяет обработчики, пока не пришел сигнал остановки; при частых падениях останавливает бота."""
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), SUPERVISE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        if not stop.is_set() and not pool.check():
+            stop.set()
+
+async def _route(token, pool):
+    bot_kwargs = {}
+    if main.TELEGRAM_BASE_URL:
+        base_url = main.TELEGRAM_BASE_URL.rstrip('/')
+        bot_kwargs = {'base_url': f"{base_url}/bot", 'base_file_url': f"{base_url}/file/bot"}
+    update_queue = asyncio.Queue()
+    updater = Updater(Bot(token, **bot_kwargs), update_queue)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with updater:
+        if main.BOT_MODE == 'webhook':
+            await updater.start_webhook(**main.webhook_settings())
+        else:
+            logger.info("Запуск опроса бота...")
+            await updater.start_polling()
+        dispatcher = asyncio.create_task(_dispatch(update_queue, pool))
+        supervisor = asyncio.create_task(_supervise(pool, stop))
+        await stop.wait()
+        await supervisor
+        await updater.stop()
+        await update_queue.put(None) # Обновления, полученные до остановки, еще будут переданы
+        await dispatcher
+
+def run(token, workers):
+    """Запускает процессы-обработчики и маршрутизатор в текущем процессе до сигнала остановки."""
+    if shared_cache.backend is None or isinstance(shared_cache.backend, shared_cache.MemoryBackend):
+        # Без общего файла file_id постеров, полученные не первым обработчиком, не сохраняются между запусками,
+        # а ответы TMDB каждый процесс запрашивает сам
+        raise ValueError("Для BOT_WORKERS > 1 нужно указать общий кэш на диске: SHARED_CACHE=shared_cache.sqlite3.")
+    pool = WorkerPool(token, workers)
+    logger.info(f"Запущено {workers} процессов-обработчиков.")
+    try:
+        asyncio.run(_route(token, pool))
+    finally:
+        pool.stop()
+    if pool.failed:
+        raise RuntimeError("Процесс-обработчик постоянно падает, бот остановлен (подробности - в логе выше).")
@@ -0,0 +1,173 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Общее хранилище кэшей для нескольких процессов бота (ответы TMDB, file_id постеров).
+# SHARED_CACHE:
+#     пусто            - не используется (каждый процесс держит только свои кэши)
+#     memory           - словарь в памяти процесса (замена общего хранилища для тестов)
+#     путь к файлу     - SQLite файл, общий для всех процессов на машине
+SHARED_CACHE = os.getenv('SHARED_CACHE', '')
+PURGE_INTERVAL = 600 # Как часто удалять просроченные записи (сек.)
+
+
+class MemoryBackend:
+    """Хранилище в памяти процесса с тем же интерфейсом, что и SQLiteBackend."""
+
+    def __init__(self):
+        self._entries = {} # (пространство, ключ) -> (значение, годно_до)
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        """Возвращает (значение, оставшееся время жизни в сек.) или None."""
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+        if entry is None:
+            return None
+        remaining = entry[1] - time.time()
+        return (entry[0], remaining) if remaining > 0 else None
+
+    def set(self, namespace, key, value, ttl):
+        with self._lock:
+            self._entries[(namespace, key)] = (value, time.time() + ttl)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]
+            for k in expired:
+                del self._entries[k]
+        return len(expired)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Хранилище в одном SQLite файле, общем для процессов на одной машине.
+    Режим WAL позволяет читать параллельно с записью другого процесса.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+        return self._conn
+
+    def get(self, namespace, key):
+        """Возвращает (значение, оставшееся время жизни в сек.) или None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None
+        remaining = row[1] - time.time()
+        return (row[0], remaining) if remaining > 0 else None
+
+    def set(self, namespace, key, value, ttl):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO shared_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, value, time.time() + ttl),
+                )
+
+    def delete(self, namespace, key):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def open_backend(spec=SHARED_CACHE):
+    """Создает хранилище по значению SHARED_CACHE (или None, если оно не задано)."""
+    if not spec:
+        return None
+    if spec == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(spec)
+
+# Единственное общее хранилище на процесс
+backend = open_backend()
+
+# --- Асинхронные обертки (запросы к SQLite выполняются в отдельном потоке) ---
+
+async def get(namespace, key):
+    if backend is None:
+        return None
+    try:
+        return await asyncio.to_thread(backend.get, namespace, key)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка чтения общего кэша ({namespace}): {e}")
+        return None
+
+async def put(namespace, key, value, ttl):
+    if backend is None:
+        return
+    try:
+        await asyncio.to_thread(backend.set, namespace, key, value, ttl)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка записи в общий кэш ({namespace}): {e}")
+
+async def delete(namespace, key):
+    if backend is None:
+        return
+    try:
+        await asyncio.to_thread(backend.delete, namespace, key)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка удаления из общего кэша ({namespace}): {e}")
+
+async def purge_job(context) -> None:
+    """Задача JobQueue: удаляет просроченные записи общего кэша."""
+    if backend is None:
+        return
+    try:
+        removed = await asyncio.to_thread(backend.purge)
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось очистить общий кэш: {e}")
+        return
+    if removed:
+        logger.info(f"Из общего кэша удалено {removed} просроченных записей.")
+
+def close():
+    if backend is not None:
+        backend.close()
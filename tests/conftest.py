@@ -0,0 +1,37 @@
+import os
+import sys
+
+import httpx
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit
+import tmdb_api
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Свой ограничитель без лимита, чтобы паузы после 429 не влияли на другие тесты."""
+    fresh = rate_limit.TMDBRateLimiter(rate=1000, burst=1000)
+    monkeypatch.setattr(rate_limit, 'tmdb_limiter', fresh)
+    return fresh
+
+
+@pytest.fixture
+def mock_tmdb(monkeypatch, limiter):
+    """Подменяет HTTP клиент TMDB; handler(request) -> httpx.Response. Возвращает список запросов."""
+    requests = []
+
+    def install(handler):
+        def record(request):
+            requests.append(request)
+            return handler(request)
+        transport = tmdb_api.TMDBTransport('https://tmdb.test/3', 'key')
+        transport._async_client = httpx.AsyncClient(base_url=transport.base_url, transport=httpx.MockTransport(record))
+        monkeypatch.setattr(tmdb_api, 'transport', transport)
+        return requests
+
+    monkeypatch.setattr(tmdb_api, 'MAX_RETRIES', 2)
+    return install
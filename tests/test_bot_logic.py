@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+import pytest
+
+import bot_logic
+import tmdb_api
+
+
+# --- Сборка списков из страниц TMDB ---
+
+@pytest.fixture
+def chart_pages(mock_tmdb, monkeypatch):
+    """Заглушка /movie/popular: 20 фильмов на странице, 10 страниц. Возвращает список запросов."""
+    monkeypatch.setattr(tmdb_api, 'TMDB_API_KEY', 'key')
+    monkeypatch.setattr(bot_logic, 'MIN_VOTE_COUNT', 0)
+
+    def handler(request):
+        page = int(request.url.params['page'])
+        results = [{'id': page * 100 + i, 'title': f"Фильм {page}-{i}", 'vote_count': 10} for i in range(20)]
+        return httpx.Response(200, json={'page': page, 'total_pages': 10, 'results': results})
+
+    return mock_tmdb(handler)
+
+
+def _pages(requests):
+    return sorted(int(request.url.params['page']) for request in requests)
+
+
+def test_chart_target_on_first_page_requests_one_page(chart_pages, monkeypatch):
+    monkeypatch.setattr(bot_logic, 'CHART_TARGET', 15)
+    movies = asyncio.run(bot_logic._assemble_chart('popular', refresh=True))
+    assert len(movies) == 20
+    assert _pages(chart_pages) == [1]
+
+
+def test_chart_requests_only_missing_pages(chart_pages, monkeypatch):
+    monkeypatch.setattr(bot_logic, 'CHART_TARGET', 50)
+    movies = asyncio.run(bot_logic._assemble_chart('popular', refresh=True))
+    assert len(movies) == 60
+    assert [m['id'] for m in movies[:2]] == [100, 101]
+    assert _pages(chart_pages) == [1, 2, 3]
+
+
+def test_chart_window_grows_when_filter_drops_movies(chart_pages, monkeypatch):
+    monkeypatch.setattr(bot_logic, 'CHART_TARGET', 100)
+    monkeypatch.setattr(bot_logic, 'MIN_VOTE_COUNT', 11) # Фильтр отбрасывает все фильмы
+    assert asyncio.run(bot_logic._assemble_chart('popular', refresh=True)) == []
+    assert _pages(chart_pages) == list(range(1, 11))
+
+
+# --- Детали показываемой карточки ---
+
+@pytest.fixture
+def slow_details(monkeypatch):
+    """Заглушка /movie/{id}: отвечает деталями, когда тест откроет release."""
+    state = {'calls': 0, 'release': None}
+
+    async def get_details(movie_id, append_to_response=None):
+        state['calls'] += 1
+        await state['release'].wait()
+        return {'id': movie_id, 'title': 'Начало', 'genres': [{'id': 878, 'name': 'фантастика'}], 'runtime': 148}
+
+    monkeypatch.setattr(tmdb_api, 'get_movie_details_async', get_details)
+    monkeypatch.setattr(bot_logic, 'DETAILS_WAIT', 0.05)
+    return state
+
+
+def test_card_does_not_wait_for_slow_details(slow_details):
+    list_record = {'id': 900001, 'title': 'Начало', 'genre_ids': [878], 'vote_average': 8.4}
+
+    async def run():
+        slow_details['release'] = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        movie = await bot_logic._load_movie(list_record)
+        waited = loop.time() - started
+        assert not movie.detailed
+        assert bot_logic.render_movie_card(movie)[0] # Карточка строится по данным списка
+        slow_details['release'].set()
+        await asyncio.sleep(0.01) # Запрос деталей продолжается в фоне и дополняет запись
+        return waited, movie
+
+    waited, movie = asyncio.run(run())
+    assert waited < 1.0
+    assert movie.detailed and movie.runtime == 148
+    assert slow_details['calls'] == 1
+
+
+def test_card_uses_details_that_arrive_in_time(slow_details):
+    async def run():
+        slow_details['release'] = asyncio.Event()
+        slow_details['release'].set()
+        return await bot_logic._load_movie({'id': 900002, 'title': 'Начало', 'genre_ids': [878]})
+
+    assert asyncio.run(run()).detailed
+
+
+def test_index_result_without_record_waits_for_details(slow_details):
+    async def run():
+        slow_details['release'] = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.1, slow_details['release'].set) # Дольше DETAILS_WAIT
+        return await bot_logic._load_movie({'id': 900003})
+
+    assert asyncio.run(run()).detailed
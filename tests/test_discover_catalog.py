@@ -0,0 +1,131 @@
+import asyncio
+import datetime
+
+import pytest
+
+import discover_catalog
+from discover_catalog import DiscoverCatalog
+
+DRAMA, COMEDY, WESTERN = 18, 35, 37
+
+
+def movie(movie_id, year, popularity, genres=(DRAMA,), rating=7.0):
+    return {'id': movie_id, 'title': f"Фильм {movie_id}", 'release_date': f"{year}-05-01",
+            'genre_ids': list(genres), 'vote_average': rating, 'vote_count': 1000, 'popularity': popularity}
+
+
+@pytest.fixture
+def catalog():
+    return DiscoverCatalog([
+        movie(1, 1999, 10.0, (DRAMA,), 8.0),
+        movie(2, 1999, 50.0, (COMEDY,), 6.0),
+        movie(3, 2000, 30.0, (DRAMA, COMEDY), 7.5),
+        movie(4, 2000, 40.0, (DRAMA,), 5.0),
+        movie(5, 1999, 20.0, (DRAMA,), 7.0),
+    ], built_at=1.0)
+
+
+def ids(page):
+    return [m['id'] for m in page['results']]
+
+
+# --- Подбор ---
+
+@pytest.mark.parametrize('criteria, expected', [
+    ({}, [2, 4, 3, 5, 1]),
+    ({'with_genres': DRAMA}, [4, 3, 5, 1]),
+    ({'with_genres': COMEDY, 'primary_release_year': 2000}, [3]),
+    ({'primary_release_year': 1999, 'vote_average.gte': 7}, [5, 1]),
+    ({'with_genres': DRAMA, 'vote_average.gte': 7.5}, [3, 1]),
+    ({'with_genres': WESTERN}, []), # Жанра нет ни у одного фильма
+])
+def test_query_filters_and_sorts_by_popularity(catalog, criteria, expected):
+    page = catalog.query(criteria)
+    assert ids(page) == expected
+    assert page['total_results'] == len(expected)
+    assert page['total_pages'] == 1
+
+
+def test_query_pages(monkeypatch):
+    monkeypatch.setattr(discover_catalog, 'PAGE_SIZE', 2)
+    catalog = DiscoverCatalog([movie(i, 2000, float(i)) for i in range(1, 6)], built_at=1.0)
+    pages = [catalog.query({}, page) for page in (1, 2, 3)]
+    assert [ids(page) for page in pages] == [[5, 4], [3, 2], [1]]
+    assert pages[0]['total_pages'] == 3
+
+
+def test_equal_popularity_keeps_catalog_order():
+    catalog = DiscoverCatalog([movie(i, 2000, 1.0) for i in (7, 3, 9)], built_at=1.0)
+    assert ids(catalog.query({})) == [7, 3, 9]
+
+
+def test_query_needs_api(catalog):
+    assert catalog.query({'with_genres': DRAMA, 'sort_by': 'vote_average.desc'}) is None
+    assert DiscoverCatalog().query({}) is None
+
+
+def test_match_cache_reuses_and_evicts(catalog, monkeypatch):
+    monkeypatch.setattr(discover_catalog, 'MATCH_CACHE_SIZE', 2)
+    first = catalog._cached_match(0, 1999, None)
+    assert catalog._cached_match(0, 1999, None) is first
+    catalog._cached_match(0, 2000, None)
+    catalog._cached_match(0, 1999, None) # Самый свежий
+    catalog._cached_match(0, None, 7)
+    assert list(catalog._matches) == [(0, 1999, None), (0, None, 7)]
+    assert ids(catalog.query({'primary_release_year': 2000})) == [4, 3]
+
+
+def test_snapshot_roundtrip(catalog, tmp_path):
+    path = str(tmp_path / 'catalog.pickle')
+    catalog.save_snapshot(path)
+    loaded = DiscoverCatalog.from_snapshot(path)
+    assert loaded.built_at == catalog.built_at
+    assert ids(loaded.query({'with_genres': COMEDY})) == ids(catalog.query({'with_genres': COMEDY}))
+
+
+# --- Загрузка из TMDB ---
+
+@pytest.fixture
+def crawl(monkeypatch):
+    """Заглушка загрузки по годам: за последние два года по одному фильму; годы из failed не загружаются."""
+    this_year = datetime.date.today().year
+    state = {'failed': set(), 'calls': 0}
+
+    async def fetch(criteria, page=1):
+        state['calls'] += 1
+        year = criteria['primary_release_year']
+        if year in state['failed']:
+            return None
+        results = [movie(year, year, float(year))] if year >= this_year else []
+        return {'page': page, 'total_pages': 1, 'results': results}
+
+    monkeypatch.setattr(discover_catalog, 'FIRST_YEAR', this_year - 1)
+    monkeypatch.setattr(discover_catalog, 'CRAWL_RETRY_DELAY', 0)
+    monkeypatch.setattr(discover_catalog.tmdb_api, 'crawl_discover_movies_async', fetch)
+    state['years'] = [this_year - 1, this_year, this_year + 1]
+    return state
+
+
+def test_build_all_years(crawl):
+    built, failed = asyncio.run(discover_catalog.build())
+    assert failed == []
+    assert sorted(built.ids.tolist()) == crawl['years'][1:]
+    assert built.built_at > 0
+
+
+def test_build_keeps_previous_movies_for_failed_years(crawl):
+    last_year, this_year, next_year = crawl['years']
+    previous = DiscoverCatalog([movie(1, last_year, 5.0), movie(2, this_year, 6.0)], built_at=1.0)
+    crawl['failed'] = {last_year}
+    built, failed = asyncio.run(discover_catalog.build(previous))
+    assert failed == [last_year]
+    # Год, который не загрузился, - из прежнего каталога; загруженные годы - только новые данные
+    assert sorted(built.ids.tolist()) == [1, this_year, next_year]
+    assert crawl['calls'] == discover_catalog.CRAWL_ATTEMPTS + 2
+
+
+def test_build_fails_when_no_year_loads(crawl):
+    crawl['failed'] = set(crawl['years'])
+    built, failed = asyncio.run(discover_catalog.build(DiscoverCatalog([movie(1, 2000, 1.0)], built_at=1.0)))
+    assert built is None
+    assert failed == crawl['years']
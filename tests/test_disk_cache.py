@@ -0,0 +1,111 @@
+import json
+import zlib
+import asyncio
+
+import pytest
+
+import disk_cache
+import tmdb_api
+from disk_cache import DiskCache
+
+
+class FakeClock:
+    """Замена модуля time в disk_cache: time() управляется тестом."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(disk_cache, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DiskCache(str(tmp_path / 'tmdb_cache.sqlite3'), max_bytes=1 << 20)
+    yield cache
+    cache.close()
+
+
+def content(value):
+    return json.dumps(value).encode('utf-8')
+
+
+def rows(cache):
+    with cache._lock:
+        return [key for (key,) in cache._connect().execute("SELECT key FROM responses ORDER BY stored_at")]
+
+
+def test_put_flush_load_roundtrip(cache, clock):
+    cache.put('/movie/1', content({'id': 1}), ttl=100, stale_ttl=50)
+    asyncio.run(cache.flush())
+    assert cache._pending == {}
+    clock.now += 30
+    assert cache.load() == [('/movie/1', {'id': 1}, len(content({'id': 1})), 70, 50)]
+
+
+def test_stale_entry_keeps_remaining_stale_ttl(cache, clock):
+    cache.put('/movie/1', content({'id': 1}), ttl=100, stale_ttl=50)
+    asyncio.run(cache.flush())
+    clock.now += 120
+    ((key, data, size, ttl, stale_ttl),) = cache.load()
+    assert (ttl, stale_ttl) == (0, 30)
+
+
+def test_expired_rows_are_pruned(cache, clock):
+    cache.put('/old', content(1), ttl=10, stale_ttl=10)
+    cache.put('/new', content(2), ttl=100, stale_ttl=10)
+    asyncio.run(cache.flush())
+    clock.now += 20
+    assert [entry[0] for entry in cache.load()] == ['/new']
+    assert rows(cache) == ['/new'] # Удалена из файла, а не только пропущена
+
+
+def test_repeated_put_writes_latest_content(cache, clock):
+    cache.put('/movie/1', content({'v': 1}), ttl=100, stale_ttl=0)
+    cache.put('/movie/1', content({'v': 2}), ttl=100, stale_ttl=0)
+    asyncio.run(cache.flush())
+    assert [entry[1] for entry in cache.load()] == [{'v': 2}]
+
+
+def test_eviction_above_max_bytes(cache, clock):
+    bodies = {key: content(key * 100) for key in ('/a', '/b', '/c')}
+    sizes = {key: len(zlib.compress(body)) for key, body in bodies.items()} # Лимит - по сжатому размеру
+    cache.max_bytes = sizes['/b'] + sizes['/c']
+    for key, body in bodies.items():
+        cache.put(key, body, ttl=100, stale_ttl=0)
+        asyncio.run(cache.flush())
+        clock.now += 1
+    assert rows(cache) == ['/b', '/c'] # Вытеснена самая старая запись
+
+
+def test_corrupted_row_is_skipped(cache, clock):
+    cache.put('/ok', content(1), ttl=100, stale_ttl=0)
+    asyncio.run(cache.flush())
+    with cache._lock:
+        conn = cache._connect()
+        with conn:
+            conn.execute("INSERT INTO responses VALUES ('/bad', x'00', 1, ?, ?, ?)", (clock.now + 100, clock.now + 100, clock.now))
+    assert [entry[0] for entry in cache.load()] == ['/ok']
+
+
+# --- Кэш ответов tmdb_api после перезапуска ---
+
+def test_tmdb_responses_survive_restart(tmp_path, monkeypatch):
+    disk = DiskCache(str(tmp_path / 'tmdb_cache.sqlite3'), max_bytes=1 << 20)
+    monkeypatch.setattr(tmdb_api, 'disk_tier', disk)
+    monkeypatch.setattr(tmdb_api, 'response_cache', tmdb_api.ResponseCache())
+    data = {'id': 1, 'title': 'Начало'}
+    tmdb_api._store_response('/movie/1', 'movie-1', data, content(data))
+    asyncio.run(tmdb_api.flush_disk_cache())
+
+    monkeypatch.setattr(tmdb_api, 'response_cache', tmdb_api.ResponseCache()) # "Перезапуск": память пуста
+    assert asyncio.run(tmdb_api.load_disk_cache()) == 1
+    assert tmdb_api.response_cache.get('movie-1') == (data, True)
+    disk.close()
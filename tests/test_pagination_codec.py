@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import pagination_codec
+from pagination_codec import MAX_CALLBACK_BYTES, LAST_OFFSET, QueryHandleStore, decode, encode
+
+
+@pytest.fixture(autouse=True)
+def handle_store(tmp_path, monkeypatch):
+    """Отдельная таблица хэшей запросов для каждого теста."""
+    store = QueryHandleStore(str(tmp_path / 'handles.sqlite3'))
+    monkeypatch.setattr(pagination_codec, 'query_handles', store)
+    yield store
+    store.close()
+
+
+def roundtrip(source, args, page, offset):
+    async def run():
+        data = await encode(source, args, page, offset)
+        return data, await decode(data)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('source, args', [
+    ('search', {'query': 'матрица'}),
+    ('title', {'query': 'the matrix'}),
+    ('discover', {'criteria': {'with_genres': 28, 'primary_release_year': 1999, 'vote_average.gte': 7}}),
+    ('discover', {'criteria': {'with_genres': 18}}),
+    ('discover', {'criteria': {}}),
+    ('popular', {}),
+    ('top_rated', {}),
+    ('upcoming', {}),
+])
+@pytest.mark.parametrize('page, offset', [(1, 0), (37, 19), (500, LAST_OFFSET)])
+def test_roundtrip(source, args, page, offset):
+    data, decoded = roundtrip(source, args, page, offset)
+    assert data.startswith(pagination_codec.PREFIX)
+    assert len(data.encode('utf-8')) <= MAX_CALLBACK_BYTES
+    assert decoded == (source, args, page, offset)
+
+
+@pytest.mark.parametrize('length', [1, 10, 20, 25, 26, 27, 40, 100])
+def test_cyrillic_query_fits_limit(length):
+    query = 'ж' * length # 2 байта на символ в UTF-8
+    data, decoded = roundtrip('search', {'query': query}, 500, LAST_OFFSET)
+    assert len(data.encode('utf-8')) <= MAX_CALLBACK_BYTES
+    assert decoded == ('search', {'query': query}, 500, LAST_OFFSET)
+
+
+def test_short_query_is_inline_long_query_uses_handle():
+    short, _ = roundtrip('search', {'query': 'дюна'}, 1, 0)
+    long, _ = roundtrip('search', {'query': 'властелин колец: братство кольца'}, 1, 0)
+    assert short.endswith(':qдюна')
+    assert long.split(':', 4)[4].startswith('h')
+
+
+@pytest.mark.parametrize('query', ['mission: impossible', ':', 'a:b:c:d', 'звёздные войны: эпизод 4 - новая надежда'])
+def test_query_with_colons(query):
+    data, decoded = roundtrip('search', {'query': query}, 2, 3)
+    assert decoded == ('search', {'query': query}, 2, 3)
+
+
+def test_handle_survives_restart(handle_store, tmp_path):
+    query = 'очень длинный поисковый запрос, который не помещается в кнопку'
+    data, _ = roundtrip('search', {'query': query}, 1, 0)
+    handle_store.close()
+    # Другой процесс (или перезапуск): в памяти хэша нет, запрос читается из SQLite
+    restarted = QueryHandleStore(handle_store.path)
+    pagination_codec.query_handles = restarted
+    try:
+        assert asyncio.run(decode(data)) == ('search', {'query': query}, 1, 0)
+    finally:
+        restarted.close()
+
+
+def test_unknown_handle_decodes_to_none():
+    assert asyncio.run(decode('pg:s:1:0:hAAAAAAAAAAAA')) is None
+
+
+@pytest.mark.parametrize('data', [
+    'prev_movie_3', 'next_movie_12', # Кнопки старого формата
+    'pg:', 'pg:x:1:0:', 'pg:s:one:0:qa', 'pg:p:1', 'pg:d:1:0:28.1999', 'pg:d:1:0:a.b.c',
+])
+def test_malformed_and_legacy_data(data):
+    assert asyncio.run(decode(data)) is None
+
+
+def test_legacy_buttons_get_stale_list_answer():
+    import bot_logic
+
+    answers = []
+
+    async def answer(text=None, show_alert=False):
+        answers.append((text, show_alert))
+
+    update = SimpleNamespace(callback_query=SimpleNamespace(data='next_movie_5', answer=answer))
+    asyncio.run(bot_logic.handle_pagination(update, SimpleNamespace()))
+    assert answers == [("Список устарел, повторите поиск.", True)]
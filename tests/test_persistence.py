@@ -0,0 +1,46 @@
+import copy
+import asyncio
+
+import pytest
+
+from persistence import CompactPersistence, LazyUserData, decode_user_data, encode_user_data
+
+USER_DATA = {'discover': {'with_genres': 18}, 'query': 'начало', 'pages': [1, 2]}
+
+
+def test_encode_lazy_user_data_without_access():
+    lazy = LazyUserData(encode_user_data(USER_DATA))
+    assert decode_user_data(encode_user_data(lazy)) == USER_DATA
+
+
+def test_encode_lazy_user_data_after_change():
+    lazy = LazyUserData(encode_user_data(USER_DATA))
+    lazy['query'] = 'матрица'
+    assert decode_user_data(encode_user_data(lazy)) == {**USER_DATA, 'query': 'матрица'}
+
+
+def test_lazy_user_data_decodes_on_first_access():
+    lazy = LazyUserData(encode_user_data(USER_DATA))
+    assert lazy._blob is not None
+    assert lazy['query'] == 'начало'
+    assert lazy._blob is None
+    assert lazy == USER_DATA
+    assert copy.deepcopy(LazyUserData(encode_user_data(USER_DATA))) == USER_DATA
+
+
+@pytest.fixture
+def persistence(tmp_path):
+    return CompactPersistence(str(tmp_path / 'bot_state.sqlite3'))
+
+
+def test_untouched_user_data_survives_second_save(persistence):
+    async def run():
+        await persistence.update_user_data(1, USER_DATA)
+        await persistence.flush()
+        loaded = await persistence.get_user_data()
+        # Сохраняем загруженные, но не прочитанные данные без копии (PTB копирует их, но полагаться на это не стоит)
+        await persistence.update_user_data(1, loaded[1])
+        await persistence.flush()
+        return await persistence.get_user_data()
+
+    assert asyncio.run(run())[1] == USER_DATA
@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+
+import pytest
+from telegram.error import RetryAfter
+
+import rate_limit
+from rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, TelegramRateLimiter, TokenBucket
+
+
+# --- Token bucket ---
+
+def test_interactive_waiters_are_served_before_background():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=1)
+        await bucket.acquire() # Корзина пуста, дальше все встают в очередь
+        served = []
+
+        async def waiter(name, priority):
+            await bucket.acquire(priority)
+            served.append(name)
+
+        tasks = [asyncio.create_task(waiter(f"bg{i}", PRIORITY_BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(waiter(f"ui{i}", PRIORITY_INTERACTIVE)) for i in range(2)]
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(run()) == ['ui0', 'ui1', 'bg0', 'bg1', 'bg2']
+
+
+def test_new_request_does_not_overtake_waiters():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=1)
+        await bucket.acquire()
+        first = asyncio.create_task(bucket.acquire(PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.06) # Токен уже накопился, но его ждет first
+        waited = await bucket.acquire(PRIORITY_BACKGROUND)
+        return await first, waited
+
+    first_wait, second_wait = asyncio.run(run())
+    assert first_wait > 0 and second_wait > 0
+
+
+def test_cancelled_waiter_is_skipped():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=1)
+        await bucket.acquire()
+        cancelled = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await bucket.acquire()
+        return bucket.queued
+
+    assert asyncio.run(run()) == 0
+
+
+def test_pause_delays_acquire():
+    async def run():
+        bucket = TokenBucket(rate=1000, capacity=10)
+        bucket.pause(0.1)
+        return await bucket.acquire()
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_idle_bucket():
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.idle
+    bucket._tokens = 1.0
+    assert not bucket.idle
+
+
+def test_tmdb_limiter_stats_by_priority():
+    async def run():
+        limiter = rate_limit.TMDBRateLimiter(rate=1000, burst=5)
+        await limiter.acquire()
+        await rate_limit.run_in_background(limiter.acquire())
+        return limiter.get_stats()
+
+    stats = asyncio.run(run())
+    assert stats['requests'] == 2
+    assert stats['interactive']['requests'] == 1
+    assert stats['background']['requests'] == 1
+
+
+# --- Ограничитель Telegram ---
+
+@pytest.fixture
+def telegram_limiter(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'TELEGRAM_RATE', 1000)
+    return TelegramRateLimiter(max_retries=2)
+
+
+@pytest.fixture
+def fast_chats(monkeypatch):
+    """После RetryAfter корзина чата пуста; с настоящим лимитом чата (1 в секунду) тесты шли бы секундами."""
+    monkeypatch.setattr(rate_limit, 'TELEGRAM_CHAT_RATE', 1000)
+
+
+def _flaky(failures, retry_after):
+    """Callback, который сначала failures раз отвечает RetryAfter."""
+    calls = []
+
+    async def callback(value):
+        calls.append(value)
+        if len(calls) <= failures:
+            raise RetryAfter(datetime.timedelta(seconds=retry_after))
+        return value
+
+    return callback, calls
+
+
+def test_retry_after_is_retried_not_surfaced(telegram_limiter, fast_chats):
+    callback, calls = _flaky(failures=2, retry_after=0.05)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await telegram_limiter.process_request(callback, ('ok',), {}, 'sendMessage', {'chat_id': 42}, None)
+        return result, loop.time() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == 'ok'
+    assert calls == ['ok'] * 3
+    assert elapsed >= 0.09 # Обе паузы RetryAfter выдержаны
+
+
+def test_retry_after_pauses_whole_bot(telegram_limiter, fast_chats):
+    callback, _ = _flaky(failures=1, retry_after=0.1)
+
+    async def run():
+        await telegram_limiter.process_request(callback, ('ok',), {}, 'sendMessage', {'chat_id': 42}, None)
+        return telegram_limiter.global_bucket._paused_until, telegram_limiter._chat_bucket(42)._paused_until
+
+    global_pause, chat_pause = asyncio.run(run())
+    assert global_pause > 0 and chat_pause > 0
+
+
+def test_retry_after_surfaces_after_max_retries(telegram_limiter, fast_chats):
+    callback, calls = _flaky(failures=10, retry_after=0.01)
+    with pytest.raises(RetryAfter):
+        asyncio.run(telegram_limiter.process_request(callback, ('ok',), {}, 'sendMessage', {'chat_id': 42}, None))
+    assert len(calls) == telegram_limiter.max_retries + 1
+
+
+@pytest.mark.parametrize('chat_id, rate', [
+    (42, rate_limit.TELEGRAM_CHAT_RATE),
+    ('42', rate_limit.TELEGRAM_CHAT_RATE),
+    (-100123, rate_limit.TELEGRAM_GROUP_RATE),
+    ('-100123', rate_limit.TELEGRAM_GROUP_RATE),
+    ('@channel', rate_limit.TELEGRAM_GROUP_RATE),
+])
+def test_chat_buckets_by_chat_type(telegram_limiter, chat_id, rate):
+    async def run():
+        callback, _ = _flaky(failures=0, retry_after=0)
+        await telegram_limiter.process_request(callback, ('ok',), {}, 'sendMessage', {'chat_id': chat_id}, None)
+
+    asyncio.run(run())
+    (bucket,) = telegram_limiter.chat_buckets.values()
+    assert bucket.rate == rate
+
+
+def test_private_chat_limit_applies_per_chat(telegram_limiter):
+    callback, _ = _flaky(failures=0, retry_after=0)
+
+    async def send(chat_id):
+        return await telegram_limiter.process_request(callback, ('ok',), {}, 'sendMessage', {'chat_id': chat_id}, None)
+
+    async def run():
+        # Всплеск в одном чате сверх TELEGRAM_CHAT_BURST ждет, другой чат - нет
+        for _ in range(rate_limit.TELEGRAM_CHAT_BURST):
+            await send(1)
+        blocked = asyncio.create_task(send(1))
+        await send(2)
+        await asyncio.sleep(0.01)
+        done = blocked.done()
+        blocked.cancel()
+        return done
+
+    assert asyncio.run(run()) is False
+    assert telegram_limiter.get_stats()['chats'] == 2
@@ -0,0 +1,189 @@
+import gzip
+import json
+
+import pytest
+
+import title_index
+from title_index import TitleIndex
+
+
+EXPORT = [
+    {'id': 1, 'original_title': 'Inception', 'popularity': 90.0},
+    {'id': 2, 'original_title': 'Начало', 'popularity': 3.0},
+    {'id': 3, 'original_title': 'Начало конца', 'popularity': 5.0},
+    {'id': 4, 'original_title': 'The Matrix', 'popularity': 80.0},
+    {'id': 5, 'original_title': 'The Matrix Reloaded', 'popularity': 40.0},
+    {'id': 6, 'original_title': 'Matrimony', 'popularity': 2.0},
+    {'id': 7, 'original_title': 'Up', 'popularity': 60.0},
+    {'id': 8, 'original_title': 'Upgrade', 'popularity': 30.0},
+    {'id': 9, 'original_title': 'Unpopular', 'popularity': 0.5},
+    {'id': 10, 'original_title': 'Adult', 'popularity': 50.0, 'adult': True},
+]
+
+
+@pytest.fixture
+def export_file(tmp_path):
+    path = tmp_path / 'movie_ids.json.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for movie in EXPORT:
+            f.write(json.dumps(movie, ensure_ascii=False) + '\n')
+        f.write('не json\n')
+    return str(path)
+
+
+@pytest.fixture
+def index(export_file):
+    return TitleIndex.from_export_file(export_file)
+
+
+# --- Ответ без TMDB ---
+
+@pytest.mark.parametrize('query', ['Inception', 'the matrix', 'UP'])
+def test_whole_original_title_is_answered_locally(index, query):
+    assert index.answers_locally(query)
+
+
+@pytest.mark.parametrize('query', [
+    'Начало', # Может быть локализованным названием "Inception"
+    'начало конца',
+    'Incep', # Только начало названия
+    'matrix', # Слово из названия, а не название целиком
+    'The Matrix Revolutions',
+    'Inceptoin', # Опечатка
+])
+def test_other_queries_go_to_tmdb(index, query):
+    assert not index.answers_locally(query)
+
+
+def test_index_from_api_results_is_not_answered_locally():
+    index = TitleIndex()
+    index.add_results([{'id': 1, 'title': 'Начало', 'original_title': 'Inception', 'popularity': 90.0}])
+    assert index.search('Inception')[0] == [1]
+    assert not index.answers_locally('Inception')
+
+
+# --- Поиск ---
+
+def test_export_filters_adult_and_unpopular(index):
+    assert len(index) == 8
+    assert index.search('Adult') == ([], False)
+    assert index.search('Unpopular') == ([], False)
+
+
+def test_prefix_match_ranked_by_popularity(index):
+    ids, has_prefix = index.search('the matr')
+    assert ids[:2] == [4, 5]
+    assert has_prefix
+
+
+def test_more_specific_title_ranks_first(index):
+    ids, has_prefix = index.search('matrix reloaded')
+    assert ids[0] == 5 and has_prefix
+
+
+def test_typo_is_fuzzy_match(index):
+    ids, has_prefix = index.search('Inceptoin')
+    assert ids == [1]
+    assert not has_prefix
+
+
+def test_unrelated_query_has_no_candidates(index):
+    assert index.search('зебра') == ([], False)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('up', [7, 8]), # Точное совпадение названия - первым, затем по популярности
+    ('m', [4, 5, 6]),
+    ('нач', [3, 2]),
+    ('xyz', []),
+])
+def test_short_query_uses_prefixes(index, query, expected):
+    assert index.search(query) == (expected, bool(expected))
+
+
+def test_added_title_joins_prefix_lists(index):
+    index.add(11, 'Matrimonial Bliss', 100.0)
+    assert index.search('m')[0][:2] == [11, 4]
+    assert index.search('matrimonial')[0][0] == 11
+
+
+def test_popularity_update_reorders_results(index):
+    index.add_results([{'id': 6, 'original_title': 'Matrimony', 'popularity': 500.0}])
+    assert index.search('matri')[0][0] == 6
+
+
+def test_max_api_titles(monkeypatch):
+    monkeypatch.setattr(title_index, 'MAX_API_TITLES', 2)
+    index = TitleIndex()
+    index.add_results([
+        {'id': 1, 'title': 'Начало', 'original_title': 'Inception'},
+        {'id': 2, 'title': 'Матрица', 'original_title': 'The Matrix', 'popularity': 5.0},
+    ])
+    assert len(index) == 2 and index.api_titles == 2
+    assert index.search('матрица') == ([], False)
+
+
+def test_page(index):
+    index.add_results([{'id': 100 + i, 'title': f"Matrix {i}"} for i in range(25)])
+    first, second = index.page('matrix', 1), index.page('matrix', 2)
+    assert first['total_pages'] == 2 and first['total_results'] == 28
+    assert len(first['results']) == title_index.PAGE_SIZE
+    assert len(second['results']) == 8
+
+
+# --- Кэш запросов ---
+
+def test_query_cache_reuses_results(index, monkeypatch):
+    expected = index.search('the matr')
+
+    def fail(query):
+        raise AssertionError("запрос должен браться из кэша")
+
+    monkeypatch.setattr(index, '_search', fail)
+    assert index.search('The Matr') == expected # Тот же запрос после нормализации
+
+
+def test_query_cache_expires_and_evicts(index, monkeypatch):
+    monkeypatch.setattr(title_index, 'QUERY_CACHE_SIZE', 2)
+    index.search('inception')
+    index.search('up')
+    index.search('inception')
+    index.search('matrix')
+    assert list(index._cache) == ['inception', 'matrix']
+    monkeypatch.setattr(title_index, 'QUERY_CACHE_TTL', 0)
+    calls = []
+    search = index._search
+    monkeypatch.setattr(index, '_search', lambda query: calls.append(query) or search(query))
+    index.search('matrix')
+    assert calls == ['matrix']
+
+
+# --- Снимок ---
+
+def test_snapshot_roundtrip(index, tmp_path):
+    path = str(tmp_path / 'title_index.pickle')
+    index.save_snapshot(path)
+    loaded = TitleIndex.from_snapshot(path)
+    assert len(loaded) == len(index)
+    assert loaded.from_export
+    for query in ('the matr', 'Inceptoin', 'up', 'нач'):
+        assert loaded.search(query) == index.search(query)
+    assert loaded.answers_locally('Inception')
+    loaded.add(1, 'Inception', 1.0) # Известное название не дублируется
+    assert len(loaded) == len(index)
+
+
+def test_snapshot_version_mismatch(index, tmp_path, monkeypatch):
+    path = str(tmp_path / 'title_index.pickle')
+    index.save_snapshot(path)
+    monkeypatch.setattr(title_index, 'SNAPSHOT_VERSION', title_index.SNAPSHOT_VERSION + 1)
+    with pytest.raises(ValueError):
+        TitleIndex.from_snapshot(path)
+
+
+def test_load_or_build_prefers_fresh_snapshot(export_file, tmp_path):
+    snapshot = str(tmp_path / 'title_index.pickle')
+    built = title_index._load_or_build(export_file, snapshot)
+    assert len(built) == 8
+    TitleIndex().save_snapshot(snapshot) # Снимок новее выгрузки - выгрузка не разбирается
+    assert len(title_index._load_or_build(export_file, snapshot)) == 0
@@ -0,0 +1,261 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+import rate_limit
+import tmdb_api
+from tmdb_api import CircuitBreaker
+
+
+class FakeClock:
+    """Замена модуля time в tmdb_api: monotonic() управляется тестом, остальное - настоящее."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(tmdb_api, 'time', fake)
+    return fake
+
+
+def _response(status, headers=None):
+    request = httpx.Request('GET', 'https://api.themoviedb.org/3/movie/1')
+    return httpx.Response(status, headers=headers, json={}, request=request)
+
+
+# --- Автоматический выключатель ---
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_breaker_success_resets_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+
+def test_breaker_half_open_probe_closes(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow() # Пока идет пробный запрос, остальные отклоняются
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_breaker_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker('test', failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure() # Одной ошибки пробного запроса достаточно
+    assert breaker.state == 'open'
+    assert breaker.opened_at == clock.now
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_breaker_release_reopens_for_next_probe(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == 'open'
+    assert breaker.allow() # Таймаут уже истек - сразу новая проба
+    breaker.release()
+    breaker.record_success()
+    breaker.release() # Замкнутый выключатель не меняется
+    assert breaker.state == 'closed'
+
+
+@pytest.mark.parametrize('status', [400, 401, 404, 422])
+def test_client_errors_do_not_count_as_failures(status):
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    response = _response(status)
+    error = httpx.HTTPStatusError(f"HTTP {status}", request=response.request, response=response)
+    tmdb_api._handle_request_error('/movie/1', breaker, error)
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+
+@pytest.mark.parametrize('error', [
+    tmdb_api._RetryableStatus(_response(503)),
+    httpx.ConnectError('connection refused'),
+    asyncio.TimeoutError(),
+])
+def test_server_errors_count_as_failures(error):
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    tmdb_api._handle_request_error('/movie/1', breaker, error)
+    assert breaker.state == 'open'
+
+
+# --- Retry-After и задержки повторов ---
+
+def test_retry_after_header_is_used():
+    assert tmdb_api._retry_delay(0, _response(429, {'Retry-After': '7'})) == 7.0
+
+
+@pytest.mark.parametrize('headers', [None, {'Retry-After': 'Wed, 21 Oct 2026 07:28:00 GMT'}])
+@pytest.mark.parametrize('attempt', [0, 2, 10])
+def test_retry_delay_backoff_without_seconds(headers, attempt):
+    delay = tmdb_api._retry_delay(attempt, _response(503, headers))
+    assert 0 <= delay <= min(tmdb_api.RETRY_MAX_DELAY, tmdb_api.RETRY_BASE_DELAY * 2 ** attempt)
+
+
+def test_429_pauses_all_requests(limiter):
+    delay = tmdb_api._before_retry('/movie/1', 0, tmdb_api._RetryableStatus(_response(429, {'Retry-After': '5'})))
+    assert delay == 5.0
+    assert limiter.bucket._paused_until >= rate_limit.time.monotonic() + 4
+
+
+def test_503_does_not_pause_limiter(limiter):
+    tmdb_api._before_retry('/movie/1', 0, tmdb_api._RetryableStatus(_response(503, {'Retry-After': '5'})))
+    assert limiter.bucket._paused_until == 0.0
+
+
+# --- Запрос целиком: повторы и выключатель ---
+
+def test_fetch_retries_with_retry_after(mock_tmdb):
+    statuses = iter([429, 503, 200])
+    requests = mock_tmdb(lambda request: httpx.Response(next(statuses), headers={'Retry-After': '0'}, json={'ok': True}))
+    breaker = CircuitBreaker('test')
+    data = asyncio.run(tmdb_api._fetch_async('/movie/1', {}, 'k', store=False, breaker=breaker))
+    assert data == {'ok': True}
+    assert len(requests) == 3
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+
+def test_fetch_404_is_not_retried_and_keeps_breaker_closed(mock_tmdb):
+    requests = mock_tmdb(lambda request: httpx.Response(404, json={'status_code': 34}))
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    assert asyncio.run(tmdb_api._fetch_async('/movie/1', {}, 'k', store=False, breaker=breaker)) is None
+    assert len(requests) == 1
+    assert breaker.state == 'closed'
+
+
+def test_open_breaker_skips_request(mock_tmdb):
+    requests = mock_tmdb(lambda request: httpx.Response(503, headers={'Retry-After': '0'}))
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60)
+    assert asyncio.run(tmdb_api._fetch_async('/movie/1', {}, 'k', store=False, breaker=breaker)) is None
+    assert breaker.state == 'open'
+    sent = len(requests)
+    assert sent == tmdb_api.MAX_RETRIES + 1
+    assert asyncio.run(tmdb_api._fetch_async('/movie/1', {}, 'k', store=False, breaker=breaker)) is None
+    assert len(requests) == sent
+    assert breaker.rejected == 1
+
+
+def test_cancelled_probe_releases_half_open_breaker(mock_tmdb, clock):
+    async def hang(request):
+        await asyncio.Event().wait()
+
+    mock_tmdb(hang)
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+
+    async def run():
+        probe = asyncio.create_task(tmdb_api._fetch_async('/movie/1', {}, 'k', store=False, breaker=breaker))
+        await asyncio.sleep(0.01)
+        assert breaker.state == 'half_open'
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(run())
+    assert breaker.state == 'open'
+    assert breaker.allow()
+
+
+# --- Объединение одинаковых запросов (single-flight) ---
+
+@pytest.fixture
+def slow_fetch(monkeypatch):
+    """Подменяет _fetch_async запросом, который завершается по сигналу теста."""
+    state = {'calls': 0, 'release': None}
+
+    async def fetch(endpoint, params, key, refresh=False):
+        state['calls'] += 1
+        await state['release'].wait()
+        return {'key': key}
+
+    monkeypatch.setattr(tmdb_api, '_fetch_async', fetch)
+    monkeypatch.setattr(tmdb_api, '_in_flight', {})
+    return state
+
+
+def test_cancelled_waiter_does_not_cancel_shared_request(slow_fetch):
+    async def run():
+        slow_fetch['release'] = asyncio.Event()
+        waiters = [asyncio.create_task(tmdb_api._fetch_coalesced('/movie/1', {}, 'k')) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert len(tmdb_api._in_flight) == 1
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+        slow_fetch['release'].set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        return results
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == [{'key': 'k'}, {'key': 'k'}]
+    assert slow_fetch['calls'] == 1
+    assert tmdb_api._in_flight == {}
+
+
+def test_all_waiters_cancelled_request_finishes_and_is_released(slow_fetch):
+    async def run():
+        slow_fetch['release'] = asyncio.Event()
+        waiters = [asyncio.create_task(tmdb_api._fetch_coalesced('/movie/1', {}, 'k')) for _ in range(2)]
+        await asyncio.sleep(0)
+        task = tmdb_api._in_flight['k']
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        slow_fetch['release'].set()
+        return await task
+
+    assert asyncio.run(run()) == {'key': 'k'}
+    assert tmdb_api._in_flight == {}
+
+
+def test_next_call_after_completion_starts_new_request(slow_fetch):
+    async def run():
+        slow_fetch['release'] = asyncio.Event()
+        slow_fetch['release'].set()
+        first = await tmdb_api._fetch_coalesced('/movie/1', {}, 'k')
+        second = await tmdb_api._fetch_coalesced('/movie/1', {}, 'k')
+        return first, second
+
+    assert asyncio.run(run()) == ({'key': 'k'}, {'key': 'k'})
+    assert slow_fetch['calls'] == 2
+    assert tmdb_api._in_flight == {}
@@ -0,0 +1,367 @@
+import os
+import re
+import sys
+import gzip
+import json
+import math
+import time
+import pickle
+import heapq
+import asyncio
+import logging
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Локальный индекс названий фильмов для поиска без обращения к TMDB и с опечатками.
+# Строится из ежедневной выгрузки TMDB (gzip, по одному JSON на строку: id, original_title, popularity)
+# и дополняется названиями из ответов API. Готовый индекс сохраняется в снимок, который при
+# следующем старте загружается вместо разбора выгрузки.
+EXPORT_FILE = os.getenv('TITLE_INDEX_EXPORT', '') # Например, movie_ids_05_15_2025.json.gz
+SNAPSHOT_FILE = os.getenv('TITLE_INDEX_SNAPSHOT', 'title_index.pickle')
+MIN_POPULARITY = float(os.getenv('TITLE_INDEX_MIN_POPULARITY', '1.0')) # Фильмы ниже порога из выгрузки не берутся
+MAX_API_TITLES = int(os.getenv('TITLE_INDEX_MAX_API_TITLES', '50000')) # Сколько названий можно добавить из ответов API
+SNAPSHOT_VERSION = 1
+
+MIN_SIMILARITY = 0.3 # Минимальное сходство триграмм для нечеткого совпадения
+MAX_RESULTS = 200
+PAGE_SIZE = 20 # Как у страниц TMDB
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_TTL = 600 # Результат запроса не меняется при листании в течение этого времени (сек.)
+# Запросы из одного слова не длиннее PREFIX_MAX_LEN ищутся по префиксам: у их триграмм огромные списки документов
+PREFIX_MAX_LEN = 4
+
+_NON_WORD = re.compile(r"[^\w]+")
+# Буквы языка поиска бота (ru-RU): в выгрузке только оригинальные названия, а TMDB ищет и по русским
+_LOCALIZED_SCRIPT = re.compile(r"[а-я]")
+_EMPTY = array('I')
+
+def normalize(text):
+    """Приводит название к виду для сравнения: нижний регистр, ё -> е, без знаков препинания."""
+    return ' '.join(_NON_WORD.sub(' ', text.casefold().replace('ё', 'е')).split())
+
+def _trigrams(text, partial_last=False):
+    """Триграммы слов с отступами по краям; у последнего слова запроса конец может быть не дописан."""
+    grams = set()
+    words = text.split()
+    for i, word in enumerate(words):
+        padded = '  ' + word if partial_last and i == len(words) - 1 else '  ' + word + ' '
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+def _prefixes(title):
+    """Начала слов названия длиной до PREFIX_MAX_LEN символов."""
+    return {word[:n] for word in title.split() for n in range(1, min(len(word), PREFIX_MAX_LEN) + 1)}
+
+
+class TitleIndex:
+    """
+    Триграммный индекс названий. Кандидаты отбираются по общим триграммам,
+    затем проверяются на совпадение начала слова (префикс) и ранжируются с учетом популярности.
+    Для коротких запросов хранится префиксное дерево глубиной PREFIX_MAX_LEN: у каждого начала слова -
+    до MAX_RESULTS самых популярных документов, так что такой запрос - один поиск в словаре.
+    """
+
+    def __init__(self):
+        self.movie_ids = array('q')
+        self.popularity = array('d')
+        self.gram_counts = array('H')
+        self.titles = [] # Нормализованные названия, по одному на документ
+        self.postings = {} # триграмма -> array('I') номеров документов
+        self.prefixes = {} # начало слова -> array('I') номеров документов по убыванию популярности (до MAX_RESULTS)
+        self.short_titles = {} # название не длиннее PREFIX_MAX_LEN -> array('I') номеров документов
+        self.api_titles = 0 # Сколько названий добавлено из ответов API
+        self._docs = {} # (ID фильма, название) -> номер документа
+        self.from_export = False # Индекс построен по полной выгрузке, а не только по ответам API
+        self._cache = OrderedDict() # запрос -> (время, ID фильмов, есть ли совпадение по префиксу)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, movie_id, title, popularity=0.0, new=True):
+        """
+        Добавляет название фильма (или обновляет популярность уже известного).
+        new=False - только обновить известное. Возвращает True, если название добавлено.
+        """
+        doc = self._add_doc(movie_id, title, popularity, new)
+        if doc is None:
+            return False
+        self._add_prefixes(doc, self.titles[doc])
+        return True
+
+    def _add_doc(self, movie_id, title, popularity, new=True):
+        """Добавляет название в триграммный индекс без списков префиксов; возвращает номер нового документа или None."""
+        title = normalize(title or '')
+        if not title:
+            return None
+        doc = self._docs.get((movie_id, title))
+        if doc is not None:
+            self.popularity[doc] = popularity
+            return None
+        if not new:
+            return None
+        doc = len(self.titles)
+        self._docs[(movie_id, title)] = doc
+        self.titles.append(title)
+        self.movie_ids.append(movie_id)
+        self.popularity.append(popularity)
+        grams = _trigrams(title)
+        self.gram_counts.append(min(len(grams), 0xFFFF))
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            posting.append(doc)
+        return doc
+
+    def _add_prefixes(self, doc, title):
+        """Добавляет документ в списки префиксов, сохраняя порядок по популярности."""
+        popularity = self.popularity[doc]
+        if len(title) <= PREFIX_MAX_LEN:
+            self.short_titles.setdefault(title, array('I')).append(doc)
+        for prefix in _prefixes(title):
+            top = self.prefixes.get(prefix)
+            if top is None:
+                self.prefixes[prefix] = array('I', (doc,))
+                continue
+            if len(top) >= MAX_RESULTS and popularity <= self.popularity[top[-1]]:
+                continue
+            i = len(top)
+            while i and self.popularity[top[i - 1]] < popularity:
+                i -= 1
+            top.insert(i, doc)
+            if len(top) > MAX_RESULTS:
+                top.pop()
+
+    def _build_prefixes(self):
+        """Строит списки префиксов заново по всем названиям (после загрузки выгрузки или снимка)."""
+        groups = {}
+        self.short_titles = {}
+        for doc, title in enumerate(self.titles):
+            if len(title) <= PREFIX_MAX_LEN:
+                self.short_titles.setdefault(title, array('I')).append(doc)
+            for prefix in _prefixes(title):
+                docs = groups.get(prefix)
+                if docs is None:
+                    docs = groups[prefix] = []
+                docs.append(doc)
+        popularity = self.popularity.__getitem__
+        self.prefixes = {
+            prefix: array('I', heapq.nlargest(MAX_RESULTS, docs, key=popularity))
+            for prefix, docs in groups.items()
+        }
+
+    def add_results(self, results):
+        """
+        Добавляет названия из списка результатов TMDB (русское и оригинальное).
+        Новых названий добавляется не больше MAX_API_TITLES, дальше только обновляется популярность известных.
+        """
+        for movie in results:
+            movie_id = movie.get('id')
+            if movie_id is None:
+                continue
+            popularity = movie.get('popularity') or 0.0
+            for title in (movie.get('title'), movie.get('original_title')):
+                new = self.api_titles < MAX_API_TITLES
+                if self.add(movie_id, title, popularity, new=new):
+                    self.api_titles += 1
+                    if self.api_titles == MAX_API_TITLES:
+                        logger.warning(f"Из ответов API добавлено {MAX_API_TITLES} названий, новые больше не добавляются.")
+
+    def _search_prefix(self, query):
+        """Поиск запроса из одного короткого слова: точные совпадения названия, затем самые популярные по префиксу."""
+        ranked = []
+        seen = set()
+        exact = sorted(self.short_titles.get(query, _EMPTY), key=self.popularity.__getitem__, reverse=True)
+        for doc in (*exact, *self.prefixes.get(query, _EMPTY)):
+            movie_id = self.movie_ids[doc]
+            if movie_id not in seen:
+                seen.add(movie_id)
+                ranked.append(movie_id)
+        return ranked, bool(ranked)
+
+    def _search(self, query):
+        if len(query) <= PREFIX_MAX_LEN and ' ' not in query:
+            return self._search_prefix(query)
+        grams = _trigrams(query, partial_last=True)
+        if not grams:
+            return [], False
+        words = query.split()
+        # Сколько общих триграмм нужно документу, чтобы пройти порог сходства или совпасть по префиксу
+        # (у не последних слов запроса концевая триграмма может не совпасть с более длинным словом названия)
+        min_common = max(1, min(math.ceil(MIN_SIMILARITY * len(grams)), len(grams) - (len(words) - 1)))
+        postings = sorted((self.postings.get(g, _EMPTY) for g in grams), key=len)
+        # Такой документ обязательно содержит одну из (n - min_common + 1) самых редких триграмм,
+        # поэтому кандидаты берутся только из них, а остальные триграммы проверяются двоичным поиском
+        seeds = len(grams) - min_common + 1
+        hits = {}
+        for posting in postings[:seeds]:
+            for doc in posting:
+                hits[doc] = hits.get(doc, 0) + 1
+        for posting in postings[seeds:]:
+            for doc in hits:
+                i = bisect_left(posting, doc)
+                if i < len(posting) and posting[i] == doc:
+                    hits[doc] += 1
+
+        scored = {}
+        has_prefix = False
+        for doc, common in hits.items():
+            if common < min_common:
+                continue
+            title = self.titles[doc]
+            title_words = title.split()
+            # Все слова запроса - начала слов названия (последнее слово может быть не дописано)
+            prefix = all(any(tw.startswith(w) for tw in title_words) for w in words)
+            similarity = common / (len(grams) + self.gram_counts[doc] - common)
+            if not prefix and similarity < MIN_SIMILARITY:
+                continue
+            has_prefix = has_prefix or prefix
+            quality = similarity + (1.0 if prefix else 0.0) + (1.0 if title == query else 0.0)
+            score = quality * math.log(2 + self.popularity[doc])
+            movie_id = self.movie_ids[doc]
+            if score > scored.get(movie_id, 0.0):
+                scored[movie_id] = score
+        ranked = sorted(scored, key=scored.get, reverse=True)[:MAX_RESULTS]
+        return ranked, has_prefix
+
+    def search(self, query):
+        """
+        Ищет фильмы по названию. Возвращает (ID фильмов по убыванию релевантности,
+        есть ли среди них совпадение по началу слов, а не только нечеткое).
+        """
+        query = normalize(query)
+        cached = self._cache.get(query)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < QUERY_CACHE_TTL:
+            self._cache.move_to_end(query)
+            return cached[1], cached[2]
+        ids, has_prefix = self._search(query)
+        self._cache[query] = (now, ids, has_prefix)
+        self._cache.move_to_end(query)
+        if len(self._cache) > QUERY_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return ids, has_prefix
+
+    def answers_locally(self, query):
+        """
+        Можно ли ответить на запрос без TMDB: индекс построен по выгрузке, лучший результат - название
+        целиком, и запрос не на языке поиска бота. Русский запрос может быть локализованным названием
+        иностранного фильма (например, "Начало"), которого в выгрузке нет, - такие запросы ищет TMDB.
+        """
+        query = normalize(query)
+        if not self.from_export or not query or _LOCALIZED_SCRIPT.search(query):
+            return False
+        ids, _ = self.search(query)
+        return bool(ids) and (ids[0], query) in self._docs
+
+    def page(self, query, page):
+        """Страница результатов в формате ответа TMDB (в results - только ID фильмов)."""
+        ids, _ = self.search(query)
+        start = (page - 1) * PAGE_SIZE
+        return {
+            'page': page,
+            'total_pages': max(math.ceil(len(ids) / PAGE_SIZE), 1),
+            'total_results': len(ids),
+            'results': [{'id': movie_id} for movie_id in ids[start:start + PAGE_SIZE]],
+        }
+
+    # --- Выгрузка и снимок ---
+
+    @classmethod
+    def from_export_file(cls, path, min_popularity=MIN_POPULARITY):
+        """Строит индекс по выгрузке TMDB (блокирующий вызов)."""
+        index = cls()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    movie = json.loads(line)
+                except ValueError:
+                    continue
+                if movie.get('adult') or (movie.get('popularity') or 0.0) < min_popularity:
+                    continue
+                index._add_doc(movie['id'], movie.get('original_title'), movie.get('popularity') or 0.0)
+        index.from_export = True
+        index._build_prefixes()
+        return index
+
+    def save_snapshot(self, path):
+        state = {
+            'version': SNAPSHOT_VERSION,
+            'movie_ids': self.movie_ids,
+            'popularity': self.popularity,
+            'gram_counts': self.gram_counts,
+            'titles': self.titles,
+            'postings': self.postings,
+            'from_export': self.from_export,
+        }
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия снимка индекса: {state.get('version')}")
+        index = cls()
+        index.movie_ids = state['movie_ids']
+        index.popularity = state['popularity']
+        index.gram_counts = state['gram_counts']
+        index.titles = state['titles']
+        index.postings = state['postings']
+        index.from_export = state['from_export']
+        index._docs = {(movie_id, title): doc for doc, (movie_id, title) in enumerate(zip(index.movie_ids, index.titles))}
+        index._build_prefixes()
+        return index
+
+
+def _load_or_build(export_file, snapshot_file):
+    """Загружает снимок, если он новее выгрузки, иначе строит индекс по выгрузке и сохраняет снимок."""
+    export_mtime = os.path.getmtime(export_file) if export_file and os.path.exists(export_file) else None
+    if os.path.exists(snapshot_file) and (export_mtime is None or os.path.getmtime(snapshot_file) >= export_mtime):
+        return TitleIndex.from_snapshot(snapshot_file)
+    if export_mtime is None:
+        return TitleIndex()
+    built = TitleIndex.from_export_file(export_file)
+    built.save_snapshot(snapshot_file)
+    return built
+
+# Единственный индекс на процесс
+index = TitleIndex()
+
+async def load():
+    """Загружает индекс (при старте бота) в отдельном потоке; до загрузки используется пустой индекс."""
+    global index
+    started = time.monotonic()
+    try:
+        loaded = await asyncio.to_thread(_load_or_build, EXPORT_FILE, SNAPSHOT_FILE)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        logger.error(f"Не удалось загрузить индекс названий: {e}")
+        return
+    # Названия, добавленные из ответов API во время загрузки, не теряем
+    for doc, title in enumerate(index.titles):
+        loaded.add(index.movie_ids[doc], title, index.popularity[doc])
+    index = loaded
+    logger.info(f"Индекс названий загружен: {len(index)} названий за {time.monotonic() - started:.1f}с.")
+
+
+if __name__ == '__main__':
+    # Сборка снимка заранее: python title_index.py movie_ids_05_15_2025.json.gz [title_index.pickle]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print("Использование: python title_index.py <выгрузка.json.gz> [снимок]")
+        sys.exit(1)
+    snapshot = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_FILE
+    started = time.monotonic()
+    built = TitleIndex.from_export_file(sys.argv[1])
+    built.save_snapshot(snapshot)
+    logger.info(f"Снимок {snapshot}: {len(built)} названий за {time.monotonic() - started:.1f}с.")
@@ -1,7 +1,17 @@
 import os
-import requests
+import json
+import time
+import zlib
+import random
+import asyncio
+from collections import OrderedDict
+import httpx
 from dotenv import load_dotenv
 import logging
+import rate_limit
+import disk_cache
+import shared_cache
+import traffic_recorder
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -12,74 +22,638 @@ load_dotenv()
 
 # Получение API ключа и определение базового URL
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
-BASE_URL = "https://api.themoviedb.org/3"
+BASE_URL = os.getenv('TMDB_BASE_URL', "https://api.themoviedb.org/3") # Переопределяется для заглушки TMDB (см. benchmark.py)
+
+# Настройки HTTP транспорта (можно переопределить через .env)
+POOL_SIZE = int(os.getenv('TMDB_POOL_SIZE', '20')) # Максимум соединений к api.themoviedb.org
+KEEPALIVE_EXPIRY = float(os.getenv('TMDB_KEEPALIVE_EXPIRY', '30')) # Сколько секунд держать простаивающее соединение
+REQUEST_TIMEOUT = float(os.getenv('TMDB_TIMEOUT', '10')) # Таймаут чтения/записи/ожидания пула
+CONNECT_TIMEOUT = float(os.getenv('TMDB_CONNECT_TIMEOUT', '5'))
+USE_HTTP2 = os.getenv('TMDB_HTTP2', '0').lower() in ('1', 'true', 'yes')
+DEFAULT_LANGUAGE = 'ru-RU'
 
 if not TMDB_API_KEY:
     logger.error("TMDB_API_KEY не найден в переменных окружения. Проверьте ваш файл .env.")
     # Здесь можно выбросить исключение или завершить работу в зависимости от желаемого поведения
     # raise ValueError("TMDB_API_KEY не найден.")
 
-# --- Вспомогательная функция ---
-def _make_request(endpoint, params=None):
-    """Вспомогательная функция для выполнения запросов к TMDB API."""
-    if not TMDB_API_KEY:
-        logger.error("Невозможно выполнить API запрос без TMDB_API_KEY.")
+# --- HTTP транспорт ---
+
+class TMDBTransport:
+    """
+    Долгоживущий HTTP транспорт к TMDB.
+    Держит по одному синхронному и асинхронному httpx клиенту с общим пулом
+    keep-alive соединений, таймаутами и заранее собранными заголовками.
+    """
+
+    def __init__(self, base_url, api_key, pool_size=POOL_SIZE, keepalive_expiry=KEEPALIVE_EXPIRY,
+                 timeout=REQUEST_TIMEOUT, connect_timeout=CONNECT_TIMEOUT, http2=USE_HTTP2):
+        self.base_url = base_url
+        self.headers = {
+            "accept": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self.limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = http2 and self._h2_available()
+        self._client = None
+        self._async_client = None
+        # Счетчики для оценки переиспользования соединений
+        self.requests_sent = 0
+        self.connections_opened = 0
+
+    @staticmethod
+    def _h2_available():
+        """Проверяет, установлен ли пакет h2 (нужен httpx для HTTP/2)."""
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            logger.warning("TMDB_HTTP2 включен, но пакет h2 не установлен. Используется HTTP/1.1.")
+            return False
+
+    def _client_kwargs(self):
+        return {
+            'base_url': self.base_url,
+            'headers': self.headers,
+            'limits': self.limits,
+            'timeout': self.timeout,
+            'http2': self.http2,
+        }
+
+    @property
+    def client(self):
+        """Синхронный клиент (создается лениво)."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.Client(**self._client_kwargs())
+        return self._client
+
+    @property
+    def async_client(self):
+        """Асинхронный клиент (создается лениво внутри цикла событий)."""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(**self._client_kwargs())
+        return self._async_client
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def _trace_async(self, event_name, info):
+        self._trace(event_name, info)
+
+    def get(self, endpoint, params):
+        """Выполняет синхронный GET запрос через пул соединений."""
+        self.requests_sent += 1
+        return self.client.get(endpoint, params=params, extensions={"trace": self._trace})
+
+    async def get_async(self, endpoint, params):
+        """Выполняет асинхронный GET запрос через пул соединений."""
+        self.requests_sent += 1
+        return await self.async_client.get(endpoint, params=params, extensions={"trace": self._trace_async})
+
+    def pool_stats(self):
+        """Возвращает статистику пула: число запросов, новых соединений и долю переиспользования."""
+        reused = max(self.requests_sent - self.connections_opened, 0)
+        return {
+            'requests': self.requests_sent,
+            'connections_opened': self.connections_opened,
+            'connections_reused': reused,
+            'reuse_rate': reused / self.requests_sent if self.requests_sent else 0.0,
+            'max_connections': self.limits.max_connections,
+            'http2': self.http2,
+        }
+
+    def close(self):
+        """Закрывает синхронный клиент."""
+        if self._client is not None and not self._client.is_closed:
+            self._client.close()
+        self._client = None
+
+    async def aclose(self):
+        """Закрывает оба клиента."""
+        self.close()
+        if self._async_client is not None and not self._async_client.is_closed:
+            await self._async_client.aclose()
+        self._async_client = None
+
+
+# Единственный транспорт на процесс
+transport = TMDBTransport(BASE_URL, TMDB_API_KEY)
+
+def get_pool_stats():
+    """Возвращает статистику пула соединений TMDB."""
+    return transport.pool_stats()
+
+async def close_transport():
+    """Закрывает HTTP транспорт TMDB, дисковый и общий кэши (вызывается при остановке бота)."""
+    await transport.aclose()
+    logger.info("HTTP транспорт TMDB закрыт.")
+    if disk_tier is not None:
+        await flush_disk_cache()
+        disk_tier.close()
+    shared_cache.close()
+
+# --- Кэш ответов ---
+
+# Время жизни записей по классам эндпоинтов (сек.): (свежая запись, допустимая устаревшая)
+# В течение второго интервала устаревший ответ отдается сразу, а обновление идет в фоне.
+CACHE_TTLS = {
+    'config': (24 * 3600, 24 * 3600),
+    'genres': (24 * 3600, 24 * 3600),
+    'charts': (3 * 3600, 3 * 3600), # popular / top_rated / upcoming
+    'discover': (3600, 3600),
+    'details': (6 * 3600, 6 * 3600),
+    'search': (600, 600),
+}
+CACHE_MAX_ENTRIES = int(os.getenv('TMDB_CACHE_MAX_ENTRIES', '2000'))
+CACHE_MAX_BYTES = int(os.getenv('TMDB_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Дисковый уровень кэша (необязательный): путь к файлу SQLite, пусто - отключен
+DISK_CACHE_PATH = os.getenv('TMDB_DISK_CACHE', '')
+DISK_CACHE_MAX_BYTES = int(os.getenv('TMDB_DISK_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+DISK_CACHE_FLUSH_INTERVAL = 10 # Как часто записывать накопленные ответы на диск (сек.)
+
+def _endpoint_class(endpoint):
+    """Определяет класс эндпоинта для выбора TTL."""
+    if endpoint == "/configuration":
+        return 'config'
+    if endpoint.startswith("/genre/"):
+        return 'genres'
+    if endpoint in ("/movie/popular", "/movie/top_rated", "/movie/upcoming"):
+        return 'charts'
+    if endpoint.startswith("/discover/"):
+        return 'discover'
+    if endpoint.startswith("/search/"):
+        return 'search'
+    return 'details'
+
+def _normalize_param(name, value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if name == 'query':
+        # Поиск TMDB не зависит от регистра и лишних пробелов
+        return ' '.join(str(value).split()).lower()
+    return str(value)
+
+def _cache_key(endpoint, params):
+    """Строит ключ кэша из эндпоинта и нормализованных параметров."""
+    items = sorted((k, _normalize_param(k, v)) for k, v in params.items() if v is not None)
+    return endpoint + '?' + '&'.join(f"{k}={v}" for k, v in items)
+
+
+class ResponseCache:
+    """
+    Ограниченный LRU кэш ответов TMDB с TTL и режимом stale-while-revalidate.
+    Размер ограничен как числом записей, так и суммарным объемом ответов в байтах.
+    Возвращаемые словари общие для всех вызывающих, их нельзя изменять.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # ключ -> (данные, размер, свежо_до, годно_до)
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Возвращает (данные, свежие ли они) или (None, False) при промахе."""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or now >= entry[3]:
+            # Просроченная запись остается до вытеснения: ее можно отдать, пока TMDB недоступен
+            self.misses += 1
+            return None, False
+        self._entries.move_to_end(key)
+        if now < entry[2]:
+            self.hits += 1
+            return entry[0], True
+        self.stale_hits += 1
+        return entry[0], False
+
+    def peek(self, key):
+        """Возвращает последний сохраненный ответ независимо от срока годности (или None)."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, data, size, ttl, stale_ttl):
+        """Сохраняет ответ и вытесняет самые старые записи при превышении лимитов."""
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        now = time.monotonic()
+        self._entries[key] = (data, size, now + ttl, now + ttl + stale_ttl)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+
+# Единственный кэш ответов на процесс
+response_cache = ResponseCache()
+# Фоновые обновления устаревших записей: ключ -> задача
+_refreshing = {}
+
+def get_cache_stats():
+    """Возвращает счетчики кэша ответов TMDB и объединения запросов."""
+    stats = response_cache.stats()
+    stats['in_flight'] = len(_in_flight)
+    stats['coalesced'] = _coalesced_requests
+    return stats
+
+def _store_response(endpoint, key, data, content):
+    ttl, stale_ttl = CACHE_TTLS[_endpoint_class(endpoint)]
+    response_cache.set(key, data, len(content), ttl, stale_ttl)
+    if disk_tier is not None:
+        disk_tier.put(key, content, ttl, stale_ttl)
+
+# --- Дисковый кэш ---
+
+disk_tier = disk_cache.DiskCache(DISK_CACHE_PATH, DISK_CACHE_MAX_BYTES) if DISK_CACHE_PATH else None
+
+async def load_disk_cache():
+    """Загружает годные ответы с диска в кэш в памяти (при старте бота)."""
+    if disk_tier is None:
+        return 0
+    entries = await asyncio.to_thread(disk_tier.load)
+    for key, data, size, ttl, stale_ttl in entries:
+        response_cache.set(key, data, size, ttl, stale_ttl)
+    logger.info(f"Из дискового кэша {DISK_CACHE_PATH} загружено {len(entries)} ответов TMDB.")
+    return len(entries)
+
+async def flush_disk_cache():
+    """Записывает накопленные ответы на диск."""
+    if disk_tier is not None:
+        await disk_tier.flush()
+
+async def flush_disk_cache_job(context) -> None:
+    """Задача JobQueue для периодической записи дискового кэша."""
+    await flush_disk_cache()
+
+# --- Общий кэш нескольких процессов (см. shared_cache.py) ---
+
+async def _load_shared(endpoint, key):
+    """Возвращает свежий ответ, уже полученный другим процессом, и кладет его в кэш в памяти (или None)."""
+    entry = await shared_cache.get('tmdb', key)
+    if entry is None:
+        return None
+    blob, remaining = entry
+    ttl, stale_ttl = CACHE_TTLS[_endpoint_class(endpoint)]
+    if remaining <= stale_ttl:
+        return None # Запись уже устарела, ее обновит тот, кто первым обратится к TMDB
+    try:
+        content = zlib.decompress(blob)
+        data = json.loads(content)
+    except (zlib.error, ValueError) as e:
+        logger.warning(f"Поврежденная запись общего кэша {key}: {e}")
         return None
+    response_cache.set(key, data, len(content), remaining - stale_ttl, stale_ttl)
+    return data
+
+async def _share_response(endpoint, key, content):
+    ttl, stale_ttl = CACHE_TTLS[_endpoint_class(endpoint)]
+    await shared_cache.put('tmdb', key, zlib.compress(content), ttl + stale_ttl)
+
+# --- Вспомогательные функции ---
 
+def _prepare_params(params):
     if params is None:
         params = {}
-
     # Установка языка по умолчанию на русский, с резервным en-US
-    params.setdefault('language', 'ru-RU')
+    params.setdefault('language', DEFAULT_LANGUAGE)
+    return params
 
-    headers = {
-        "accept": "application/json",
-        "Authorization": f"Bearer {TMDB_API_KEY}"
-    }
+def _log_request_error(endpoint, e):
+    """Логирует ошибку запроса к TMDB с подробностями ответа, если он есть."""
+    logger.error(f"Ошибка API запроса для эндпоинта {endpoint}: {e}")
+    if isinstance(e, httpx.HTTPStatusError):
+        logger.error(f"URL: {e.request.url}")
+        logger.error(f"Статус код: {e.response.status_code}")
+        logger.error(f"Текст ответа: {e.response.text}")
+    else:
+        logger.error(f"URL: {BASE_URL}{endpoint}")
+
+# --- Повторы, дедлайны и автоматический выключатель ---
+
+MAX_RETRIES = int(os.getenv('TMDB_MAX_RETRIES', '3'))
+RETRY_BASE_DELAY = 0.5 # Базовая задержка экспоненциального повтора (сек.)
+RETRY_MAX_DELAY = 8.0
+REQUEST_DEADLINE = float(os.getenv('TMDB_DEADLINE', '15')) # Общий лимит времени на вызов вместе с повторами
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_FAILURE_THRESHOLD = 5 # Сколько ошибок подряд размыкают выключатель
+BREAKER_RESET_TIMEOUT = 30.0 # Через сколько секунд пропустить пробный запрос
+
+
+class _RetryableStatus(Exception):
+    """Ответ с кодом, после которого имеет смысл повторить запрос."""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для группы эндпоинтов TMDB.
+    После серии ошибок размыкается, и запросы не отправляются до истечения таймаута;
+    затем пропускается один пробный запрос, и по его итогу выключатель замыкается или снова размыкается.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас."""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open' # Пропускаем один пробный запрос
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != 'closed':
+            logger.info(f"Выключатель {self.name} замкнут, TMDB снова отвечает.")
+        self.state = 'closed'
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.error(f"Выключатель {self.name} разомкнут после {self.failures} ошибок подряд.")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Запрос отменен, не дождавшись ответа. Если это был пробный запрос, выключатель возвращается
+        в разомкнутое состояние с прежним временем, и следующий запрос сразу станет пробным.
+        """
+        if self.state == 'half_open':
+            self.state = 'open'
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected}
+
+
+# По одному выключателю на класс эндпоинтов
+_breakers = {name: CircuitBreaker(name) for name in CACHE_TTLS}
+# Отдельный выключатель фоновой загрузки каталога: ее ошибки не должны отключать /discover для пользователей
+_breakers['discover_crawl'] = CircuitBreaker('discover_crawl')
+
+def get_breaker_stats():
+    """Возвращает состояние выключателей по группам эндпоинтов."""
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+def _retry_delay(attempt, response=None):
+    """Задержка перед повтором: Retry-After от TMDB или экспоненциальная с полным джиттером."""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+def _check_response(response):
+    if response.status_code in RETRYABLE_STATUSES:
+        raise _RetryableStatus(response)
+    response.raise_for_status()  # Выбросить исключение для плохих статус-кодов (4xx)
+
+def _before_retry(endpoint, attempt, e):
+    """Логирует ошибку и возвращает задержку перед следующей попыткой."""
+    response = e.response if isinstance(e, _RetryableStatus) else None
+    delay = _retry_delay(attempt, response)
+    if response is not None and response.status_code == 429:
+        rate_limit.tmdb_limiter.pause(delay) # Притормаживаем все запросы, а не только этот
+    logger.warning(f"Запрос к {endpoint} не удался ({e}), попытка {attempt + 1}/{MAX_RETRIES + 1}. Повтор через {delay:.1f}с.")
+    return delay
+
+def _get_with_retries(endpoint, params):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = transport.get(endpoint, params)
+            _check_response(response)
+            return response
+        except (_RetryableStatus, httpx.TransportError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_before_retry(endpoint, attempt, e))
+
+async def _get_with_retries_async(endpoint, params):
+    """Первый токен ограничителя уже получен вызывающим (см. _fetch_async), повторы ждут свой."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            if attempt:
+                await rate_limit.tmdb_limiter.acquire()
+            response = await transport.get_async(endpoint, params)
+            _check_response(response)
+            return response
+        except (_RetryableStatus, httpx.TransportError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(_before_retry(endpoint, attempt, e))
+
+def _serve_while_open(endpoint, key):
+    """Ответ при разомкнутом выключателе: последний ответ из кэша или быстрый отказ."""
+    data = response_cache.peek(key)
+    if data is not None:
+        logger.warning(f"TMDB недоступен для {endpoint}, отдаю последний ответ из кэша.")
+    else:
+        logger.warning(f"TMDB недоступен для {endpoint}, запрос отклонен без обращения к API.")
+    return data
+
+def _handle_request_error(endpoint, breaker, e):
+    """Логирует ошибку и учитывает ее в выключателе (ошибки клиента 4xx не считаются сбоем TMDB)."""
+    if isinstance(e, _RetryableStatus):
+        e = httpx.HTTPStatusError(str(e), request=e.response.request, response=e.response)
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in RETRYABLE_STATUSES:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error(f"Запрос к {endpoint} не уложился в дедлайн {REQUEST_DEADLINE}с.")
+    elif isinstance(e, httpx.HTTPError):
+        _log_request_error(endpoint, e)
+    else:
+        logger.error(f"Произошла непредвиденная ошибка во время API запроса к {endpoint}: {e}")
+
+def _make_request(endpoint, params=None):
+    """Вспомогательная функция для выполнения запросов к TMDB API."""
+    if not TMDB_API_KEY:
+        logger.error("Невозможно выполнить API запрос без TMDB_API_KEY.")
+        return None
+
+    params = _prepare_params(params)
+    key = _cache_key(endpoint, params)
+    data, fresh = response_cache.get(key)
+    if fresh:
+        return data
 
-    url = f"{BASE_URL}{endpoint}"
+    # Синхронный путь не обновляет кэш в фоне: устаревшая запись просто перезапрашивается
+    breaker = _breakers[_endpoint_class(endpoint)]
+    if not breaker.allow():
+        return _serve_while_open(endpoint, key)
     try:
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()  # Выбросить исключение для плохих статус-кодов (4xx или 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка API запроса для эндпоинта {endpoint}: {e}")
-        logger.error(f"URL: {response.url if 'response' in locals() else url}")
-        logger.error(f"Статус код: {response.status_code if 'response' in locals() else 'N/A'}")
-        logger.error(f"Текст ответа: {response.text if 'response' in locals() else 'N/A'}")
+        response = _get_with_retries(endpoint, params)
+        data = response.json()
+    except Exception as e:
+        _handle_request_error(endpoint, breaker, e)
         return None
+    breaker.record_success()
+    _store_response(endpoint, key, data, response.content)
+    return data
+
+async def _fetch_async(endpoint, params, key, refresh=False, store=True, breaker=None):
+    """
+    Запрашивает эндпоинт с повторами и дедлайном и сохраняет успешный ответ в кэш.
+    Дедлайн отсчитывается с момента, когда ограничитель частоты выдал токен: ожидание в его очереди
+    (например, за сотнями фоновых запросов) не считается ошибкой TMDB.
+    Если задан общий кэш, сначала проверяет, не получил ли этот ответ другой процесс.
+    store=False - ответ нужен один раз (массовая загрузка), в кэши он не записывается.
+    breaker - свой выключатель вместо выключателя группы эндпоинтов.
+    """
+    if shared_cache.backend is not None and not refresh:
+        data = await _load_shared(endpoint, key)
+        if data is not None:
+            return data
+    breaker = breaker or _breakers[_endpoint_class(endpoint)]
+    if not breaker.allow():
+        return _serve_while_open(endpoint, key)
+    try:
+        await rate_limit.tmdb_limiter.acquire()
+        response = await asyncio.wait_for(_get_with_retries_async(endpoint, params), REQUEST_DEADLINE)
+        data = response.json()
+    except asyncio.CancelledError:
+        breaker.release() # Иначе отмененный пробный запрос оставил бы выключатель полуразомкнутым навсегда
+        raise
     except Exception as e:
-        logger.error(f"Произошла непредвиденная ошибка во время API запроса к {endpoint}: {e}")
+        _handle_request_error(endpoint, breaker, e)
         return None
+    breaker.record_success()
+    if not store:
+        return data
+    _store_response(endpoint, key, data, response.content)
+    if shared_cache.backend is not None:
+        await _share_response(endpoint, key, response.content)
+    return data
 
-# --- Функции API ---
+# --- Объединение одинаковых запросов (single-flight) ---
+# Одновременные запросы с одинаковым ключом ждут один общий запрос к TMDB.
+_in_flight = {} # ключ -> asyncio.Task
+_coalesced_requests = 0
 
-def get_api_config():
-    """Запрашивает детали конфигурации API, такие как базовые URL изображений."""
+async def _fetch_and_release(endpoint, params, key, refresh):
+    try:
+        return await _fetch_async(endpoint, params, key, refresh)
+    finally:
+        # Убираем запись сразу по завершении, чтобы следующие вызовы не получили старый результат
+        _in_flight.pop(key, None)
+
+async def _fetch_coalesced(endpoint, params, key, refresh=False):
+    """Выполняет запрос или присоединяется к уже идущему запросу с тем же ключом."""
+    global _coalesced_requests
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_fetch_and_release(endpoint, params, key, refresh))
+        _in_flight[key] = task
+    else:
+        _coalesced_requests += 1
+    # shield: отмена одного ожидающего не отменяет общий запрос для остальных
+    return await asyncio.shield(task)
+
+async def _refresh_in_background(endpoint, params, key):
+    try:
+        await _fetch_coalesced(endpoint, params, key)
+    finally:
+        _refreshing.pop(key, None)
+
+async def _make_request_async(endpoint, params=None, refresh=False):
+    """
+    Асинхронный аналог _make_request, не блокирующий цикл событий.
+    refresh=True пропускает кэш и обновляет запись; при ошибке прежняя запись остается.
+    """
+    if not TMDB_API_KEY:
+        logger.error("Невозможно выполнить API запрос без TMDB_API_KEY.")
+        return None
+
+    params = _prepare_params(params)
+    key = _cache_key(endpoint, params)
+    if refresh:
+        return _record(key, await _fetch_coalesced(endpoint, params, key, refresh=True))
+    data, fresh = response_cache.get(key)
+    if data is not None:
+        if not fresh and key not in _refreshing:
+            # Отдаем устаревший ответ сразу, обновляем в фоне
+            _refreshing[key] = asyncio.get_running_loop().create_task(
+                rate_limit.run_in_background(_refresh_in_background(endpoint, params, key))
+            )
+        return _record(key, data)
+
+    return _record(key, await _fetch_coalesced(endpoint, params, key))
+
+def _record(key, data):
+    """Записывает ответ в трассу трафика (если запись включена, см. traffic_recorder.py) и возвращает его."""
+    if traffic_recorder.recorder is not None and data is not None:
+        traffic_recorder.recorder.record_tmdb(key, data)
+    return data
+
+# --- Параметры запросов ---
+# Каждая функция возвращает (эндпоинт, параметры) и используется
+# как синхронными, так и асинхронными функциями API ниже.
+
+def _api_config_request():
     logger.info("Запрос конфигурации API.")
-    return _make_request("/configuration")
+    return "/configuration", None
 
-def get_genres():
-    """Запрашивает список официальных жанров фильмов."""
+def _genres_request():
     logger.info("Запрос списка жанров фильмов.")
-    return _make_request("/genre/movie/list")
+    return "/genre/movie/list", None
 
-def search_movies(query, page=1, include_adult=False):
-    """Ищет фильмы по названию."""
+def _search_movies_request(query, page, include_adult):
     logger.info(f"Поиск фильмов по запросу: '{query}', страница: {page}")
     params = {
         'query': query,
         'page': page,
         'include_adult': include_adult
     }
-    return _make_request("/search/movie", params=params)
+    return "/search/movie", params
 
-def discover_movies(criteria, page=1):
-    """
-    Подбирает фильмы по различным критериям.
-    'criteria' должен быть словарем параметров, таких как:
-    'with_genres', 'primary_release_year', 'vote_average.gte', и т.д.
-    """
+def _discover_movies_request(criteria, page):
     logger.info(f"Подбор фильмов по критериям: {criteria}, страница: {page}")
     params = criteria.copy() # Избегаем изменения оригинального словаря
     params['page'] = page
@@ -87,19 +661,17 @@ def discover_movies(criteria, page=1):
     params.setdefault('sort_by', 'popularity.desc')
     # Добавляем фильтр по количеству голосов
     params['vote_count.gte'] = 1000
-    return _make_request("/discover/movie", params=params)
+    return "/discover/movie", params
 
-def get_movie_details(movie_id, append_to_response=None):
-    """Получает детальную информацию по конкретному фильму."""
+def _movie_details_request(movie_id, append_to_response):
     logger.info(f"Запрос деталей для фильма ID: {movie_id}")
     endpoint = f"/movie/{movie_id}"
     params = {}
     if append_to_response:
         params['append_to_response'] = append_to_response
-    return _make_request(endpoint, params=params)
+    return endpoint, params
 
-def get_popular_movies(page=1, region=None):
-    """Получает список популярных фильмов."""
+def _popular_movies_request(page, region):
     logger.info(f"Запрос популярных фильмов, страница: {page}")
     params = {'page': page}
     if region:
@@ -108,25 +680,110 @@ def get_popular_movies(page=1, region=None):
     # Возможно, потребуется фильтровать результаты позже или использовать /discover с sort_by=popularity.desc
     # Пока оставим так и будем фильтровать позже при необходимости.
     # params['vote_count.gte'] = 1000 # Это не сработает на /movie/popular
-    return _make_request("/movie/popular", params=params)
+    return "/movie/popular", params
 
-def get_top_rated_movies(page=1, region=None):
-    """Получает список фильмов с высоким рейтингом."""
+def _top_rated_movies_request(page, region):
     logger.info(f"Запрос фильмов с высоким рейтингом, страница: {page}")
     params = {'page': page}
     if region:
         params['region'] = region
     # Добавляем фильтр по количеству голосов
     params['vote_count.gte'] = 1000
-    return _make_request("/movie/top_rated", params=params)
+    return "/movie/top_rated", params
 
-def get_upcoming_movies(page=1, region=None):
-    """Получает список скоро выходящих фильмов."""
+def _upcoming_movies_request(page, region):
     logger.info(f"Запрос скоро выходящих фильмов, страница: {page}")
     params = {'page': page}
     if region:
         params['region'] = region
-    return _make_request("/movie/upcoming", params=params)
+    return "/movie/upcoming", params
+
+# --- Функции API ---
+
+def get_api_config():
+    """Запрашивает детали конфигурации API, такие как базовые URL изображений."""
+    return _make_request(*_api_config_request())
+
+def get_genres():
+    """Запрашивает список официальных жанров фильмов."""
+    return _make_request(*_genres_request())
+
+def search_movies(query, page=1, include_adult=False):
+    """Ищет фильмы по названию."""
+    return _make_request(*_search_movies_request(query, page, include_adult))
+
+def discover_movies(criteria, page=1):
+    """
+    Подбирает фильмы по различным критериям.
+    'criteria' должен быть словарем параметров, таких как:
+    'with_genres', 'primary_release_year', 'vote_average.gte', и т.д.
+    """
+    return _make_request(*_discover_movies_request(criteria, page))
+
+def get_movie_details(movie_id, append_to_response=None):
+    """Получает детальную информацию по конкретному фильму."""
+    return _make_request(*_movie_details_request(movie_id, append_to_response))
+
+def get_popular_movies(page=1, region=None):
+    """Получает список популярных фильмов."""
+    return _make_request(*_popular_movies_request(page, region))
+
+def get_top_rated_movies(page=1, region=None):
+    """Получает список фильмов с высоким рейтингом."""
+    return _make_request(*_top_rated_movies_request(page, region))
+
+def get_upcoming_movies(page=1, region=None):
+    """Получает список скоро выходящих фильмов."""
+    return _make_request(*_upcoming_movies_request(page, region))
+
+# --- Асинхронные функции API ---
+# Используются обработчиками бота, чтобы запросы к TMDB не блокировали цикл событий.
+# refresh=True принудительно обновляет запись кэша (используется фоновым обновлением).
+
+async def get_api_config_async(refresh=False):
+    """Асинхронная версия get_api_config."""
+    return await _make_request_async(*_api_config_request(), refresh=refresh)
+
+async def get_genres_async(refresh=False):
+    """Асинхронная версия get_genres."""
+    return await _make_request_async(*_genres_request(), refresh=refresh)
+
+async def search_movies_async(query, page=1, include_adult=False, refresh=False):
+    """Асинхронная версия search_movies."""
+    return await _make_request_async(*_search_movies_request(query, page, include_adult), refresh=refresh)
+
+async def discover_movies_async(criteria, page=1, refresh=False):
+    """Асинхронная версия discover_movies."""
+    return await _make_request_async(*_discover_movies_request(criteria, page), refresh=refresh)
+
+async def crawl_discover_movies_async(criteria, page=1):
+    """
+    Страница подбора для фоновой загрузки каталога (discover_catalog.py): с повторами и
+    ограничением частоты, но без записи в кэши, чтобы сотни страниц не вытеснили ответы для пользователей.
+    """
+    if not TMDB_API_KEY:
+        logger.error("Невозможно выполнить API запрос без TMDB_API_KEY.")
+        return None
+    endpoint, params = _discover_movies_request(criteria, page)
+    params = _prepare_params(params)
+    return await _fetch_async(endpoint, params, _cache_key(endpoint, params), refresh=True, store=False,
+                              breaker=_breakers['discover_crawl'])
+
+async def get_movie_details_async(movie_id, append_to_response=None, refresh=False):
+    """Асинхронная версия get_movie_details."""
+    return await _make_request_async(*_movie_details_request(movie_id, append_to_response), refresh=refresh)
+
+async def get_popular_movies_async(page=1, region=None, refresh=False):
+    """Асинхронная версия get_popular_movies."""
+    return await _make_request_async(*_popular_movies_request(page, region), refresh=refresh)
+
+async def get_top_rated_movies_async(page=1, region=None, refresh=False):
+    """Асинхронная версия get_top_rated_movies."""
+    return await _make_request_async(*_top_rated_movies_request(page, region), refresh=refresh)
+
+async def get_upcoming_movies_async(page=1, region=None, refresh=False):
+    """Асинхронная версия get_upcoming_movies."""
+    return await _make_request_async(*_upcoming_movies_request(page, region), refresh=refresh)
 
 # Пример использования (для целей тестирования)
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+import os
+import hmac
+import gzip
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Запись реального трафика для воспроизведения (replay.py). Включается переменной TRAFFIC_RECORD_FILE.
+# Трасса - JSON-lines (или .jsonl.gz), по одной записи на строку:
+#     {"type": "meta", ...}                                  - начало записи
+#     {"type": "update", "ts": ..., "update": {...}}         - входящее обновление
+#     {"type": "tmdb", "ts": ..., "key": ..., "body": {...}}  - ответ TMDB (один раз на ключ кэша)
+#     {"type": "handle", "handle": ..., "query": ...}        - длинный поисковый запрос из кнопок пагинации
+# ID пользователей и чатов заменяются псевдонимами (HMAC с секретом TRAFFIC_RECORD_SALT или случайным),
+# имена, фамилии, username и названия чатов удаляются. Тексты сообщений сохраняются - в них поисковые запросы.
+RECORD_FILE = os.getenv('TRAFFIC_RECORD_FILE', '')
+RECORD_SALT = os.getenv('TRAFFIC_RECORD_SALT', '') # Одинаковый для всех процессов, чтобы псевдонимы совпадали
+FLUSH_INTERVAL = 1.0 # Как часто сбрасывать буфер на диск (сек.)
+_STOP = object() # Сигнал потоку записи: дописать очередь и закрыть файл
+TRACE_VERSION = 1
+
+_CHAT_TYPES = {'private', 'group', 'supergroup', 'channel', 'sender'}
+_PERSONAL_FIELDS = ('last_name', 'username', 'title', 'bio', 'phone_number', 'active_usernames')
+
+
+def _process_path(path):
+    """Несколько процессов бота пишут каждый в свой файл: trace.<pid>.jsonl."""
+    if int(os.getenv('BOT_WORKERS', '1')) <= 1:
+        return path
+    name, ext = path, ''
+    for suffix in ('.jsonl.gz', '.jsonl', '.gz'):
+        if path.endswith(suffix):
+            name, ext = path[:-len(suffix)], suffix
+            break
+    return f"{name}.{os.getpid()}{ext}"
+
+
+class TrafficRecorder:
+    """
+    Пишет обновления и ответы TMDB в трассу. Цикл событий только ставит записи в очередь,
+    а кодирование, сжатие и запись в файл выполняет отдельный поток (запускается при первой записи).
+    """
+
+    def __init__(self, path, salt=RECORD_SALT):
+        self.path = _process_path(path)
+        self._secret = salt.encode('utf-8') if salt else os.urandom(16)
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._tmdb_keys = set()
+        self._handles = set()
+        self.updates = 0
+        self.responses = 0
+
+    def _write(self, record):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer, name='traffic-recorder', daemon=True)
+            self._thread.start()
+        self._queue.put(record)
+
+    def _writer(self):
+        opener = gzip.open if self.path.endswith('.gz') else open
+        with opener(self.path, 'at', encoding='utf-8') as f:
+            self._write_line(f, {'type': 'meta', 'version': TRACE_VERSION, 'ts': time.time(), 'pid': os.getpid()})
+            while True:
+                try:
+                    record = self._queue.get(timeout=FLUSH_INTERVAL)
+                except queue.Empty:
+                    f.flush() # Очередь опустела - сбрасываем буфер, чтобы трасса не отставала от работы бота
+                    continue
+                if record is _STOP:
+                    break
+                self._write_line(f, record)
+
+    @staticmethod
+    def _write_line(f, record):
+        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def pseudonym(self, value):
+        """Постоянный для записи псевдоним ID (знак сохраняется: у групп ID отрицательные)."""
+        digest = hmac.new(self._secret, str(abs(value)).encode('ascii'), hashlib.sha256).digest()
+        pseudonym = int.from_bytes(digest[:5], 'big') + 1
+        return -pseudonym if value < 0 else pseudonym
+
+    def anonymize(self, data):
+        """Заменяет ID пользователей и чатов псевдонимами и удаляет личные поля (на месте)."""
+        if isinstance(data, list):
+            for item in data:
+                self.anonymize(item)
+            return data
+        if not isinstance(data, dict):
+            return data
+        is_user = 'first_name' in data and 'is_bot' in data
+        is_chat = data.get('type') in _CHAT_TYPES and 'id' in data
+        if (is_user and not data['is_bot']) or is_chat:
+            data['id'] = self.pseudonym(data['id'])
+            for field in _PERSONAL_FIELDS:
+                data.pop(field, None)
+            if 'first_name' in data:
+                data['first_name'] = 'U'
+        if 'chat_instance' in data:
+            data['chat_instance'] = hmac.new(self._secret, data['chat_instance'].encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+        for key in ('contact', 'location', 'venue'):
+            data.pop(key, None)
+        for value in data.values():
+            if isinstance(value, (dict, list)):
+                self.anonymize(value)
+        return data
+
+    def record_update(self, update):
+        self.updates += 1
+        self._write({'type': 'update', 'ts': time.time(), 'update': self.anonymize(update.to_dict())})
+
+    def record_tmdb(self, key, data):
+        """Записывает ответ TMDB, если ответа с таким ключом в трассе еще нет."""
+        if key in self._tmdb_keys:
+            return
+        self._tmdb_keys.add(key)
+        self.responses += 1
+        self._write({'type': 'tmdb', 'ts': time.time(), 'key': key, 'body': data})
+
+    def record_handle(self, handle, query):
+        """
+        Записывает поисковый запрос, который кнопки пагинации передают хэшем (см. pagination_codec.py):
+        хэши могли появиться до начала записи, а при воспроизведении таблицы хэшей с этой машины нет.
+        """
+        if handle in self._handles:
+            return
+        self._handles.add(handle)
+        self._write({'type': 'handle', 'handle': handle, 'query': query})
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            logger.info(f"Трасса трафика {self.path}: {self.updates} обновлений, {self.responses} ответов TMDB.")
+
+
+# Единственный экземпляр на процесс (None - запись выключена)
+recorder = TrafficRecorder(RECORD_FILE) if RECORD_FILE else None
+
+async def record_update(update, context) -> None:
+    """Обработчик TypeHandler (группа -1): записывает каждое обновление до остальных обработчиков."""
+    if recorder is not None:
+        recorder.record_update(update)
+
+def record_handle(handle, query):
+    if recorder is not None:
+        recorder.record_handle(handle, query)
+
+def close():
+    if recorder is not None:
+        recorder.close()
@@ -0,0 +1,100 @@
+import os
+import asyncio
+import logging
+import contextlib
+from telegram.ext import BaseUpdateProcessor
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений может обрабатываться одновременно (во всех чатах вместе)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+UNLIMITED_UPDATES = 2 ** 31 - 1 # Лимит для семафора BaseUpdateProcessor (см. ChatOrderedUpdateProcessor)
+
+
+def ordering_key(update):
+    """Ключ упорядочивания: чат обновления, а если его нет - пользователь."""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return ('chat', chat.id)
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return ('user', user.id)
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления разных чатов параллельно, а обновления одного чата - строго по очереди.
+    Пагинация (редактирование или удаление и переотправка сообщения) рассчитывает на то,
+    что нажатия в одном чате обрабатываются в порядке поступления.
+    Обновление занимает место в общем лимите только когда подходит его очередь в чате,
+    поэтому один "шумный" чат не блокирует остальные.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        # Семафор базового класса охватывает и обновления, ждущие очереди своего чата, поэтому он не ограничивает
+        # (current_concurrent_updates - все принятые обновления), а общий лимит - свой семафор внутри очереди чата
+        super().__init__(UNLIMITED_UPDATES)
+        self.limit = max_concurrent_updates
+        self._global_limit = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {} # ключ -> [asyncio.Lock, число ожидающих и выполняемых обновлений]
+        self.active = 0
+        self.processed = 0
+        self.max_chat_depth = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @contextlib.asynccontextmanager
+    async def ordered(self, key):
+        """
+        Очередь чата (ключ - ordering_key): код внутри выполняется после всего, что раньше встало в очередь
+        этого чата, и до того, что встанет позже. Нужна и работе вне обработчиков, например отложенной перерисовке.
+        """
+        if key is None:
+            yield
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.max_chat_depth = max(self.max_chat_depth, entry[1])
+        try:
+            # asyncio.Lock выдается в порядке ожидания, поэтому порядок в чате сохраняется
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        async with self.ordered(ordering_key(update)):
+            async with self._global_limit:
+                self.active += 1
+                try:
+                    await self.run_update(update, coroutine)
+                finally:
+                    self.active -= 1
+                    self.processed += 1
+
+    async def run_update(self, update, coroutine) -> None:
+        """Обработка обновления, когда подошла его очередь (переопределяется для замеров, см. benchmark.py)."""
+        await coroutine
+
+    def get_stats(self):
+        """Глубина очередей: сколько обновлений выполняется и сколько ждет своей очереди."""
+        pending = sum(count for _, count in self._chats.values())
+        return {
+            'active': self.active,
+            'queued': max(pending - self.active, 0),
+            'accepted': self.current_concurrent_updates,
+            'chats_with_pending': len(self._chats),
+            'max_chat_depth': self.max_chat_depth,
+            'processed': self.processed,
+            'max_concurrent_updates': self.limit,
+        }